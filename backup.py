@@ -0,0 +1,175 @@
+# backup.py
+import os
+import sys
+import glob
+import gzip
+import json
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+
+import banco
+import repositorio
+
+# ---------------- Configurações ----------------
+BACKUP_DIR = os.path.join(banco.BASE_DIR, "backups")
+MANTER_BACKUPS = 10
+
+# Cópia incremental: poucas páginas por passo e uma pausa entre passos, para
+# que quem está gravando no banco nunca espere muito
+PAGINAS_POR_PASSO = 256
+PAUSA_ENTRE_PASSOS = 0.005
+
+# Cada escrita de outra conexão reinicia a cópia incremental. Se o banco
+# mudar mais vezes que isso, o restante é copiado num passo só.
+MAX_REINICIOS = 20
+
+PREFIXO = "estoque-"
+EXTENSAO = ".db.gz"
+
+
+class _Reiniciar(Exception):
+    pass
+
+
+def _copiar(origem, destino, passo_a_passo=True, progresso=None):
+    # Copia origem -> destino pela API de backup online do SQLite.
+    # Devolve quantas vezes a cópia recomeçou por escrita concorrente.
+    reinicios = [0]
+    restante_anterior = [None]
+
+    def ao_progredir(status, restante, total):
+        if restante_anterior[0] is not None and restante > restante_anterior[0]:
+            reinicios[0] += 1
+            if reinicios[0] > MAX_REINICIOS:
+                raise _Reiniciar()
+        restante_anterior[0] = restante
+        if progresso:
+            progresso(total - restante, total)
+        time.sleep(PAUSA_ENTRE_PASSOS)
+
+    src = sqlite3.connect(origem)
+    dst = sqlite3.connect(destino)
+    try:
+        if passo_a_passo:
+            try:
+                src.backup(dst, pages=PAGINAS_POR_PASSO, progress=ao_progredir)
+                return reinicios[0]
+            except _Reiniciar:
+                pass
+        src.backup(dst, pages=-1)
+        return reinicios[0]
+    finally:
+        dst.close()
+        src.close()
+
+
+def _verificar(caminho):
+    conn = sqlite3.connect(caminho)
+    try:
+        resultado = conn.execute("PRAGMA quick_check").fetchone()[0]
+    finally:
+        conn.close()
+    if resultado != "ok":
+        raise ValueError(f"Cópia corrompida: {resultado}")
+
+
+def listar_backups(destino_dir=BACKUP_DIR):
+    # Do mais recente para o mais antigo: (caminho, tamanho em bytes, data)
+    arquivos = glob.glob(os.path.join(destino_dir, PREFIXO + "*" + EXTENSAO))
+    arquivos.sort(reverse=True)
+    return [(a, os.path.getsize(a), datetime.fromtimestamp(os.path.getmtime(a))) for a in arquivos]
+
+
+def _rotacionar(destino_dir, manter):
+    for caminho, _tam, _data in listar_backups(destino_dir)[manter:]:
+        os.remove(caminho)
+
+
+def _registrar(destino_dir, info):
+    with open(os.path.join(destino_dir, "historico.jsonl"), "a", encoding="utf-8") as f:
+        f.write(json.dumps(info, ensure_ascii=False) + "\n")
+
+
+def fazer_backup(destino_dir=BACKUP_DIR, manter=MANTER_BACKUPS, verificar=True, progresso=None, sufixo=""):
+    # Snapshot consistente do banco em uso, comprimido com gzip, mantendo só
+    # os `manter` mais recentes. Devolve um dict com arquivo, duração e tamanhos.
+    os.makedirs(destino_dir, exist_ok=True)
+    inicio = time.monotonic()
+    # com microssegundos: o backup de segurança do restaurar_backup pode cair
+    # no mesmo segundo de outro e não pode sobrescrevê-lo
+    carimbo = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    nome = f"{PREFIXO}{carimbo}{sufixo}"
+    tmp = os.path.join(destino_dir, f".{nome}.db.tmp")
+    final = os.path.join(destino_dir, nome + EXTENSAO)
+
+    try:
+        reinicios = _copiar(banco.DB_PATH, tmp, progresso=progresso)
+        if verificar:
+            _verificar(tmp)
+        tamanho_banco = os.path.getsize(tmp)
+        parcial = final + ".part"
+        with open(tmp, "rb") as entrada, gzip.open(parcial, "wb", compresslevel=6) as saida:
+            shutil.copyfileobj(entrada, saida, 1024 * 1024)
+        os.replace(parcial, final)
+    finally:
+        for caminho in (tmp, final + ".part"):
+            if os.path.exists(caminho):
+                os.remove(caminho)
+
+    _rotacionar(destino_dir, manter)
+    info = {
+        "arquivo": final,
+        "data_hora": datetime.now().isoformat(sep=" ", timespec="seconds"),
+        "duracao_s": round(time.monotonic() - inicio, 3),
+        "tamanho_banco": tamanho_banco,
+        "tamanho_arquivo": os.path.getsize(final),
+        "reinicios": reinicios,
+    }
+    _registrar(destino_dir, info)
+    return info
+
+
+def restaurar_backup(arquivo, destino_dir=BACKUP_DIR):
+    # Substitui o conteúdo do banco em uso pelo snapshot, também pela API de
+    # backup (numa transação só no destino). Antes guarda o estado atual.
+    os.makedirs(destino_dir, exist_ok=True)
+    tmp = os.path.join(destino_dir, ".restaurar.db.tmp")
+    try:
+        with gzip.open(arquivo, "rb") as entrada, open(tmp, "wb") as saida:
+            shutil.copyfileobj(entrada, saida, 1024 * 1024)
+        _verificar(tmp)
+        seguranca = fazer_backup(destino_dir, manter=MANTER_BACKUPS + 1, sufixo="-antes-de-restaurar")
+        _copiar(tmp, banco.DB_PATH, passo_a_passo=False)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    _registrar(destino_dir, {
+        "restaurado": arquivo,
+        "data_hora": datetime.now().isoformat(sep=" ", timespec="seconds"),
+        "copia_anterior": seguranca["arquivo"],
+    })
+    return seguranca
+
+
+def formatar_tamanho(n):
+    for unidade in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unidade == "GB":
+            return f"{n:.0f} {unidade}" if unidade == "B" else f"{n:.1f} {unidade}"
+        n /= 1024
+
+
+# ---------------- Linha de comando ----------------
+if __name__ == "__main__":
+    # python backup.py                -> faz um backup (para agendar no cron/Agendador)
+    # python backup.py --listar       -> lista os backups existentes
+    repositorio.usar_sqlite("backup.py")
+    if "--listar" in sys.argv:
+        for caminho, tamanho, data in listar_backups():
+            print(f"{data:%Y-%m-%d %H:%M:%S}  {formatar_tamanho(tamanho):>10}  {caminho}")
+    else:
+        info = fazer_backup()
+        print(f"Backup gravado em {info['arquivo']} "
+              f"({formatar_tamanho(info['tamanho_banco'])} -> {formatar_tamanho(info['tamanho_arquivo'])}, "
+              f"{info['duracao_s']:.1f}s)")
@@ -0,0 +1,1227 @@
+# banco.py
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+import custos
+import duplicados
+
+# ---------------- Configurações ----------------
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+DB_PATH = os.path.join(BASE_DIR, "estoque.db")
+
+DEFAULT_ADMIN_USER = "admin"
+DEFAULT_ADMIN_PASS = "123"
+
+LOCAL_PADRAO = "Depósito Central"
+TIPOS_LOCAL = ("loja", "deposito")
+
+# Categorias com controle de lote/validade (saídas alocadas por FEFO)
+CATEGORIAS_COM_LOTE = ("Alimentos", "Higiene Pessoal")
+
+# ---------------- Banco de Dados ----------------
+def get_conn():
+    return sqlite3.connect(DB_PATH)
+
+SQL_MOVIMENTACOES = """
+    CREATE TABLE IF NOT EXISTS movimentacoes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        produto_id INTEGER NOT NULL,
+        quantidade INTEGER NOT NULL,
+        tipo TEXT CHECK(tipo IN ('entrada','saida')) NOT NULL,
+        usuario TEXT,
+        data_hora TEXT NOT NULL,
+        observacao TEXT,
+        FOREIGN KEY(produto_id) REFERENCES produtos(id)
+    )
+"""
+
+def init_db(criar_admin=True):
+    conn = get_conn()
+    cur = conn.cursor()
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS usuarios (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        nome TEXT UNIQUE NOT NULL,
+        senha TEXT NOT NULL,
+        cargo TEXT CHECK(cargo IN ('administrador','funcionario')) NOT NULL
+    )
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS produtos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        nome TEXT NOT NULL,
+        categoria TEXT NOT NULL,
+        quantidade INTEGER CHECK(quantidade >= 0) NOT NULL DEFAULT 0,
+        preco_unitario REAL CHECK(preco_unitario >= 0) NOT NULL DEFAULT 0.0,
+        fornecedor TEXT
+    )
+    """)
+
+    # Tabela de histórico de movimentações (entradas/saídas)
+    cur.execute(SQL_MOVIMENTACOES)
+
+    # Cria admin padrão caso não exista (o dashboard cria o seu, com senha em hash)
+    cur.execute("SELECT id FROM usuarios WHERE nome = ?", (DEFAULT_ADMIN_USER,))
+    if criar_admin and not cur.fetchone():
+        cur.execute(
+            "INSERT INTO usuarios (nome, senha, cargo) VALUES (?, ?, ?)",
+            (DEFAULT_ADMIN_USER, DEFAULT_ADMIN_PASS, "administrador")
+        )
+
+    conn.commit()
+    aplicar_migracoes(conn)
+    conn.close()
+
+# ---------------- Migrações ----------------
+# Cada migração roda uma única vez, na ordem, e a versão aplicada fica em
+# PRAGMA user_version. Tanto o app Tkinter quanto o dashboard chamam
+# aplicar_migracoes() depois de criar suas tabelas base.
+def _colunas(cur, tabela):
+    cur.execute(f"PRAGMA table_info({tabela})")
+    return {row[1] for row in cur.fetchall()}
+
+def _adicionar_coluna(cur, tabela, coluna, definicao):
+    if coluna not in _colunas(cur, tabela):
+        cur.execute(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {definicao}")
+
+def _migracao_locais(cur):
+    # O dashboard pode ter criado o banco sem a tabela de movimentações
+    cur.execute(SQL_MOVIMENTACOES)
+
+    cur.execute("""
+    CREATE TABLE locais (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        nome TEXT UNIQUE NOT NULL,
+        tipo TEXT CHECK(tipo IN ('loja','deposito')) NOT NULL DEFAULT 'loja'
+    )
+    """)
+    cur.execute("INSERT INTO locais (nome, tipo) VALUES (?, 'deposito')", (LOCAL_PADRAO,))
+    local_padrao = cur.lastrowid
+
+    # Estoque por (produto, local). produtos.quantidade passa a ser o total da
+    # rede e é mantido pelos triggers abaixo.
+    cur.execute("""
+    CREATE TABLE estoque_local (
+        produto_id INTEGER NOT NULL REFERENCES produtos(id),
+        local_id INTEGER NOT NULL REFERENCES locais(id),
+        quantidade INTEGER CHECK(quantidade >= 0) NOT NULL DEFAULT 0,
+        PRIMARY KEY (produto_id, local_id)
+    ) WITHOUT ROWID
+    """)
+    cur.execute("CREATE INDEX idx_estoque_local_local ON estoque_local (local_id, produto_id)")
+
+    # Agregados por local: uma linha por local, atualizada incrementalmente,
+    # para que totais da rede não precisem varrer estoque_local.
+    cur.execute("""
+    CREATE TABLE totais_local (
+        local_id INTEGER PRIMARY KEY REFERENCES locais(id),
+        quantidade INTEGER NOT NULL DEFAULT 0,
+        valor REAL NOT NULL DEFAULT 0.0,
+        produtos INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+
+    _adicionar_coluna(cur, "movimentacoes", "local_id", "INTEGER REFERENCES locais(id)")
+    _adicionar_coluna(cur, "movimentacoes", "transferencia_id", "INTEGER")
+    cur.execute("UPDATE movimentacoes SET local_id = ? WHERE local_id IS NULL", (local_padrao,))
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_movimentacoes_data ON movimentacoes (data_hora)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_movimentacoes_local ON movimentacoes (local_id, data_hora)")
+
+    # Estoque já existente vai todo para o local padrão (antes dos triggers,
+    # senão produtos.quantidade seria somado em dobro)
+    cur.execute("""
+        INSERT INTO estoque_local (produto_id, local_id, quantidade)
+        SELECT id, ?, quantidade FROM produtos WHERE quantidade > 0
+    """, (local_padrao,))
+    cur.execute("""
+        INSERT INTO totais_local (local_id, quantidade, valor, produtos)
+        SELECT ?, COALESCE(SUM(quantidade), 0), COALESCE(SUM(quantidade * preco_unitario), 0), COUNT(*)
+        FROM produtos WHERE quantidade > 0
+    """, (local_padrao,))
+
+    cur.execute("""
+    CREATE TRIGGER trg_locais_insert AFTER INSERT ON locais BEGIN
+        INSERT INTO totais_local (local_id) VALUES (NEW.id);
+    END
+    """)
+    cur.execute("""
+    CREATE TRIGGER trg_estoque_local_insert AFTER INSERT ON estoque_local BEGIN
+        UPDATE produtos SET quantidade = quantidade + NEW.quantidade WHERE id = NEW.produto_id;
+        UPDATE totais_local
+        SET quantidade = quantidade + NEW.quantidade,
+            valor = valor + NEW.quantidade * COALESCE((SELECT preco_unitario FROM produtos WHERE id = NEW.produto_id), 0),
+            produtos = produtos + (NEW.quantidade > 0)
+        WHERE local_id = NEW.local_id;
+    END
+    """)
+    cur.execute("""
+    CREATE TRIGGER trg_estoque_local_update AFTER UPDATE OF quantidade ON estoque_local BEGIN
+        UPDATE produtos SET quantidade = quantidade + NEW.quantidade - OLD.quantidade WHERE id = NEW.produto_id;
+        UPDATE totais_local
+        SET quantidade = quantidade + NEW.quantidade - OLD.quantidade,
+            valor = valor + (NEW.quantidade - OLD.quantidade) * COALESCE((SELECT preco_unitario FROM produtos WHERE id = NEW.produto_id), 0),
+            produtos = produtos + (NEW.quantidade > 0) - (OLD.quantidade > 0)
+        WHERE local_id = NEW.local_id;
+    END
+    """)
+    cur.execute("""
+    CREATE TRIGGER trg_estoque_local_delete AFTER DELETE ON estoque_local BEGIN
+        UPDATE produtos SET quantidade = quantidade - OLD.quantidade WHERE id = OLD.produto_id;
+        UPDATE totais_local
+        SET quantidade = quantidade - OLD.quantidade,
+            valor = valor - OLD.quantidade * COALESCE((SELECT preco_unitario FROM produtos WHERE id = OLD.produto_id), 0),
+            produtos = produtos - (OLD.quantidade > 0)
+        WHERE local_id = OLD.local_id;
+    END
+    """)
+    cur.execute("""
+    CREATE TRIGGER trg_produtos_preco AFTER UPDATE OF preco_unitario ON produtos
+    WHEN NEW.preco_unitario <> OLD.preco_unitario BEGIN
+        UPDATE totais_local
+        SET valor = valor + (NEW.preco_unitario - OLD.preco_unitario) *
+            (SELECT e.quantidade FROM estoque_local e WHERE e.produto_id = NEW.id AND e.local_id = totais_local.local_id)
+        WHERE local_id IN (SELECT local_id FROM estoque_local WHERE produto_id = NEW.id);
+    END
+    """)
+    # Quando o produto some, o preço já não está disponível para o trigger de
+    # estoque_local (que então desconta valor 0); por isso o valor é
+    # descontado aqui, com OLD.preco_unitario, antes de apagar as linhas.
+    cur.execute("""
+    CREATE TRIGGER trg_produtos_delete AFTER DELETE ON produtos BEGIN
+        UPDATE totais_local
+        SET valor = valor - OLD.preco_unitario *
+            (SELECT e.quantidade FROM estoque_local e WHERE e.produto_id = OLD.id AND e.local_id = totais_local.local_id)
+        WHERE local_id IN (SELECT local_id FROM estoque_local WHERE produto_id = OLD.id);
+        DELETE FROM estoque_local WHERE produto_id = OLD.id;
+    END
+    """)
+
+def _migracao_codigo_barras(cur):
+    _adicionar_coluna(cur, "produtos", "codigo_barras", "TEXT")
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_produtos_codigo_barras
+        ON produtos (codigo_barras) WHERE codigo_barras IS NOT NULL
+    """)
+
+def _migracao_lotes(cur):
+    # validade em texto AAAA-MM-DD, que ordena igual à data
+    cur.execute("""
+    CREATE TABLE lotes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        produto_id INTEGER NOT NULL REFERENCES produtos(id),
+        local_id INTEGER NOT NULL REFERENCES locais(id),
+        codigo TEXT,
+        validade TEXT NOT NULL,
+        quantidade INTEGER CHECK(quantidade >= 0) NOT NULL DEFAULT 0
+    )
+    """)
+    # FEFO: lotes com saldo de um produto no local, já na ordem de validade
+    cur.execute("""
+        CREATE INDEX idx_lotes_fefo ON lotes (produto_id, local_id, validade)
+        WHERE quantidade > 0
+    """)
+    # Relatório "vence em N dias": varredura de intervalo por validade
+    cur.execute("CREATE INDEX idx_lotes_validade ON lotes (validade) WHERE quantidade > 0")
+
+    # Quais lotes cada movimentação consumiu/abasteceu (uma saída pode
+    # atravessar vários lotes)
+    cur.execute("""
+    CREATE TABLE movimentacao_lotes (
+        movimentacao_id INTEGER NOT NULL REFERENCES movimentacoes(id),
+        lote_id INTEGER NOT NULL REFERENCES lotes(id),
+        quantidade INTEGER NOT NULL,
+        PRIMARY KEY (movimentacao_id, lote_id)
+    ) WITHOUT ROWID
+    """)
+    cur.execute("CREATE INDEX idx_movimentacao_lotes_lote ON movimentacao_lotes (lote_id)")
+
+    cur.execute("""
+    CREATE TRIGGER trg_produtos_delete_lotes AFTER DELETE ON produtos BEGIN
+        DELETE FROM lotes WHERE produto_id = OLD.id;
+    END
+    """)
+
+def _migracao_versao_produto(cur):
+    # Versão da linha para o controle otimista em atualizar_produto
+    _adicionar_coluna(cur, "produtos", "versao", "INTEGER NOT NULL DEFAULT 0")
+
+def _migracao_previsoes(cur):
+    # Índice parcial cobrindo só as saídas de venda (sem transferências): a
+    # série diária da previsão é lida sem tocar a tabela
+    cur.execute("""
+        CREATE INDEX idx_movimentacoes_saidas ON movimentacoes (data_hora, produto_id, quantidade)
+        WHERE tipo = 'saida' AND transferencia_id IS NULL
+    """)
+    # Resultado da previsão noturna (previsao.py), lido pelo dashboard
+    cur.execute("""
+    CREATE TABLE previsoes (
+        produto_id INTEGER PRIMARY KEY REFERENCES produtos(id),
+        gerado_em TEXT NOT NULL,
+        horizonte_dias INTEGER NOT NULL,
+        demanda_horizonte REAL NOT NULL,
+        demanda_diaria REAL NOT NULL,
+        modelo TEXT NOT NULL,
+        erro_medio REAL
+    )
+    """)
+
+def _migracao_custos(cur):
+    # Saldos de valoração mantidos por custos.py a cada movimentação
+    cur.execute("""
+    CREATE TABLE custo_produto (
+        produto_id INTEGER PRIMARY KEY REFERENCES produtos(id),
+        quantidade INTEGER NOT NULL DEFAULT 0,
+        custo_medio REAL NOT NULL DEFAULT 0.0,
+        valor_fifo REAL NOT NULL DEFAULT 0.0
+    )
+    """)
+    cur.execute("""
+    CREATE TABLE camadas_fifo (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        produto_id INTEGER NOT NULL REFERENCES produtos(id),
+        movimentacao_id INTEGER REFERENCES movimentacoes(id),
+        data_hora TEXT,
+        quantidade_restante INTEGER NOT NULL,
+        custo_unitario REAL NOT NULL
+    )
+    """)
+    # Só as camadas com saldo, na ordem de chegada
+    cur.execute("""
+        CREATE INDEX idx_camadas_fifo_abertas ON camadas_fifo (produto_id, id)
+        WHERE quantidade_restante > 0
+    """)
+    # Totais da rede numa linha só, para o relatório não somar produto a produto
+    cur.execute("""
+    CREATE TABLE custo_total (
+        id INTEGER PRIMARY KEY CHECK(id = 1),
+        valor_medio REAL NOT NULL DEFAULT 0.0,
+        valor_fifo REAL NOT NULL DEFAULT 0.0,
+        cmv_medio REAL NOT NULL DEFAULT 0.0,
+        cmv_fifo REAL NOT NULL DEFAULT 0.0
+    )
+    """)
+
+    _adicionar_coluna(cur, "movimentacoes", "custo_unitario", "REAL")
+    _adicionar_coluna(cur, "movimentacoes", "cmv_medio", "REAL")
+    _adicionar_coluna(cur, "movimentacoes", "cmv_fifo", "REAL")
+
+    # Sem custo de compra registrado até aqui, o estoque existente abre com
+    # o preço unitário como custo (uma camada de saldo inicial por produto)
+    cur.execute("""
+        INSERT INTO custo_produto (produto_id, quantidade, custo_medio, valor_fifo)
+        SELECT id, quantidade, preco_unitario, quantidade * preco_unitario FROM produtos WHERE quantidade > 0
+    """)
+    cur.execute("""
+        INSERT INTO camadas_fifo (produto_id, data_hora, quantidade_restante, custo_unitario)
+        SELECT id, NULL, quantidade, preco_unitario FROM produtos WHERE quantidade > 0
+    """)
+    cur.execute("""
+        INSERT INTO custo_total (id, valor_medio, valor_fifo)
+        SELECT 1, COALESCE(SUM(quantidade * custo_medio), 0), COALESCE(SUM(valor_fifo), 0) FROM custo_produto
+    """)
+
+    cur.execute("""
+    CREATE TRIGGER trg_custo_produto_insert AFTER INSERT ON custo_produto BEGIN
+        UPDATE custo_total
+        SET valor_medio = valor_medio + NEW.quantidade * NEW.custo_medio,
+            valor_fifo = valor_fifo + NEW.valor_fifo
+        WHERE id = 1;
+    END
+    """)
+    cur.execute("""
+    CREATE TRIGGER trg_custo_produto_update AFTER UPDATE ON custo_produto BEGIN
+        UPDATE custo_total
+        SET valor_medio = valor_medio + NEW.quantidade * NEW.custo_medio - OLD.quantidade * OLD.custo_medio,
+            valor_fifo = valor_fifo + NEW.valor_fifo - OLD.valor_fifo
+        WHERE id = 1;
+    END
+    """)
+    cur.execute("""
+    CREATE TRIGGER trg_custo_produto_delete AFTER DELETE ON custo_produto BEGIN
+        UPDATE custo_total
+        SET valor_medio = valor_medio - OLD.quantidade * OLD.custo_medio,
+            valor_fifo = valor_fifo - OLD.valor_fifo
+        WHERE id = 1;
+    END
+    """)
+    cur.execute("""
+    CREATE TRIGGER trg_produtos_delete_custos AFTER DELETE ON produtos BEGIN
+        DELETE FROM custo_produto WHERE produto_id = OLD.id;
+        DELETE FROM camadas_fifo WHERE produto_id = OLD.id;
+    END
+    """)
+
+def _migracao_trigramas(cur):
+    # Índice invertido de trigramas dos nomes (duplicados.py): cada trigrama
+    # aponta para os produtos que o contêm, já agrupados pela chave primária
+    cur.execute("""
+    CREATE TABLE nomes_produto (
+        produto_id INTEGER PRIMARY KEY REFERENCES produtos(id),
+        nome_normalizado TEXT NOT NULL,
+        n_trigramas INTEGER NOT NULL
+    )
+    """)
+    cur.execute("""
+    CREATE TABLE trigramas (
+        trigrama TEXT NOT NULL,
+        produto_id INTEGER NOT NULL REFERENCES produtos(id),
+        PRIMARY KEY (trigrama, produto_id)
+    ) WITHOUT ROWID
+    """)
+    cur.execute("CREATE INDEX idx_trigramas_produto ON trigramas (produto_id)")
+    cur.execute("""
+    CREATE TRIGGER trg_produtos_delete_trigramas AFTER DELETE ON produtos BEGIN
+        DELETE FROM trigramas WHERE produto_id = OLD.id;
+        DELETE FROM nomes_produto WHERE produto_id = OLD.id;
+    END
+    """)
+    # Registro das mesclagens (também avisa os snapshots de que movimentações
+    # antigas mudaram de produto)
+    cur.execute("""
+    CREATE TABLE mesclagens (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        produto_mantido INTEGER NOT NULL,
+        produto_removido INTEGER NOT NULL,
+        nome_removido TEXT,
+        usuario TEXT,
+        data_hora TEXT NOT NULL
+    )
+    """)
+    cur.execute("SELECT id, nome FROM produtos")
+    for prod_id, nome in cur.fetchall():
+        duplicados.indexar(cur, prod_id, nome)
+
+# Tabelas cuja versão (versao_dados) os relatórios pré-calculados observam
+TABELAS_VERSIONADAS = ("produtos", "locais", "estoque_local", "movimentacoes", "lotes", "custo_produto")
+
+def _migracao_tarefas(cur):
+    # Um contador por tabela, incrementado por trigger a cada linha alterada.
+    # Os contadores só crescem, então a soma dos contadores das tabelas que um
+    # relatório lê muda sempre que algum dado dele muda (tarefas.py).
+    cur.execute("""
+    CREATE TABLE versao_dados (
+        tabela TEXT PRIMARY KEY,
+        versao INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    """)
+    for tabela in TABELAS_VERSIONADAS:
+        cur.execute("INSERT INTO versao_dados (tabela) VALUES (?)", (tabela,))
+        for evento in ("INSERT", "UPDATE", "DELETE"):
+            cur.execute(f"""
+            CREATE TRIGGER trg_{tabela}_versao_{evento.lower()} AFTER {evento} ON {tabela} BEGIN
+                UPDATE versao_dados SET versao = versao + 1 WHERE tabela = '{tabela}';
+            END
+            """)
+    # Fila de relatórios executados em segundo plano (python tarefas.py)
+    cur.execute("""
+    CREATE TABLE tarefas (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        relatorio TEXT NOT NULL,
+        parametros TEXT NOT NULL DEFAULT '{}',
+        estado TEXT CHECK(estado IN ('pendente','executando','concluida','falhou')) NOT NULL DEFAULT 'pendente',
+        progresso REAL NOT NULL DEFAULT 0.0,
+        mensagem TEXT,
+        solicitado_por TEXT,
+        criada_em TEXT NOT NULL,
+        iniciada_em TEXT,
+        concluida_em TEXT,
+        atualizada_em TEXT,
+        worker TEXT
+    )
+    """)
+    cur.execute("CREATE INDEX idx_tarefas_ativas ON tarefas (relatorio, parametros) WHERE estado IN ('pendente','executando')")
+    cur.execute("CREATE INDEX idx_tarefas_recentes ON tarefas (relatorio, parametros, id)")
+    # Último arquivo gerado de cada relatório, com a versão dos dados que leu
+    cur.execute("""
+    CREATE TABLE artefatos (
+        relatorio TEXT NOT NULL,
+        parametros TEXT NOT NULL,
+        versao_dados INTEGER NOT NULL,
+        arquivo TEXT NOT NULL,
+        tamanho INTEGER NOT NULL,
+        tarefa_id INTEGER REFERENCES tarefas(id),
+        gerado_em TEXT NOT NULL,
+        PRIMARY KEY (relatorio, parametros)
+    ) WITHOUT ROWID
+    """)
+    # Relatórios refeitos periodicamente pelo worker
+    cur.execute("""
+    CREATE TABLE agendamentos (
+        relatorio TEXT NOT NULL,
+        parametros TEXT NOT NULL DEFAULT '{}',
+        intervalo_min INTEGER CHECK(intervalo_min > 0) NOT NULL,
+        proxima_em TEXT NOT NULL,
+        PRIMARY KEY (relatorio, parametros)
+    ) WITHOUT ROWID
+    """)
+
+MIGRACOES = [
+    _migracao_locais,
+    _migracao_codigo_barras,
+    _migracao_lotes,
+    _migracao_versao_produto,
+    _migracao_previsoes,
+    _migracao_custos,
+    _migracao_trigramas,
+    _migracao_tarefas,
+]
+
+def aplicar_migracoes(conn):
+    cur = conn.cursor()
+    # WAL: leituras longas (dashboard, backup online) não bloqueiam quem grava
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA user_version")
+    if cur.fetchone()[0] >= len(MIGRACOES):
+        return
+
+    nivel = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        # BEGIN IMMEDIATE: se os dois apps abrirem juntos, só um migra
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            cur.execute("PRAGMA user_version")
+            versao = cur.fetchone()[0]
+            for numero in range(versao, len(MIGRACOES)):
+                MIGRACOES[numero](cur)
+                cur.execute(f"PRAGMA user_version = {numero + 1}")
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+    finally:
+        conn.isolation_level = nivel
+
+# ---------------- Operações de BD ----------------
+def verificar_login(nome, senha):
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT cargo FROM usuarios WHERE nome=? AND senha=?", (nome, senha))
+    row = cur.fetchone()
+    conn.close()
+    return row[0] if row else None
+
+def obter_usuario(nome, senha):
+    # (id, nome, cargo) ou None
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT id, nome, cargo FROM usuarios WHERE nome=? AND senha=?", (nome, senha))
+    row = cur.fetchone()
+    conn.close()
+    return row
+
+def contar_usuarios():
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM usuarios")
+    n = cur.fetchone()[0]
+    conn.close()
+    return n
+
+def contar_produtos():
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM produtos")
+    n = cur.fetchone()[0]
+    conn.close()
+    return n
+
+def listar_produtos(local_id=None):
+    conn = get_conn()
+    cur = conn.cursor()
+    if local_id is None:
+        cur.execute("SELECT id, nome, categoria, quantidade, preco_unitario, fornecedor, codigo_barras FROM produtos ORDER BY nome")
+    else:
+        cur.execute("""
+            SELECT p.id, p.nome, p.categoria, COALESCE(e.quantidade, 0), p.preco_unitario, p.fornecedor, p.codigo_barras
+            FROM produtos p
+            LEFT JOIN estoque_local e ON e.produto_id = p.id AND e.local_id = ?
+            ORDER BY p.nome
+        """, (local_id,))
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+def inserir_produto(nome, categoria, quantidade, preco, fornecedor, local_id=None, codigo_barras=None,
+                    lote=None, validade=None, custo_unitario=None):
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        # A quantidade inicial entra como estoque do local; o trigger de
+        # estoque_local atualiza produtos.quantidade.
+        cur.execute("""
+            INSERT INTO produtos (nome, categoria, quantidade, preco_unitario, fornecedor, codigo_barras)
+            VALUES (?, ?, 0, ?, ?, ?)
+        """, (nome, categoria, preco, fornecedor, codigo_barras or None))
+        prod_id = cur.lastrowid
+        duplicados.indexar(cur, prod_id, nome)
+        if local_id is None:
+            local_id = _local_padrao(cur)
+        cur.execute("INSERT INTO estoque_local (produto_id, local_id, quantidade) VALUES (?, ?, ?)",
+                    (prod_id, local_id, quantidade))
+        if validade and quantidade > 0:
+            _entrada_lote(cur, prod_id, local_id, quantidade, validade, lote)
+        if quantidade > 0:
+            # sem custo de compra informado, o estoque inicial vale o preço
+            custos.registrar_entrada(cur, prod_id, quantidade, preco if custo_unitario is None else custo_unitario,
+                                     data_hora=datetime.now().isoformat(sep=' ', timespec='seconds'))
+        conn.commit()
+        return prod_id
+    finally:
+        conn.close()
+
+# Campos editáveis do produto -> coluna em produtos
+CAMPOS_PRODUTO = {
+    "nome": "nome",
+    "categoria": "categoria",
+    "preco": "preco_unitario",
+    "fornecedor": "fornecedor",
+    "codigo_barras": "codigo_barras",
+}
+
+def obter_produto(prod_id, local_id=None):
+    # Leitura fresca para o formulário de edição, com a versão da linha
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT p.nome, p.categoria, p.preco_unitario, p.fornecedor, p.codigo_barras, p.versao,
+               CASE WHEN ? IS NULL THEN p.quantidade ELSE COALESCE(e.quantidade, 0) END
+        FROM produtos p
+        LEFT JOIN estoque_local e ON e.produto_id = p.id AND e.local_id = ?
+        WHERE p.id = ?
+    """, (local_id, local_id, prod_id))
+    row = cur.fetchone()
+    conn.close()
+    if not row:
+        return None
+    return dict(zip(("nome", "categoria", "preco", "fornecedor", "codigo_barras", "versao", "quantidade"), row))
+
+def atualizar_produto(prod_id, versao, alteracoes, local_id=None, quantidade=None, quantidade_anterior=None):
+    # Controle otimista: grava só os campos alterados e só se a linha ainda
+    # estiver na versão lida (WHERE id=? AND versao=?). A quantidade no local
+    # segue a mesma ideia, condicionada à quantidade lida. Nada é travado
+    # enquanto o usuário edita; o único lock é o da própria escrita.
+    # Devolve (True, nova_versao) ou (False, mensagem).
+    colunas = []
+    valores = []
+    for campo, valor in alteracoes.items():
+        if campo not in CAMPOS_PRODUTO:
+            raise ValueError(f"Campo inválido: {campo}")
+        colunas.append(f"{CAMPOS_PRODUTO[campo]}=?")
+        valores.append(valor)
+
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        if colunas:
+            cur.execute(f"UPDATE produtos SET {', '.join(colunas)}, versao = versao + 1 WHERE id=? AND versao=?",
+                        valores + [prod_id, versao])
+            if cur.rowcount == 0:
+                return False, "O produto foi alterado ou removido por outro usuário."
+            versao += 1
+            if "nome" in alteracoes:
+                duplicados.indexar(cur, prod_id, alteracoes["nome"])
+
+        if quantidade is not None:
+            if local_id is None:
+                local_id = _local_padrao(cur)
+            cur.execute("""
+                UPDATE estoque_local SET quantidade = ?
+                WHERE produto_id = ? AND local_id = ? AND quantidade = ?
+            """, (quantidade, prod_id, local_id, quantidade_anterior))
+            if cur.rowcount == 0:
+                cur.execute("SELECT 1 FROM estoque_local WHERE produto_id = ? AND local_id = ?", (prod_id, local_id))
+                if cur.fetchone() or quantidade_anterior != 0:
+                    return False, "O estoque do produto mudou desde que o formulário foi aberto."
+                cur.execute("INSERT INTO estoque_local (produto_id, local_id, quantidade) VALUES (?, ?, ?)",
+                            (prod_id, local_id, quantidade))
+            # redução manual de estoque consome os lotes por FEFO, para que a
+            # soma dos lotes nunca passe do estoque do local
+            if quantidade < quantidade_anterior:
+                _alocar_fefo(cur, prod_id, local_id, quantidade_anterior - quantidade)
+            custos.ajustar(cur, prod_id, quantidade - quantidade_anterior)
+        conn.commit()
+        return True, versao
+    finally:
+        conn.close()
+
+def buscar_produto_por_codigo(codigo_barras, local_id=None):
+    # Busca pelo índice único de codigo_barras; devolve (id, nome, quantidade,
+    # categoria) com a quantidade do local (ou da rede, se local_id for None)
+    conn = get_conn()
+    cur = conn.cursor()
+    if local_id is None:
+        cur.execute("SELECT id, nome, quantidade, categoria FROM produtos WHERE codigo_barras = ?", (codigo_barras,))
+    else:
+        cur.execute("""
+            SELECT p.id, p.nome, COALESCE(e.quantidade, 0), p.categoria
+            FROM produtos p
+            LEFT JOIN estoque_local e ON e.produto_id = p.id AND e.local_id = ?
+            WHERE p.codigo_barras = ?
+        """, (local_id, codigo_barras))
+    row = cur.fetchone()
+    conn.close()
+    return row
+
+# Duplicados (índice de trigramas mantido acima, em inserir/atualizar_produto)
+def produtos_similares(nome, limiar=duplicados.LIMIAR_SIMILARIDADE, excluir_id=None, limite=10):
+    # Para avisar no cadastro: [(id, nome, categoria, similaridade)]
+    conn = get_conn()
+    try:
+        return duplicados.similares(conn.cursor(), nome, limiar, excluir_id, limite)
+    finally:
+        conn.close()
+
+def grupos_duplicados(limiar=duplicados.LIMIAR_SIMILARIDADE):
+    conn = get_conn()
+    try:
+        return duplicados.grupos_duplicados(conn.cursor(), limiar)
+    finally:
+        conn.close()
+
+def mesclar_produtos(manter_id, remover_id, usuario=None):
+    # Junta remover_id em manter_id numa transação: estoque por local, lotes,
+    # custos (média ponderada e camadas FIFO) e histórico de movimentações
+    # passam para o produto mantido; depois remover_id é apagado.
+    if manter_id == remover_id:
+        raise ValueError("Escolha dois produtos diferentes.")
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT id, nome, codigo_barras FROM produtos WHERE id IN (?, ?)", (manter_id, remover_id))
+        encontrados = {row[0]: row for row in cur.fetchall()}
+        if len(encontrados) < 2:
+            raise ValueError("Produto não encontrado.")
+        _id, nome_removido, codigo_removido = encontrados[remover_id]
+
+        # Estoque: zera no removido e soma no mantido (os triggers de
+        # estoque_local acertam totais_local com o preço de cada um)
+        cur.execute("SELECT local_id, quantidade FROM estoque_local WHERE produto_id = ? AND quantidade > 0",
+                    (remover_id,))
+        for local_id, quantidade in cur.fetchall():
+            cur.execute("UPDATE estoque_local SET quantidade = 0 WHERE produto_id = ? AND local_id = ?",
+                        (remover_id, local_id))
+            cur.execute("""
+                INSERT INTO estoque_local (produto_id, local_id, quantidade) VALUES (?, ?, ?)
+                ON CONFLICT(produto_id, local_id) DO UPDATE SET quantidade = quantidade + excluded.quantidade
+            """, (manter_id, local_id, quantidade))
+
+        cur.execute("UPDATE lotes SET produto_id = ? WHERE produto_id = ?", (manter_id, remover_id))
+
+        # Custos: saldo somado pela média ponderada; as camadas FIFO seguem
+        # na ordem de chegada (id)
+        cur.execute("SELECT quantidade, custo_medio, valor_fifo FROM custo_produto WHERE produto_id = ?", (remover_id,))
+        saldo_removido = cur.fetchone()
+        if saldo_removido:
+            qtd_r, medio_r, fifo_r = saldo_removido
+            cur.execute("SELECT quantidade, custo_medio FROM custo_produto WHERE produto_id = ?", (manter_id,))
+            qtd_m, medio_m = cur.fetchone() or (0, 0.0)
+            total = qtd_m + qtd_r
+            medio = (qtd_m * medio_m + qtd_r * medio_r) / total if total > 0 else medio_m
+            cur.execute("DELETE FROM custo_produto WHERE produto_id = ?", (remover_id,))
+            cur.execute("""
+                INSERT INTO custo_produto (produto_id, quantidade, custo_medio, valor_fifo) VALUES (?, ?, ?, ?)
+                ON CONFLICT(produto_id) DO UPDATE SET
+                    quantidade = excluded.quantidade,
+                    custo_medio = excluded.custo_medio,
+                    valor_fifo = valor_fifo + ?
+            """, (manter_id, total, medio, fifo_r, fifo_r))
+        cur.execute("UPDATE camadas_fifo SET produto_id = ? WHERE produto_id = ?", (manter_id, remover_id))
+
+        cur.execute("UPDATE movimentacoes SET produto_id = ? WHERE produto_id = ?", (manter_id, remover_id))
+        cur.execute("DELETE FROM previsoes WHERE produto_id = ?", (remover_id,))
+        cur.execute("DELETE FROM produtos WHERE id = ?", (remover_id,))
+        cur.execute("UPDATE produtos SET versao = versao + 1, codigo_barras = COALESCE(codigo_barras, ?) WHERE id = ?",
+                    (codigo_removido, manter_id))
+        cur.execute("""
+            INSERT INTO mesclagens (produto_mantido, produto_removido, nome_removido, usuario, data_hora)
+            VALUES (?, ?, ?, ?, ?)
+        """, (manter_id, remover_id, nome_removido, usuario, datetime.now().isoformat(sep=' ', timespec='seconds')))
+        conn.commit()
+    finally:
+        conn.close()
+
+def remover_produto(prod_id):
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute("DELETE FROM produtos WHERE id=?", (prod_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+def listar_usuarios():
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT id, nome, cargo FROM usuarios ORDER BY nome")
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+def inserir_usuario(nome, senha, cargo):
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute("INSERT INTO usuarios (nome, senha, cargo) VALUES (?, ?, ?)",
+                    (nome, senha, cargo))
+        conn.commit()
+        return True, None
+    except sqlite3.IntegrityError:
+        return False, "Usuário já existe."
+    except Exception as e:
+        return False, str(e)
+    finally:
+        conn.close()
+
+def remover_usuario(user_id):
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute("DELETE FROM usuarios WHERE id=?", (user_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+# Locais (lojas e depósitos)
+def _local_padrao(cur):
+    cur.execute("SELECT id FROM locais WHERE nome = ?", (LOCAL_PADRAO,))
+    row = cur.fetchone()
+    if row:
+        return row[0]
+    cur.execute("SELECT MIN(id) FROM locais")
+    return cur.fetchone()[0]
+
+def listar_locais():
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT id, nome, tipo FROM locais ORDER BY nome")
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+def inserir_local(nome, tipo="loja"):
+    if tipo not in TIPOS_LOCAL:
+        return False, "Tipo de local inválido."
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute("INSERT INTO locais (nome, tipo) VALUES (?, ?)", (nome, tipo))
+        conn.commit()
+        return True, None
+    except sqlite3.IntegrityError:
+        return False, "Local já existe."
+    except Exception as e:
+        return False, str(e)
+    finally:
+        conn.close()
+
+def estoque_por_local(produto_id):
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT l.id, l.nome, e.quantidade
+        FROM estoque_local e
+        JOIN locais l ON l.id = e.local_id
+        WHERE e.produto_id = ?
+        ORDER BY l.nome
+    """, (produto_id,))
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+def totais_por_local():
+    # Lê os agregados mantidos por trigger: uma linha por local
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT l.id, l.nome, l.tipo, t.quantidade, t.valor, t.produtos
+        FROM totais_local t
+        JOIN locais l ON l.id = t.local_id
+        ORDER BY l.nome
+    """)
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+def total_rede():
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT COALESCE(SUM(quantidade), 0), COALESCE(SUM(valor), 0) FROM totais_local")
+    row = cur.fetchone()
+    conn.close()
+    return row
+
+def recalcular_totais():
+    # Reconstrói totais_local a partir de estoque_local (manutenção, corrige
+    # eventual acúmulo de arredondamento em valor)
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            UPDATE totais_local SET
+                quantidade = COALESCE((SELECT SUM(e.quantidade) FROM estoque_local e
+                                       WHERE e.local_id = totais_local.local_id), 0),
+                valor = COALESCE((SELECT SUM(e.quantidade * p.preco_unitario)
+                                  FROM estoque_local e JOIN produtos p ON p.id = e.produto_id
+                                  WHERE e.local_id = totais_local.local_id), 0),
+                produtos = (SELECT COUNT(*) FROM estoque_local e
+                            WHERE e.local_id = totais_local.local_id AND e.quantidade > 0)
+        """)
+        conn.commit()
+    finally:
+        conn.close()
+
+# Movimentações (histórico)
+def _nome_local(cur, local_id):
+    cur.execute("SELECT nome FROM locais WHERE id = ?", (local_id,))
+    row = cur.fetchone()
+    return row[0] if row else str(local_id)
+
+# Lotes e validade
+def _validar_validade(validade):
+    try:
+        datetime.strptime(validade, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        raise ValueError("Validade deve estar no formato AAAA-MM-DD.")
+    return validade
+
+def categoria_com_lote(categoria):
+    return (categoria or "").strip().lower() in {c.lower() for c in CATEGORIAS_COM_LOTE}
+
+def _entrada_lote(cur, produto_id, local_id, quantidade, validade, codigo=None):
+    # Soma ao lote (produto, local, código, validade) ou cria um novo
+    _validar_validade(validade)
+    codigo = codigo or None
+    cur.execute("""
+        SELECT id FROM lotes
+        WHERE produto_id = ? AND local_id = ? AND validade = ? AND codigo IS ?
+    """, (produto_id, local_id, validade, codigo))
+    row = cur.fetchone()
+    if row:
+        cur.execute("UPDATE lotes SET quantidade = quantidade + ? WHERE id = ?", (quantidade, row[0]))
+        return row[0]
+    cur.execute("""
+        INSERT INTO lotes (produto_id, local_id, codigo, validade, quantidade)
+        VALUES (?, ?, ?, ?, ?)
+    """, (produto_id, local_id, codigo, validade, quantidade))
+    return cur.lastrowid
+
+def _alocar_fefo(cur, produto_id, local_id, quantidade):
+    # Consome os lotes que vencem primeiro. Lê pelo idx_lotes_fefo (já
+    # ordenado) e para assim que a quantidade é coberta. Estoque anterior ao
+    # controle de lotes não tem lote: o que sobrar fica sem alocação.
+    cur.execute("""
+        SELECT id, quantidade, codigo, validade FROM lotes
+        WHERE produto_id = ? AND local_id = ? AND quantidade > 0
+        ORDER BY validade, id
+    """, (produto_id, local_id))
+    alocacoes = []
+    restante = quantidade
+    while restante > 0:
+        row = cur.fetchone()
+        if row is None:
+            break
+        lote_id, saldo, codigo, validade = row
+        usado = min(saldo, restante)
+        alocacoes.append((lote_id, usado, codigo, validade))
+        restante -= usado
+    cur.executemany("UPDATE lotes SET quantidade = quantidade - ? WHERE id = ?",
+                    [(usado, lote_id) for lote_id, usado, _c, _v in alocacoes])
+    return alocacoes
+
+def _vincular_lotes(cur, movimentacao_id, alocacoes):
+    cur.executemany("INSERT INTO movimentacao_lotes (movimentacao_id, lote_id, quantidade) VALUES (?, ?, ?)",
+                    [(movimentacao_id, lote_id, qtd) for lote_id, qtd, _c, _v in alocacoes])
+
+def _lotes_da_movimentacao(cur, produto_id, local_id, quantidade, tipo, lote, validade):
+    if tipo == "saida":
+        return _alocar_fefo(cur, produto_id, local_id, quantidade)
+    if validade:
+        return [(_entrada_lote(cur, produto_id, local_id, quantidade, validade, lote), quantidade, lote, validade)]
+    return []
+
+def lotes_a_vencer(dias=30, local_id=None, incluir_vencidos=True):
+    # Varredura de intervalo em idx_lotes_validade: só lê lotes com validade
+    # até hoje + dias (e, sem vencidos, a partir de hoje)
+    hoje = datetime.now().date()
+    limite = (hoje + timedelta(days=dias)).isoformat()
+    sql = """
+        SELECT l.id, p.nome, p.categoria, lo.nome, l.codigo, l.validade, l.quantidade,
+               CAST(julianday(l.validade) - julianday(?) AS INTEGER)
+        FROM lotes l
+        JOIN produtos p ON p.id = l.produto_id
+        JOIN locais lo ON lo.id = l.local_id
+        WHERE l.validade <= ? AND l.quantidade > 0
+    """
+    params = [hoje.isoformat(), limite]
+    if not incluir_vencidos:
+        sql += " AND l.validade >= ?"
+        params.append(hoje.isoformat())
+    if local_id is not None:
+        sql += " AND l.local_id = ?"
+        params.append(local_id)
+    sql += " ORDER BY l.validade"
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute(sql, params)
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+def listar_lotes(produto_id, local_id=None):
+    conn = get_conn()
+    cur = conn.cursor()
+    sql = """
+        SELECT l.id, lo.nome, l.codigo, l.validade, l.quantidade
+        FROM lotes l JOIN locais lo ON lo.id = l.local_id
+        WHERE l.produto_id = ? AND l.quantidade > 0
+    """
+    params = [produto_id]
+    if local_id is not None:
+        sql += " AND l.local_id = ?"
+        params.append(local_id)
+    cur.execute(sql + " ORDER BY l.validade, l.id", params)
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+def _movimentar_estoque(cur, produto_id, local_id, delta):
+    # Aplica delta ao estoque do (produto, local) e devolve a nova quantidade.
+    # Saída maior que o saldo viola o CHECK(quantidade >= 0) e vira ValueError.
+    cur.execute("SELECT 1 FROM produtos WHERE id = ?", (produto_id,))
+    if not cur.fetchone():
+        raise ValueError("Produto não encontrado.")
+    cur.execute("""
+        INSERT INTO estoque_local (produto_id, local_id, quantidade) VALUES (?, ?, 0)
+        ON CONFLICT(produto_id, local_id) DO NOTHING
+    """, (produto_id, local_id))
+    try:
+        cur.execute("UPDATE estoque_local SET quantidade = quantidade + ? WHERE produto_id = ? AND local_id = ?",
+                    (delta, produto_id, local_id))
+    except sqlite3.IntegrityError:
+        cur.execute("SELECT quantidade FROM estoque_local WHERE produto_id = ? AND local_id = ?",
+                    (produto_id, local_id))
+        atual = cur.fetchone()[0]
+        raise ValueError(f"Não há estoque suficiente em '{_nome_local(cur, local_id)}' (atual: {atual}).")
+    cur.execute("SELECT quantidade FROM estoque_local WHERE produto_id = ? AND local_id = ?",
+                (produto_id, local_id))
+    return cur.fetchone()[0]
+
+def _valorar_movimentacao(cur, mov_id, produto_id, quantidade, tipo, custo_unitario, data_hora):
+    # Atualiza custo médio/camadas FIFO e grava o custo na movimentação
+    if tipo == "entrada":
+        custo = custos.registrar_entrada(cur, produto_id, quantidade, custo_unitario, mov_id, data_hora)
+        cur.execute("UPDATE movimentacoes SET custo_unitario = ? WHERE id = ?", (custo, mov_id))
+    else:
+        custo, cmv_medio, cmv_fifo = custos.registrar_saida(cur, produto_id, quantidade)
+        cur.execute("UPDATE movimentacoes SET custo_unitario = ?, cmv_medio = ?, cmv_fifo = ? WHERE id = ?",
+                    (custo, cmv_medio, cmv_fifo, mov_id))
+
+def inserir_movimentacao(produto_id, quantidade, tipo, usuario=None, observacao=None, local_id=None,
+                         lote=None, validade=None, custo_unitario=None):
+    # Registra a movimentação e atualiza o estoque do local na mesma transação.
+    # Entradas com validade abastecem um lote; saídas consomem lotes por FEFO.
+    if tipo not in ("entrada", "saida"):
+        raise ValueError("Tipo de movimentação inválido.")
+    if quantidade <= 0:
+        raise ValueError("Quantidade deve ser maior que zero.")
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        if local_id is None:
+            local_id = _local_padrao(cur)
+        delta = quantidade if tipo == "entrada" else -quantidade
+        nova_qtd = _movimentar_estoque(cur, produto_id, local_id, delta)
+        now = datetime.now().isoformat(sep=' ', timespec='seconds')
+        cur.execute("""
+            INSERT INTO movimentacoes (produto_id, quantidade, tipo, usuario, data_hora, observacao, local_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (produto_id, quantidade, tipo, usuario, now, observacao, local_id))
+        mov_id = cur.lastrowid
+        _vincular_lotes(cur, mov_id, _lotes_da_movimentacao(cur, produto_id, local_id, quantidade, tipo, lote, validade))
+        _valorar_movimentacao(cur, mov_id, produto_id, quantidade, tipo, custo_unitario, now)
+        conn.commit()
+        return nova_qtd
+    finally:
+        conn.close()
+
+def registrar_movimentacoes_lote(itens, tipo, usuario=None, observacao=None, local_id=None,
+                                 lote=None, validade=None):
+    # Grava várias movimentações do mesmo tipo/local numa única transação.
+    # itens: {produto_id: quantidade}. Devolve {produto_id: nova quantidade no local}.
+    # lote/validade valem para todas as entradas do lote de leituras.
+    if tipo not in ("entrada", "saida"):
+        raise ValueError("Tipo de movimentação inválido.")
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        if local_id is None:
+            local_id = _local_padrao(cur)
+        novas = {}
+        for produto_id, quantidade in itens.items():
+            if quantidade <= 0:
+                raise ValueError("Quantidade deve ser maior que zero.")
+            delta = quantidade if tipo == "entrada" else -quantidade
+            novas[produto_id] = _movimentar_estoque(cur, produto_id, local_id, delta)
+        now = datetime.now().isoformat(sep=' ', timespec='seconds')
+        for pid, qtd in itens.items():
+            cur.execute("""
+                INSERT INTO movimentacoes (produto_id, quantidade, tipo, usuario, data_hora, observacao, local_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (pid, qtd, tipo, usuario, now, observacao, local_id))
+            mov_id = cur.lastrowid
+            _vincular_lotes(cur, mov_id, _lotes_da_movimentacao(cur, pid, local_id, qtd, tipo, lote, validade))
+            _valorar_movimentacao(cur, mov_id, pid, qtd, tipo, None, now)
+        conn.commit()
+        return novas
+    finally:
+        conn.close()
+
+def transferir_estoque(produto_id, quantidade, origem_id, destino_id, usuario=None, observacao=None):
+    # Saída na origem + entrada no destino, gravadas juntas (ou nenhuma)
+    if origem_id == destino_id:
+        raise ValueError("Origem e destino devem ser diferentes.")
+    if quantidade <= 0:
+        raise ValueError("Quantidade deve ser maior que zero.")
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        _movimentar_estoque(cur, produto_id, origem_id, -quantidade)
+        _movimentar_estoque(cur, produto_id, destino_id, quantidade)
+        now = datetime.now().isoformat(sep=' ', timespec='seconds')
+        cur.execute("""
+            INSERT INTO movimentacoes (produto_id, quantidade, tipo, usuario, data_hora, observacao, local_id)
+            VALUES (?, ?, 'saida', ?, ?, ?, ?)
+        """, (produto_id, quantidade, usuario, now, observacao, origem_id))
+        transf_id = cur.lastrowid
+        cur.execute("UPDATE movimentacoes SET transferencia_id = ? WHERE id = ?", (transf_id, transf_id))
+        cur.execute("""
+            INSERT INTO movimentacoes (produto_id, quantidade, tipo, usuario, data_hora, observacao, local_id, transferencia_id)
+            VALUES (?, ?, 'entrada', ?, ?, ?, ?, ?)
+        """, (produto_id, quantidade, usuario, now, observacao, destino_id, transf_id))
+        entrada_id = cur.lastrowid
+        # os lotes saem da origem por FEFO e chegam ao destino com o mesmo
+        # código e validade
+        alocacoes = _alocar_fefo(cur, produto_id, origem_id, quantidade)
+        _vincular_lotes(cur, transf_id, alocacoes)
+        _vincular_lotes(cur, entrada_id, [
+            (_entrada_lote(cur, produto_id, destino_id, qtd, validade, codigo), qtd, codigo, validade)
+            for _lote_id, qtd, codigo, validade in alocacoes
+        ])
+        conn.commit()
+        return transf_id
+    finally:
+        conn.close()
+
+def listar_movimentacoes(limit=500, local_id=None):
+    conn = get_conn()
+    cur = conn.cursor()
+    sql = """
+        SELECT m.id, p.nome, m.quantidade, m.tipo, l.nome, m.usuario, m.data_hora, m.observacao
+        FROM movimentacoes m
+        LEFT JOIN produtos p ON p.id = m.produto_id
+        LEFT JOIN locais l ON l.id = m.local_id
+    """
+    params = []
+    if local_id is not None:
+        sql += " WHERE m.local_id = ?"
+        params.append(local_id)
+    sql += " ORDER BY m.data_hora DESC LIMIT ?"
+    params.append(limit)
+    cur.execute(sql, params)
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+def iterar_movimentacoes(local_id=None, inicio=None, fim=None, tamanho_bloco=5000):
+    # Histórico completo em ordem cronológica, lido em blocos (para exportar
+    # sem carregar tudo na memória). inicio/fim: AAAA-MM-DD, inclusivas.
+    sql = """
+        SELECT m.id, m.data_hora, m.tipo, m.produto_id, p.nome, m.quantidade, l.nome, m.usuario,
+               m.observacao, m.transferencia_id, m.custo_unitario
+        FROM movimentacoes m
+        LEFT JOIN produtos p ON p.id = m.produto_id
+        LEFT JOIN locais l ON l.id = m.local_id
+        WHERE 1 = 1
+    """
+    params = []
+    if inicio:
+        sql += " AND m.data_hora >= ?"
+        params.append(inicio)
+    if fim:
+        sql += " AND m.data_hora < date(?, '+1 day')"
+        params.append(fim)
+    if local_id is not None:
+        sql += " AND m.local_id = ?"
+        params.append(local_id)
+    conn = get_conn()
+    try:
+        cur = conn.execute(sql + " ORDER BY m.data_hora, m.id", params)
+        while True:
+            rows = cur.fetchmany(tamanho_bloco)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+# Valoração (saldos mantidos por custos.py)
+def valoracao_total():
+    # (valor a custo médio, valor FIFO, CMV médio acumulado, CMV FIFO acumulado)
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT valor_medio, valor_fifo, cmv_medio, cmv_fifo FROM custo_total WHERE id = 1")
+    row = cur.fetchone()
+    conn.close()
+    return row or (0.0, 0.0, 0.0, 0.0)
+
+def valoracao_produtos(limit=None):
+    conn = get_conn()
+    cur = conn.cursor()
+    sql = """
+        SELECT p.id, p.nome, p.categoria, c.quantidade, c.custo_medio,
+               c.quantidade * c.custo_medio AS valor_medio, c.valor_fifo
+        FROM custo_produto c JOIN produtos p ON p.id = c.produto_id
+        WHERE c.quantidade > 0
+        ORDER BY valor_medio DESC
+    """
+    params = []
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    cur.execute(sql, params)
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+def cmv_periodo(inicio, fim):
+    # CMV das saídas de venda entre as datas (AAAA-MM-DD, inclusivas), pelo
+    # índice de data das movimentações
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT COALESCE(SUM(cmv_medio), 0), COALESCE(SUM(cmv_fifo), 0)
+        FROM movimentacoes
+        WHERE data_hora >= ? AND data_hora < date(?, '+1 day')
+          AND tipo = 'saida' AND transferencia_id IS NULL
+    """, (inicio, fim))
+    row = cur.fetchone()
+    conn.close()
+    return row
+
+def listar_previsoes():
+    # Previsões com demanda (python previsao.py), para o dashboard
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT p.nome, p.categoria, p.quantidade, f.demanda_diaria, f.demanda_horizonte,
+               f.horizonte_dias, f.modelo, f.gerado_em
+        FROM previsoes f JOIN produtos p ON p.id = f.produto_id
+        WHERE f.demanda_diaria > 0
+    """)
+    rows = cur.fetchall()
+    conn.close()
+    return rows
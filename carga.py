@@ -0,0 +1,309 @@
+# carga.py
+# Teste de carga: N balconistas e M leitores do dashboard simulados,
+# chamando as mesmas operações do repositório (repositorio.py) usadas pelo app
+# Tkinter, contra uma cópia local do estoque.db ou, com --direto, contra um
+# banco PostgreSQL de teste (que é alterado).
+#
+#   python carga.py --balconistas 8 --leitores 2 --duracao 30
+#   python carga.py --balconistas 16 --processos --json resultado.json
+#   python carga.py --banco postgresql://localhost/estoque_teste --direto --popular 5000
+import os
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import banco
+import repositorio
+
+# Sem acesso ao busy handler do sqlite3, espera por lock é inferida: uma
+# operação que passa deste tempo ficou esperando outro escritor
+LIMIAR_ESPERA_MS = 50.0
+
+# Validade das entradas de produtos com lote (como o app pede no balcão)
+VALIDADE = "2099-12-31"
+
+# Repositório do processo: um pool de conexões por processo no PostgreSQL,
+# dividido pelas threads
+repo = None
+
+
+def _abrir(destino):
+    global repo
+    repo = repositorio.abrir(destino)
+    return repo
+
+
+# ---------------- Operações simuladas ----------------
+# Cada operação devolve False quando a regra de negócio recusa (estoque
+# insuficiente, conflito de versão), o que não conta como erro.
+def _validade(ctx, pid, tipo):
+    # Só entradas de categorias com lote levam validade
+    return VALIDADE if tipo == "entrada" and pid in ctx["com_lote"] else None
+
+def _movimentar(rnd, ctx):
+    tipo = "entrada" if rnd.random() < 0.5 else "saida"
+    pid = rnd.choice(ctx["produtos"])
+    try:
+        repo.inserir_movimentacao(pid, rnd.randint(1, 5), tipo, usuario="carga",
+                                  local_id=rnd.choice(ctx["locais"]), validade=_validade(ctx, pid, tipo))
+    except ValueError:
+        return False
+    return True
+
+def _ler_lote(rnd, ctx):
+    # Uma leitura em lote no balcão tem uma validade só: os itens são todos
+    # com lote ou todos sem
+    grupo = rnd.choice([g for g in (ctx["produtos_com_lote"], ctx["produtos_sem_lote"]) if g])
+    itens = {pid: rnd.randint(1, 3) for pid in rnd.sample(grupo, min(10, len(grupo)))}
+    repo.registrar_movimentacoes_lote(itens, "entrada", usuario="carga", local_id=rnd.choice(ctx["locais"]),
+                                      validade=_validade(ctx, grupo[0], "entrada"))
+    return True
+
+def _editar(rnd, ctx):
+    pid = rnd.choice(ctx["produtos"])
+    atual = repo.obter_produto(pid)
+    if atual is None:
+        return False
+    ok, _info = repo.atualizar_produto(pid, atual["versao"], {"preco": round(atual["preco"] * rnd.uniform(0.95, 1.05), 2)})
+    return ok
+
+def _transferir(rnd, ctx):
+    if len(ctx["locais"]) < 2:
+        return _movimentar(rnd, ctx)
+    origem, destino = rnd.sample(ctx["locais"], 2)
+    try:
+        repo.transferir_estoque(rnd.choice(ctx["produtos"]), rnd.randint(1, 3), origem, destino, usuario="carga")
+    except ValueError:
+        return False
+    return True
+
+def _listar_produtos(rnd, ctx):
+    repo.listar_produtos(rnd.choice(ctx["locais"] + [None]))
+    return True
+
+def _totais(rnd, ctx):
+    repo.totais_por_local()
+    repo.total_rede()
+    if repo.suporta("custos"):
+        repo.valoracao_total()
+    return True
+
+def _historico(rnd, ctx):
+    repo.listar_movimentacoes(limit=500, local_id=rnd.choice(ctx["locais"] + [None]))
+    return True
+
+# (nome, função, peso)
+OPERACOES = {
+    "balconista": [
+        ("movimentacao", _movimentar, 70),
+        ("leitura_lote", _ler_lote, 10),
+        ("edicao", _editar, 10),
+        ("transferencia", _transferir, 10),
+    ],
+    "leitor": [
+        ("listar_produtos", _listar_produtos, 30),
+        ("totais", _totais, 50),
+        ("historico", _historico, 20),
+    ],
+}
+
+
+# ---------------- Execução ----------------
+def _trabalhar(papel, duracao, pausa, semente, ctx):
+    # Um balconista ou leitor; devolve as medições brutas por operação
+    rnd = random.Random(semente)
+    ops = OPERACOES[papel]
+    nomes = [o[0] for o in ops]
+    funcoes = {o[0]: o[1] for o in ops}
+    pesos = [o[2] for o in ops]
+    medidas = {n: {"latencias": [], "recusadas": 0, "erros_lock": 0, "erros": 0, "ultimo_erro": None} for n in nomes}
+
+    fim = time.monotonic() + duracao
+    while time.monotonic() < fim:
+        nome = rnd.choices(nomes, pesos)[0]
+        m = medidas[nome]
+        inicio = time.perf_counter()
+        try:
+            if not funcoes[nome](rnd, ctx):
+                m["recusadas"] += 1
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e) or "busy" in str(e):
+                m["erros_lock"] += 1
+            else:
+                m["erros"] += 1
+            m["ultimo_erro"] = str(e)
+        except Exception as e:
+            m["erros"] += 1
+            m["ultimo_erro"] = f"{type(e).__name__}: {e}"
+        m["latencias"].append((time.perf_counter() - inicio) * 1000.0)
+        if pausa:
+            time.sleep(pausa)
+    return papel, medidas
+
+
+def _percentil(ordenadas, p):
+    if not ordenadas:
+        return 0.0
+    return ordenadas[min(len(ordenadas) - 1, int(round(p / 100.0 * (len(ordenadas) - 1))))]
+
+
+def copiar_banco(origem, destino):
+    # Cópia consistente mesmo com o banco em uso
+    src = sqlite3.connect(origem)
+    dst = sqlite3.connect(destino)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def popular(n_produtos, n_locais=3, estoque_inicial=50):
+    # Catálogo sintético para bancos vazios, cadastrado como no app (índice de
+    # duplicados, estoque por local, lote e custo do estoque inicial)
+    lotes = repo.suporta("lotes")
+    for i in range(n_locais - len(repo.listar_locais())):
+        repo.inserir_local(f"Loja carga {i + 1}")
+    categorias = ["Alimentos", "Higiene Pessoal", "Eletrônicos", "Limpeza", "Outros"]
+    for i in range(n_produtos):
+        categoria = categorias[i % len(categorias)]
+        repo.inserir_produto(f"Produto carga {i}", categoria, estoque_inicial, round(1 + (i % 97) * 0.5, 2), "carga",
+                             validade=VALIDADE if lotes and banco.categoria_com_lote(categoria) else None)
+
+
+def executar(destino, balconistas, leitores, duracao, processos=False, pausa_ms=0.0, semente=0, n_popular=0):
+    # destino: arquivo SQLite ou URL postgresql://
+    papeis = ["balconista"] * balconistas + ["leitor"] * leitores
+    # cada thread com a sua conexão, como cada app tem a sua
+    repositorio.POOL_MAX = max(repositorio.POOL_MAX, len(papeis))
+    _abrir(destino).inicializar()
+    try:
+        if n_popular:
+            popular(n_popular)
+        produtos = repo.listar_produtos()
+        lotes = repo.suporta("lotes")
+        com_lote = {r[0] for r in produtos if lotes and banco.categoria_com_lote(r[2])}
+        ctx = {
+            "produtos": [r[0] for r in produtos],
+            "produtos_com_lote": [r[0] for r in produtos if r[0] in com_lote],
+            "produtos_sem_lote": [r[0] for r in produtos if r[0] not in com_lote],
+            "com_lote": com_lote,
+            "locais": [r[0] for r in repo.listar_locais()],
+        }
+        if not ctx["produtos"]:
+            raise SystemExit("Banco sem produtos: use --popular N.")
+
+        if processos:
+            # cada processo abre o seu repositório (conexões não passam pelo fork)
+            repo.fechar()
+            Executor, extras = ProcessPoolExecutor, {"initializer": _abrir, "initargs": (destino,)}
+        else:
+            Executor, extras = ThreadPoolExecutor, {}
+        inicio = time.monotonic()
+        with Executor(max_workers=len(papeis), **extras) as pool:
+            futuros = [pool.submit(_trabalhar, papel, duracao, pausa_ms / 1000.0, semente + i, ctx)
+                       for i, papel in enumerate(papeis)]
+            resultados = [f.result() for f in futuros]
+        decorrido = time.monotonic() - inicio
+    finally:
+        repo.fechar()
+
+    # junta as medições de todos os workers por (papel, operação)
+    juntas = {}
+    for papel, medidas in resultados:
+        for nome, m in medidas.items():
+            j = juntas.setdefault((papel, nome), {"latencias": [], "recusadas": 0, "erros_lock": 0, "erros": 0, "ultimo_erro": None})
+            j["latencias"].extend(m["latencias"])
+            for campo in ("recusadas", "erros_lock", "erros"):
+                j[campo] += m[campo]
+            j["ultimo_erro"] = m["ultimo_erro"] or j["ultimo_erro"]
+
+    linhas = []
+    for (papel, nome), j in sorted(juntas.items()):
+        lat = sorted(j["latencias"])
+        total = len(lat)
+        linhas.append({
+            "papel": papel,
+            "operacao": nome,
+            "ops": total,
+            "ops_s": round(total / decorrido, 1),
+            "p50_ms": round(_percentil(lat, 50), 2),
+            "p99_ms": round(_percentil(lat, 99), 2),
+            "max_ms": round(lat[-1], 2) if lat else 0.0,
+            "esperas_lock": sum(1 for x in lat if x > LIMIAR_ESPERA_MS),
+            "erros_lock": j["erros_lock"],
+            "erros": j["erros"],
+            "taxa_erro": round((j["erros_lock"] + j["erros"]) / total, 4) if total else 0.0,
+            "recusadas": j["recusadas"],
+            "ultimo_erro": j["ultimo_erro"],
+        })
+    return {
+        "balconistas": balconistas,
+        "leitores": leitores,
+        "modo": "processos" if processos else "threads",
+        "duracao_s": round(decorrido, 1),
+        "produtos": len(ctx["produtos"]),
+        "locais": len(ctx["locais"]),
+        "operacoes": linhas,
+    }
+
+
+def imprimir(relatorio):
+    print(f"{relatorio['balconistas']} balconistas, {relatorio['leitores']} leitores ({relatorio['modo']}), "
+          f"{relatorio['duracao_s']}s, {relatorio['produtos']} produtos em {relatorio['locais']} locais")
+    cab = f"{'papel':<11} {'operação':<16} {'ops':>7} {'ops/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} " \
+          f"{'esperas':>8} {'locked':>7} {'erros':>6} {'recus.':>7}"
+    print(cab)
+    print("-" * len(cab))
+    for l in relatorio["operacoes"]:
+        print(f"{l['papel']:<11} {l['operacao']:<16} {l['ops']:>7} {l['ops_s']:>8} {l['p50_ms']:>8} {l['p99_ms']:>8} "
+              f"{l['max_ms']:>8} {l['esperas_lock']:>8} {l['erros_lock']:>7} {l['erros']:>6} {l['recusadas']:>7}")
+    escrita = [l for l in relatorio["operacoes"] if l["papel"] == "balconista"]
+    total = sum(l["ops"] for l in escrita)
+    print(f"\nVazão de escrita: {round(total / relatorio['duracao_s'], 1)} ops/s; "
+          f"esperas por lock (> {LIMIAR_ESPERA_MS:.0f} ms): {sum(l['esperas_lock'] for l in escrita)}; "
+          f"'database is locked': {sum(l['erros_lock'] for l in escrita)}")
+    for l in relatorio["operacoes"]:
+        if l["ultimo_erro"]:
+            print(f"  último erro em {l['operacao']}: {l['ultimo_erro']}")
+
+
+# ---------------- Linha de comando ----------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Teste de carga do estoque (balconistas e leitores simulados).")
+    parser.add_argument("--banco", default=os.environ.get("ESTOQUE_DB_URL") or banco.DB_PATH,
+                        help="arquivo SQLite (é copiado, nunca alterado) ou URL postgresql:// (exige --direto)")
+    parser.add_argument("--direto", action="store_true",
+                        help="roda direto no PostgreSQL indicado, sem cópia: use um banco de teste")
+    parser.add_argument("--balconistas", type=int, default=4)
+    parser.add_argument("--leitores", type=int, default=1)
+    parser.add_argument("--duracao", type=float, default=20.0, help="segundos")
+    parser.add_argument("--pausa-ms", type=float, default=0.0, help="pausa entre operações de cada worker")
+    parser.add_argument("--processos", action="store_true", help="um processo por worker em vez de threads")
+    parser.add_argument("--popular", type=int, default=0, help="cria N produtos sintéticos antes do teste")
+    parser.add_argument("--semente", type=int, default=0)
+    parser.add_argument("--json", help="grava o relatório em JSON (para comparar execuções)")
+    args = parser.parse_args()
+
+    opcoes = dict(processos=args.processos, pausa_ms=args.pausa_ms, semente=args.semente, n_popular=args.popular)
+    if repositorio.usa_postgres(args.banco):
+        # um PostgreSQL não é copiado aqui: o teste grava no próprio banco
+        if not args.direto:
+            parser.error("com PostgreSQL o teste grava no banco indicado; confirme com --direto (use um banco de teste)")
+        relatorio = executar(args.banco, args.balconistas, args.leitores, args.duracao, **opcoes)
+    else:
+        origem = args.banco[len("sqlite:///"):] if args.banco.startswith("sqlite:///") else args.banco
+        with tempfile.TemporaryDirectory() as tmp:
+            copia = os.path.join(tmp, "estoque-carga.db")
+            if os.path.exists(origem):
+                copiar_banco(origem, copia)
+            relatorio = executar(copia, args.balconistas, args.leitores, args.duracao, **opcoes)
+
+    imprimir(relatorio)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(relatorio, f, ensure_ascii=False, indent=2)
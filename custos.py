@@ -0,0 +1,86 @@
+# custos.py
+# Motor de valoração do estoque: custo médio ponderado e camadas FIFO por
+# produto, atualizados a cada movimentação (sem reprocessar o histórico).
+# As funções recebem o cursor da transação da movimentação (ver banco.py).
+
+def _saldo(cur, produto_id):
+    cur.execute("SELECT quantidade, custo_medio FROM custo_produto WHERE produto_id = ?", (produto_id,))
+    return cur.fetchone()
+
+def custo_medio_atual(cur, produto_id):
+    # Custo médio vigente; sem histórico de custo, usa o preço do produto
+    saldo = _saldo(cur, produto_id)
+    if saldo:
+        return saldo[1]
+    cur.execute("SELECT preco_unitario FROM produtos WHERE id = ?", (produto_id,))
+    row = cur.fetchone()
+    return row[0] if row else 0.0
+
+def registrar_entrada(cur, produto_id, quantidade, custo_unitario=None, movimentacao_id=None, data_hora=None):
+    # Entrada recalcula o custo médio e abre uma camada FIFO.
+    # Sem custo informado, a entrada é valorada pelo custo médio vigente.
+    # Devolve o custo unitário usado.
+    if custo_unitario is None:
+        custo_unitario = custo_medio_atual(cur, produto_id)
+    saldo = _saldo(cur, produto_id)
+    qtd, medio = saldo if saldo else (0, 0.0)
+    nova_qtd = qtd + quantidade
+    novo_medio = (qtd * medio + quantidade * custo_unitario) / nova_qtd if nova_qtd > 0 else custo_unitario
+    cur.execute("""
+        INSERT INTO custo_produto (produto_id, quantidade, custo_medio, valor_fifo) VALUES (?, ?, ?, ?)
+        ON CONFLICT(produto_id) DO UPDATE SET
+            quantidade = excluded.quantidade,
+            custo_medio = excluded.custo_medio,
+            valor_fifo = valor_fifo + ?
+    """, (produto_id, nova_qtd, novo_medio, quantidade * custo_unitario, quantidade * custo_unitario))
+    cur.execute("""
+        INSERT INTO camadas_fifo (produto_id, movimentacao_id, data_hora, quantidade_restante, custo_unitario)
+        VALUES (?, ?, ?, ?, ?)
+    """, (produto_id, movimentacao_id, data_hora, quantidade, custo_unitario))
+    return custo_unitario
+
+def registrar_saida(cur, produto_id, quantidade, contabilizar_cmv=True):
+    # Saída baixa o saldo pelo custo médio e consome as camadas FIFO mais
+    # antigas. Devolve (custo médio unitário, CMV pelo médio, CMV pelo FIFO).
+    saldo = _saldo(cur, produto_id)
+    qtd, medio = saldo if saldo else (0, custo_medio_atual(cur, produto_id))
+    cmv_medio = quantidade * medio
+
+    cur.execute("""
+        SELECT id, quantidade_restante, custo_unitario FROM camadas_fifo
+        WHERE produto_id = ? AND quantidade_restante > 0
+        ORDER BY id
+    """, (produto_id,))
+    consumo = []
+    restante = quantidade
+    cmv_fifo = 0.0
+    while restante > 0:
+        row = cur.fetchone()
+        if row is None:
+            break
+        camada_id, disponivel, custo = row
+        usado = min(disponivel, restante)
+        consumo.append((usado, camada_id))
+        cmv_fifo += usado * custo
+        restante -= usado
+    # estoque sem camada (não deveria acontecer) sai pelo custo médio
+    cmv_fifo += restante * medio
+    cur.executemany("UPDATE camadas_fifo SET quantidade_restante = quantidade_restante - ? WHERE id = ?", consumo)
+
+    if saldo:
+        cur.execute("""
+            UPDATE custo_produto SET quantidade = MAX(quantidade - ?, 0), valor_fifo = MAX(valor_fifo - ?, 0)
+            WHERE produto_id = ?
+        """, (quantidade, cmv_fifo, produto_id))
+    if contabilizar_cmv:
+        cur.execute("UPDATE custo_total SET cmv_medio = cmv_medio + ?, cmv_fifo = cmv_fifo + ? WHERE id = 1",
+                    (cmv_medio, cmv_fifo))
+    return medio, cmv_medio, cmv_fifo
+
+def ajustar(cur, produto_id, delta):
+    # Ajuste manual de quantidade (formulário de edição): sobra entra pelo
+    # custo médio, falta sai sem entrar no CMV
+    if delta > 0:
+        registrar_entrada(cur, produto_id, delta)
+    elif delta < 0:
+        registrar_saida(cur, produto_id, -delta, contabilizar_cmv=False)
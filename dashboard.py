@@ -1,105 +1,86 @@
 # dashboard.py
-import sqlite3
 import pandas as pd
 import streamlit as st
 import plotly.express as px
 import hashlib
 import io
 
+import banco
+import repositorio
+
 # ----------------- Banco -----------------
-DB_PATH = "estoque.db"
-conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-cursor = conn.cursor()
-
-# Criar tabelas se não existirem
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS usuarios (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    nome TEXT NOT NULL UNIQUE,
-    senha TEXT NOT NULL,
-    cargo TEXT CHECK(cargo IN ('administrador', 'funcionario')) NOT NULL
-)
-""")
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS produtos (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    nome TEXT NOT NULL,
-    categoria TEXT NOT NULL,
-    quantidade INTEGER CHECK(quantidade >= 0) DEFAULT 0,
-    preco_unitario REAL CHECK(preco_unitario >= 0) DEFAULT 0.0,
-    fornecedor TEXT,
-    UNIQUE(nome, categoria)
-)
-""")
-conn.commit()
+# SQLite ou PostgreSQL, conforme ESTOQUE_DB_URL (ver repositorio.py); aberto
+# e inicializado uma vez por processo, não a cada rerun
+@st.cache_resource
+def abrir_repositorio():
+    repo = repositorio.obter()
+    repo.inicializar(criar_admin=False)
+    return repo
+
+repo = abrir_repositorio()
 
 # ----------------- Utilitários -----------------
 def hash_senha(s):
     return hashlib.sha256(s.encode("utf-8")).hexdigest()
 
 def criar_admin_padrao():
-    cursor.execute("SELECT COUNT(*) FROM usuarios")
-    if cursor.fetchone()[0] == 0:
-        cursor.execute("INSERT INTO usuarios (nome, senha, cargo) VALUES (?, ?, ?)",
-                       ("admin", hash_senha("admin"), "administrador"))
-        conn.commit()
+    if repo.contar_usuarios() == 0:
+        repo.inserir_usuario("admin", hash_senha("admin"), "administrador")
 
 criar_admin_padrao()
 
 # ----------------- CRUD Produtos e Usuários -----------------
-def carregar_produtos():
-    df = pd.read_sql_query("SELECT * FROM produtos", conn)
-    return df
+COLUNAS_PRODUTOS = ["id", "nome", "categoria", "quantidade", "preco_unitario", "fornecedor", "codigo_barras"]
+
+def carregar_produtos(local_id=None):
+    # com local_id, quantidade passa a ser a do local escolhido
+    return pd.DataFrame(repo.listar_produtos(local_id), columns=COLUNAS_PRODUTOS)
+
+def carregar_locais():
+    return pd.DataFrame(repo.listar_locais(), columns=["id", "nome", "tipo"])
+
+def carregar_totais_locais():
+    # agregados mantidos a cada movimentação (uma linha por local)
+    df = pd.DataFrame(repo.totais_por_local(), columns=["id", "local", "tipo", "quantidade", "valor", "produtos"])
+    return df[["id", "local", "tipo", "produtos", "quantidade", "valor"]]
 
 def carregar_usuarios():
-    df = pd.read_sql_query("SELECT * FROM usuarios", conn)
-    return df
+    return pd.DataFrame(repo.listar_usuarios(), columns=["id", "nome", "cargo"])
 
-def cadastrar_produto(nome, categoria, quantidade, preco_unitario, fornecedor):
+def cadastrar_produto(nome, categoria, quantidade, preco_unitario, fornecedor, local_id=None, lote=None, validade=None,
+                      custo_unitario=None):
     if not nome.strip():
         return False, "Nome do produto é obrigatório."
     if quantidade < 0:
         return False, "Quantidade não pode ser negativa."
     if preco_unitario < 0:
         return False, "Preço não pode ser negativo."
-    try:
-        cursor.execute("""
-            INSERT INTO produtos (nome, categoria, quantidade, preco_unitario, fornecedor)
-            VALUES (?, ?, ?, ?, ?)
-        """, (nome.title().strip(), categoria, int(quantidade), float(preco_unitario), fornecedor.title().strip()))
-        conn.commit()
-        return True, "Produto cadastrado com sucesso."
-    except sqlite3.IntegrityError:
-        return False, "Produto já existe nessa categoria."
+    # Nome repetido não é erro (esquema de banco.py): o aviso de similares no
+    # cadastro e a mesclagem em Deleção cuidam disso.
+    # Quantidade inicial entra no estoque do local escolhido
+    repo.inserir_produto(nome.title().strip(), categoria, int(quantidade), float(preco_unitario),
+                         fornecedor.title().strip(), local_id=local_id, lote=lote, validade=validade,
+                         custo_unitario=custo_unitario)
+    return True, "Produto cadastrado com sucesso."
 
 def deletar_produto(id_produto):
-    cursor.execute("DELETE FROM produtos WHERE id=?", (id_produto,))
-    conn.commit()
+    repo.remover_produto(id_produto)
 
 def cadastrar_usuario(nome, senha, cargo):
     if not nome.strip() or not senha:
         return False, "Nome e senha são obrigatórios."
     if cargo not in ("administrador", "funcionario"):
         return False, "Cargo inválido."
-    try:
-        cursor.execute("INSERT INTO usuarios (nome, senha, cargo) VALUES (?, ?, ?)",
-                       (nome.strip(), hash_senha(senha), cargo))
-        conn.commit()
+    ok, erro = repo.inserir_usuario(nome.strip(), hash_senha(senha), cargo)
+    if ok:
         return True, "Usuário cadastrado com sucesso."
-    except sqlite3.IntegrityError:
-        return False, "Já existe um usuário com esse nome."
+    return False, "Já existe um usuário com esse nome." if erro == "Usuário já existe." else erro
 
 def deletar_usuario(id_usuario):
-    cursor.execute("DELETE FROM usuarios WHERE id=?", (id_usuario,))
-    conn.commit()
+    repo.remover_usuario(id_usuario)
 
 def autenticar_usuario(nome, senha):
-    h = hash_senha(senha)
-    cursor.execute("SELECT id, nome, cargo FROM usuarios WHERE nome=? AND senha=?", (nome, h))
-    row = cursor.fetchone()
-    if row:
-        return {"id": row[0], "nome": row[1], "cargo": row[2]}
-    return None
+    return repo.autenticar(nome, hash_senha(senha))
 
 # ----------------- Helpers para download (corrigido) -----------------
 def gerar_csv_bytes(df):
@@ -111,6 +92,47 @@ def gerar_excel_bytes(df):
         df.to_excel(writer, index=False, sheet_name="estoque")
     return output.getvalue()
 
+# ----------------- Relatórios pré-calculados (tarefas.py) -----------------
+# tarefas.py e snapshots.py só são importados quando o repositório os
+# suporta (SQLite); com PostgreSQL o painel não depende deles
+def ler_artefato(situacao):
+    import tarefas
+    with open(tarefas.caminho_artefato(situacao["artefato"]), "rb") as f:
+        return f.read()
+
+def painel_relatorio(relatorio, parametros=None, chave=None):
+    # Download do arquivo gerado pelo worker, estado da tarefa e botão para
+    # gerar de novo. Nada é calculado dentro da sessão.
+    import tarefas
+    definicao = tarefas.RELATORIOS[relatorio]
+    chave = chave or relatorio
+    sit = tarefas.situacao(relatorio, parametros)
+    art, tarefa = sit["artefato"], sit["tarefa"]
+    ativa = tarefa is not None and tarefa["estado"] in ("pendente", "executando")
+
+    col_info, col_acao = st.columns([3, 1])
+    col_info.markdown(f"**{definicao['titulo']}**")
+    if art:
+        aviso = "" if sit["atualizado"] else " — os dados mudaram desde então"
+        col_info.caption(f"Gerado em {art['gerado_em']} ({art['tamanho'] / 1024:,.0f} KB){aviso}")
+        col_info.download_button("⬇️ Baixar", data=ler_artefato(sit), file_name=f"{relatorio}.{definicao['extensao']}",
+                                 mime=definicao["mime"], key=f"baixar_{chave}")
+    if ativa:
+        col_info.progress(tarefa["progresso"])
+        col_info.caption(tarefa["mensagem"] or ("Na fila" if tarefa["estado"] == "pendente" else "Gerando..."))
+        espera = pd.Timestamp.now() - pd.Timestamp(tarefa["criada_em"])
+        if tarefa["estado"] == "pendente" and espera > pd.Timedelta(minutes=1):
+            col_info.warning("Nenhum worker pegou a tarefa ainda — rode `python tarefas.py`.")
+        if col_acao.button("🔄 Atualizar", key=f"atualizar_{chave}"):
+            st.experimental_rerun()
+    else:
+        if tarefa is not None and tarefa["estado"] == "falhou":
+            col_info.error(f"Última geração falhou: {tarefa['mensagem']}")
+        if not sit["atualizado"] and col_acao.button("Gerar", key=f"gerar_{chave}"):
+            tarefas.solicitar(relatorio, parametros, usuario=st.session_state.user["nome"])
+            st.experimental_rerun()
+    return sit
+
 # ----------------- Streamlit UI -----------------
 st.set_page_config(page_title="Dashboard de Estoque - Finalzona", layout="wide")
 st.title("📦 Dashboard de Estoque — Finalzona")
@@ -158,11 +180,22 @@ def style_estoque(df, limite_baixo=5):
 # -------------------------------- Produtos --------------------------------
 if menu == "Produtos":
     st.subheader("📋 Produtos e Relatórios Rápidos")
-    df = carregar_produtos()
+    df_locais = carregar_locais()
+    locais_opcoes = ["Todos os locais"] + df_locais["nome"].tolist()
+    local_select = st.sidebar.selectbox("Local", locais_opcoes)
+    local_id = None
+    if local_select != "Todos os locais":
+        local_id = int(df_locais.loc[df_locais["nome"] == local_select, "id"].iloc[0])
+    df = carregar_produtos(local_id)
+
+    # Totais do local (ou da rede) vêm de totais_local, não de somar df
+    totais = carregar_totais_locais()
+    if local_id is not None:
+        totais = totais[totais["id"] == local_id]
 
     col1, col2, col3, col4 = st.columns(4)
-    total_itens = int(df["quantidade"].sum()) if not df.empty else 0
-    valor_total = float((df["quantidade"] * df["preco_unitario"]).sum()) if not df.empty else 0.0
+    total_itens = int(totais["quantidade"].sum()) if not totais.empty else 0
+    valor_total = float(totais["valor"].sum()) if not totais.empty else 0.0
     produtos_unicos = int(df.shape[0]) if not df.empty else 0
     estoque_baixo = int(df[df["quantidade"] <= 5].shape[0]) if not df.empty else 0
 
@@ -253,11 +286,36 @@ elif menu == "Cadastro":
         nome = st.text_input("Nome do produto")
         categoria = st.selectbox("Categoria", ["Alimentos", "Higiene Pessoal", "Eletrônicos", "Vestuário e Acessórios", "Limpeza", "Outros"])
         quantidade = st.number_input("Quantidade", min_value=0, value=0, step=1)
+        df_locais = carregar_locais()
+        local_cad = st.selectbox("Local do estoque inicial", df_locais["nome"].tolist())
+        validade_cad = lote_cad = None
+        if repo.suporta("lotes") and banco.categoria_com_lote(categoria):
+            validade_cad = st.date_input("Validade do lote")
+            lote_cad = st.text_input("Código do lote (opcional)")
     with col_right:
         preco = st.number_input("Preço unitário (R$)", min_value=0.0, value=0.0, step=0.01)
+        custo = 0.0
+        if repo.suporta("custos"):
+            custo = st.number_input("Custo unitário de compra (R$, 0 = usar o preço)", min_value=0.0, value=0.0, step=0.01)
         fornecedor = st.text_input("Fornecedor (opcional)")
+        # Aviso de provável duplicado pelo índice de trigramas
+        similares = []
+        if repo.suporta("duplicados") and nome.strip():
+            similares = repo.produtos_similares(nome.title().strip(), limite=5)
+        confirmar_dup = False
+        if similares:
+            st.warning("Produtos parecidos já cadastrados:\n\n" +
+                       "\n".join(f"- {n} ({cat}) — {sim:.0%}" for _pid, n, cat, sim in similares))
+            confirmar_dup = st.checkbox("Cadastrar mesmo assim")
         if st.button("Cadastrar produto"):
-            ok, msg = cadastrar_produto(nome, categoria, quantidade, preco, fornecedor)
+            if similares and not confirmar_dup:
+                st.error("Confirme que não é um produto duplicado.")
+                st.stop()
+            local_cad_id = int(df_locais.loc[df_locais["nome"] == local_cad, "id"].iloc[0])
+            ok, msg = cadastrar_produto(nome, categoria, quantidade, preco, fornecedor, local_cad_id,
+                                        lote=lote_cad or None,
+                                        validade=validade_cad.isoformat() if validade_cad else None,
+                                        custo_unitario=custo or None)
             if ok:
                 st.success(msg)
             else:
@@ -301,6 +359,28 @@ elif menu == "Deleção":
                 st.success("Produto deletado.")
                 st.experimental_rerun()
 
+            if repo.suporta("duplicados"):
+                st.markdown("---")
+                st.subheader("🔁 Produtos duplicados")
+                st.caption("O produto escolhido em cada grupo recebe estoque, lotes, custos e histórico dos demais, que são apagados.")
+                if st.button("Procurar duplicados"):
+                    st.session_state.grupos_duplicados = repo.grupos_duplicados()
+                grupos = st.session_state.get("grupos_duplicados")
+                if grupos is not None and not grupos:
+                    st.info("Nenhum duplicado encontrado.")
+                for n, membros in enumerate(grupos or [], 1):
+                    with st.expander(f"Grupo {n}: {membros[0][1]} ({len(membros)} produtos)"):
+                        st.table(pd.DataFrame(membros, columns=["id", "nome", "categoria", "quantidade"]))
+                        manter = st.selectbox("Manter", [m[0] for m in membros], key=f"dup_manter_{n}",
+                                              format_func=lambda pid, m=membros: next(f"{x[1]} (ID: {x[0]})" for x in m if x[0] == pid))
+                        if st.button("Mesclar grupo", key=f"dup_mesclar_{n}"):
+                            for pid, *_resto in membros:
+                                if pid != manter:
+                                    repo.mesclar_produtos(manter, pid, usuario=st.session_state.user["nome"])
+                            st.session_state.grupos_duplicados = repo.grupos_duplicados()
+                            st.success("Produtos mesclados.")
+                            st.experimental_rerun()
+
 # -------------------------------- Usuários --------------------------------
 elif menu == "Usuários":
     if not st.session_state.user:
@@ -339,19 +419,125 @@ elif menu == "Relatórios":
         st.stop()
 
     st.subheader("📑 Relatórios e Resumos")
-    df = carregar_produtos()
-    if df.empty:
+    if repo.contar_produtos() == 0:
         st.info("Sem dados para gerar relatório.")
         st.stop()
 
-    total_valor = (df["quantidade"] * df["preco_unitario"]).sum()
+    totais = carregar_totais_locais()
+    total_valor = totais["valor"].sum()
     st.metric("Valor total em estoque", f"R${total_valor:,.2f}")
+    st.write("Estoque por local:")
+    st.table(totais.drop(columns=["id"]))
     st.write("Produtos por categoria:")
-    st.table(df.groupby("categoria")[["quantidade"]].sum().reset_index())
+    # Lotes, custos, previsão, snapshots e a fila de relatórios só existem no SQLite
+    if repo.suporta("tarefas"):
+        sit_categorias = painel_relatorio("resumo_categorias")
+        if sit_categorias["artefato"]:
+            st.table(pd.read_csv(io.BytesIO(ler_artefato(sit_categorias))))
+    else:
+        st.table(carregar_produtos().groupby("categoria")[["quantidade"]].sum().reset_index())
+
+    if repo.suporta("lotes"):
+        st.markdown("### ⏳ Lotes a vencer")
+        col_dias, col_venc = st.columns(2)
+        dias = col_dias.number_input("Vencendo em até (dias)", min_value=0, value=30, step=1)
+        incluir_vencidos = col_venc.checkbox("Incluir lotes já vencidos", value=True)
+        df_lotes = pd.DataFrame(
+            repo.lotes_a_vencer(int(dias), incluir_vencidos=incluir_vencidos),
+            columns=["lote_id", "produto", "categoria", "local", "lote", "validade", "quantidade", "dias_restantes"],
+        )
+        if df_lotes.empty:
+            st.info("Nenhum lote vencendo no período.")
+        else:
+            st.dataframe(df_lotes.drop(columns=["lote_id"]), use_container_width=True)
+
+    if repo.suporta("custos"):
+        st.markdown("### 💰 Valoração do estoque (custo)")
+        valor_medio, valor_fifo, cmv_medio, cmv_fifo = repo.valoracao_total()
+        col_v1, col_v2, col_v3, col_v4 = st.columns(4)
+        col_v1.metric("Valor a custo médio", f"R${valor_medio:,.2f}")
+        col_v2.metric("Valor FIFO", f"R${valor_fifo:,.2f}")
+        col_v3.metric("CMV acumulado (médio)", f"R${cmv_medio:,.2f}")
+        col_v4.metric("CMV acumulado (FIFO)", f"R${cmv_fifo:,.2f}")
+
+        periodo = st.date_input("CMV no período", value=(pd.Timestamp.today().replace(day=1).date(), pd.Timestamp.today().date()))
+        if isinstance(periodo, (list, tuple)) and len(periodo) == 2:
+            cmv_p_medio, cmv_p_fifo = repo.cmv_periodo(periodo[0].isoformat(), periodo[1].isoformat())
+            st.write(f"CMV no período: **R${cmv_p_medio:,.2f}** (custo médio) · **R${cmv_p_fifo:,.2f}** (FIFO)")
+
+        df_val = pd.DataFrame(repo.valoracao_produtos(limit=200),
+                              columns=["id", "nome", "categoria", "quantidade", "custo_medio", "valor_medio", "valor_fifo"])
+        if not df_val.empty:
+            st.write("Maiores valores em estoque (a custo):")
+            st.dataframe(df_val.drop(columns=["id"]), use_container_width=True)
+
+    if repo.suporta("previsao"):
+        st.markdown("### 🔮 Previsão de demanda")
+        df_prev = pd.DataFrame(repo.listar_previsoes(),
+                               columns=["nome", "categoria", "quantidade", "demanda_diaria", "demanda_horizonte",
+                                        "horizonte_dias", "modelo", "gerado_em"])
+        if df_prev.empty:
+            st.info("Nenhuma previsão gerada ainda (rode `python previsao.py`).")
+        else:
+            st.caption(f"Gerada em {df_prev['gerado_em'].iloc[0]} — horizonte de {df_prev['horizonte_dias'].iloc[0]} dias")
+            df_prev["dias_cobertura"] = (df_prev["quantidade"] / df_prev["demanda_diaria"]).round(1)
+            df_prev["falta_no_horizonte"] = (df_prev["demanda_horizonte"] - df_prev["quantidade"]).clip(lower=0).round(0)
+            st.dataframe(df_prev.drop(columns=["gerado_em", "horizonte_dias"]).sort_values("dias_cobertura"),
+                         use_container_width=True)
+
+    if repo.suporta("snapshots"):
+        st.markdown("### 📈 Histórico de movimentações")
+        # Lido dos snapshots Parquet (python snapshots.py), não do banco em uso
+        import snapshots
+        manifesto = snapshots.carregar_manifesto()
+        if st.button("Atualizar snapshot agora"):
+            with st.spinner("Exportando movimentações novas..."):
+                resumo = snapshots.atualizar()
+            st.success(f"{resumo['movimentacoes_novas']} movimentações novas exportadas em {resumo['duracao_s']}s.")
+            manifesto = snapshots.carregar_manifesto()
+        if manifesto is None or not manifesto["movimentacoes"]:
+            st.info("Nenhum snapshot gerado ainda (rode `python snapshots.py`).")
+        else:
+            st.caption(f"Snapshot de {manifesto['gerado_em']}")
+            hoje = pd.Timestamp.today().date()
+            periodo_hist = st.date_input("Período do histórico", value=((pd.Timestamp.today() - pd.DateOffset(months=12)).date(), hoje))
+            if isinstance(periodo_hist, (list, tuple)) and len(periodo_hist) == 2:
+                mov = snapshots.ler_movimentacoes(
+                    ["data_hora", "produto_id", "quantidade", "tipo", "transferencia_id"],
+                    periodo_hist[0].isoformat(), periodo_hist[1].isoformat(),
+                ).to_pandas()
+                mov = mov[mov["transferencia_id"].isna()]
+                if mov.empty:
+                    st.info("Sem movimentações no período.")
+                else:
+                    mov["mes"] = mov["data_hora"].dt.strftime("%Y-%m")
+                    por_mes = mov.groupby(["mes", "tipo"])["quantidade"].sum().reset_index()
+                    fig_mes = px.bar(por_mes, x="mes", y="quantidade", color="tipo", barmode="group",
+                                     title="Entradas e saídas por mês", labels={"mes": "Mês", "quantidade": "Quantidade"})
+                    st.plotly_chart(fig_mes, use_container_width=True)
+
+                    nomes = snapshots.ler_produtos(["id", "nome", "categoria"]).to_pandas()
+                    saidas = mov[mov["tipo"] == "saida"].groupby("produto_id")["quantidade"].sum()
+                    mais_vendidos = (saidas.sort_values(ascending=False).head(20).reset_index()
+                                     .merge(nomes, left_on="produto_id", right_on="id", how="left"))
+                    st.write("Produtos com mais saídas no período:")
+                    st.dataframe(mais_vendidos[["nome", "categoria", "quantidade"]], use_container_width=True)
 
     st.markdown("### ⬇️ Downloads")
-    st.download_button("Baixar CSV (completo)", data=gerar_csv_bytes(df), file_name="estoque_completo.csv", mime="text/csv")
-    st.download_button("Baixar Excel (completo)", data=gerar_excel_bytes(df), file_name="estoque_completo.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    if repo.suporta("tarefas"):
+        # Gerados em segundo plano pelo worker (python tarefas.py); enquanto os
+        # dados não mudam, o arquivo pronto é servido direto
+        painel_relatorio("estoque_csv")
+        painel_relatorio("estoque_xlsx")
+        periodo_mov = st.date_input("Período das movimentações",
+                                    value=(pd.Timestamp.today().replace(day=1).date(), pd.Timestamp.today().date()),
+                                    key="periodo_movimentacoes")
+        if isinstance(periodo_mov, (list, tuple)) and len(periodo_mov) == 2:
+            painel_relatorio("movimentacoes", {"inicio": periodo_mov[0].isoformat(), "fim": periodo_mov[1].isoformat()})
+    else:
+        df = carregar_produtos()
+        st.download_button("Baixar CSV (completo)", data=gerar_csv_bytes(df), file_name="estoque_completo.csv", mime="text/csv")
+        st.download_button("Baixar Excel (completo)", data=gerar_excel_bytes(df), file_name="estoque_completo.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
 
 # ----------------- Fim -----------------
 st.markdown("---")
@@ -0,0 +1,216 @@
+# duplicados.py
+# Detecção de produtos quase duplicados ("Arroz 5kg" x "Arroz 5 Kg") por
+# similaridade de trigramas (Jaccard) sobre o nome normalizado.
+# O índice invertido fica em `trigramas` (ver banco._migracao_trigramas) e é
+# mantido por banco.py; as funções recebem o cursor da transação.
+import re
+import math
+import itertools
+import unicodedata
+
+# Similaridade mínima para considerar dois nomes o mesmo produto
+LIMIAR_SIMILARIDADE = 0.6
+
+# Entradas do índice que a busca no cadastro pode ler além do mínimo
+LEITURAS_SIMILARES = 300000
+
+UNIDADES = {
+    "kg": "kg", "kgs": "kg", "quilo": "kg", "quilos": "kg",
+    "g": "g", "gr": "g", "grs": "g", "gramas": "g",
+    "mg": "mg",
+    "l": "l", "lt": "l", "lts": "l", "litro": "l", "litros": "l",
+    "ml": "ml",
+    "un": "un", "und": "un", "unid": "un", "unidades": "un",
+    "cm": "cm", "mm": "mm", "m": "m",
+}
+_RE_MEDIDA = re.compile(r"(\d+(?:[.,]\d+)?)\s*([a-z]+)\b")
+_RE_SEPARADORES = re.compile(r"[^a-z0-9.]+")
+
+
+# ---------------- Normalização ----------------
+def normalizar(nome):
+    # Minúsculas, sem acentos, medidas juntas e com unidade canônica
+    # ("5 Kg" -> "5kg", "1,5 Litros" -> "1.5l"), pontuação vira espaço
+    texto = unicodedata.normalize("NFKD", nome or "")
+    texto = "".join(c for c in texto if not unicodedata.combining(c)).casefold()
+
+    def medida(m):
+        unidade = UNIDADES.get(m.group(2))
+        if unidade is None:
+            return m.group(0)
+        return m.group(1).replace(",", ".") + unidade
+
+    texto = _RE_MEDIDA.sub(medida, texto)
+    texto = _RE_SEPARADORES.sub(" ", texto)
+    return " ".join(p.strip(".") for p in texto.split() if p.strip("."))
+
+
+def trigramas(nome_normalizado):
+    # Trigramas de cada palavra com bordas (" ar", "arr", ..., "oz "), para
+    # que a ordem das palavras pese pouco
+    grams = set()
+    for palavra in nome_normalizado.split():
+        p = f" {palavra} "
+        grams.update(p[i:i + 3] for i in range(len(p) - 2))
+    return grams
+
+
+def similaridade(a, b):
+    # Jaccard entre dois conjuntos de trigramas
+    if not a or not b:
+        return 0.0
+    comuns = len(a & b)
+    return comuns / (len(a) + len(b) - comuns)
+
+
+def _minimo_comuns(n, limiar):
+    # Jaccard >= limiar exige pelo menos ceil(limiar * n) trigramas em comum
+    return max(1, math.ceil(limiar * n - 1e-9))
+
+
+# ---------------- Índice ----------------
+def indexar(cur, produto_id, nome):
+    # (Re)indexa o nome do produto
+    norm = normalizar(nome)
+    grams = trigramas(norm)
+    cur.execute("DELETE FROM trigramas WHERE produto_id = ?", (produto_id,))
+    cur.execute("""
+        INSERT INTO nomes_produto (produto_id, nome_normalizado, n_trigramas) VALUES (?, ?, ?)
+        ON CONFLICT(produto_id) DO UPDATE SET
+            nome_normalizado = excluded.nome_normalizado, n_trigramas = excluded.n_trigramas
+    """, (produto_id, norm, len(grams)))
+    cur.executemany("INSERT INTO trigramas (trigrama, produto_id) VALUES (?, ?)",
+                    [(g, produto_id) for g in grams])
+
+
+def similares(cur, nome, limiar=LIMIAR_SIMILARIDADE, excluir_id=None, limite=10):
+    # Produtos com nome parecido, do mais para o menos similar:
+    # [(produto_id, nome, categoria, similaridade)].
+    # Só as listas dos trigramas mais raros do nome são lidas: um nome com
+    # similaridade >= limiar precisa conter ao menos um dos n - mínimo + 1
+    # mais raros. Ler mais alguns (até LEITURAS_SIMILARES entradas) permite
+    # exigir mais trigramas em comum já no SQL e verificar menos candidatos.
+    grams = trigramas(normalizar(nome))
+    if not grams:
+        return []
+    n = len(grams)
+    minimo = _minimo_comuns(n, limiar)
+    cur.execute(f"SELECT trigrama, COUNT(*) FROM trigramas WHERE trigrama IN ({','.join('?' * n)}) GROUP BY trigrama",
+                list(grams))
+    frequencia = dict(cur.fetchall())
+    ordenados = sorted(grams, key=lambda g: frequencia.get(g, 0))
+    m = n - minimo + 1
+    lidos = sum(frequencia.get(g, 0) for g in ordenados[:m])
+    while m < n and lidos + frequencia.get(ordenados[m], 0) <= max(LEITURAS_SIMILARES, lidos):
+        lidos += frequencia.get(ordenados[m], 0)
+        m += 1
+    usados = [g for g in ordenados[:m] if frequencia.get(g)]
+    if not usados:
+        return []
+
+    # em comum >= mínimo exige, entre os m lidos, ao menos mínimo - (n - m)
+    cur.execute(f"""
+        SELECT n.produto_id, n.nome_normalizado
+        FROM (
+            SELECT produto_id FROM trigramas
+            WHERE trigrama IN ({",".join("?" * len(usados))})
+            GROUP BY produto_id
+            HAVING COUNT(*) >= ?
+        ) c
+        JOIN nomes_produto n ON n.produto_id = c.produto_id
+        WHERE n.n_trigramas BETWEEN ? AND ?
+    """, usados + [max(1, minimo - (n - m)), limiar * n - 1e-9, n / limiar + 1e-9])
+    achados = {}
+    for pid, norm in cur.fetchall():
+        if pid == excluir_id:
+            continue
+        s = similaridade(grams, trigramas(norm))
+        if s >= limiar:
+            achados[pid] = round(s, 3)
+    melhores = sorted(achados, key=lambda pid: -achados[pid])[:limite]
+    if not melhores:
+        return []
+    cur.execute(f"SELECT id, nome, categoria FROM produtos WHERE id IN ({','.join('?' * len(melhores))})", melhores)
+    nomes = {row[0]: row[1:] for row in cur.fetchall()}
+    return [(pid,) + nomes[pid] + (achados[pid],) for pid in melhores if pid in nomes]
+
+
+def grupos_duplicados(cur, limiar=LIMIAR_SIMILARIDADE):
+    # Varredura do catálogo inteiro sem comparar todos os pares (PPJoin):
+    # trigramas de cada nome em ordem de frequência global (raros primeiro) e
+    # nomes em ordem de tamanho. Dois nomes com similaridade >= limiar sempre
+    # compartilham um trigrama dos seus prefixos, e a posição desse trigrama
+    # limita quantos ainda podem coincidir; só os pares que passam por esses
+    # filtros têm a similaridade calculada.
+    # Devolve grupos (componentes conexos) de produtos:
+    # [[(produto_id, nome, categoria, quantidade), ...], ...], maiores primeiro.
+    cur.execute("SELECT trigrama, COUNT(*) FROM trigramas GROUP BY trigrama")
+    ordem = {g: i for i, (g, _freq) in enumerate(sorted(cur.fetchall(), key=lambda r: (r[1], r[0])))}
+    cur.execute("""
+        SELECT n.produto_id, n.nome_normalizado, p.nome, p.categoria, p.quantidade
+        FROM nomes_produto n JOIN produtos p ON p.id = n.produto_id
+    """)
+    produtos = {}
+    registros = []
+    for pid, norm, nome, categoria, quantidade in cur.fetchall():
+        produtos[pid] = (nome, categoria, quantidade)
+        tokens = sorted(ordem[g] for g in trigramas(norm) if g in ordem)
+        if tokens:
+            registros.append((len(tokens), pid, tokens))
+    registros.sort()
+
+    pai = {pid: pid for pid in produtos}
+
+    def raiz(x):
+        while pai[x] != x:
+            pai[x] = pai[pai[x]]
+            x = pai[x]
+        return x
+
+    indice = {}
+    inicio = {}      # por trigrama: entradas curtas demais para os nomes seguintes
+    conjuntos = {}
+    fator = limiar / (1 + limiar)
+    for tamanho, pid, tokens in registros:
+        conjuntos[pid] = conjunto = set(tokens)
+        menor = limiar * tamanho - 1e-9
+        prefixo = tamanho - _minimo_comuns(tamanho, limiar) + 1
+        # trigramas em comum exigidos com um nome de cada tamanho (os já
+        # indexados nunca são maiores que este)
+        alfa = [math.ceil(fator * (tamanho + t) - 1e-9) for t in range(tamanho + 1)]
+        comuns = {}
+        for i in range(prefixo):
+            lista = indice.get(tokens[i])
+            if not lista:
+                continue
+            k = inicio.get(tokens[i], 0)
+            while k < len(lista) and lista[k][1] < menor:
+                k += 1
+            inicio[tokens[i]] = k
+            resto = tamanho - i - 1
+            for outro, tamanho_outro, j in itertools.islice(lista, k, None):
+                c = comuns.get(outro, 0)
+                if c < 0:
+                    continue
+                restante = tamanho_outro - j - 1
+                if c + 1 + (resto if resto < restante else restante) >= alfa[tamanho_outro]:
+                    comuns[outro] = c + 1
+                else:
+                    comuns[outro] = -1
+        for outro, c in comuns.items():
+            if c > 0 and similaridade(conjunto, conjuntos[outro]) >= limiar:
+                pai[raiz(pid)] = raiz(outro)
+        # os próximos nomes são maiores: basta indexar um prefixo menor
+        indexados = tamanho - math.ceil(2 * fator * tamanho - 1e-9) + 1
+        for i in range(indexados):
+            indice.setdefault(tokens[i], []).append((pid, tamanho, i))
+
+    grupos = {}
+    for pid in produtos:
+        grupos.setdefault(raiz(pid), []).append(pid)
+    resultado = [
+        [(pid,) + produtos[pid] for pid in sorted(membros)]
+        for membros in grupos.values() if len(membros) > 1
+    ]
+    resultado.sort(key=lambda g: (-len(g), g[0][0]))
+    return resultado
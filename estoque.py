@@ -0,0 +1,381 @@
+# estoque.py
+# Linha de comando do estoque, sem interface gráfica: só importa o
+# repositório (nunca tkinter, streamlit ou plotly), então abre rápido e serve
+# para rotinas noturnas e pipelines. Saídas em CSV ou JSON lines, linha a linha.
+# Usa o mesmo banco dos apps (ESTOQUE_DB_URL); lotes, custos, duplicados,
+# backup, snapshots e previsão só existem no SQLite.
+#
+#   python -m estoque produtos --local "Loja Centro" > produtos.csv
+#   python -m estoque movimentar entradas.csv --usuario noturno
+#   python -m estoque movimentacoes --desde 2024-01-01 --formato jsonl | gzip > mov.jsonl.gz
+import os
+import sys
+import csv
+import json
+import argparse
+
+import banco
+import duplicados
+import repositorio
+
+# Repositório aberto em main (SQLite ou PostgreSQL)
+repo = None
+
+
+# ---------------- Saída ----------------
+def _escritor(formato, campos, saida=sys.stdout):
+    # Devolve uma função que grava uma linha (tupla na ordem de `campos`)
+    if formato == "jsonl":
+        def escrever(linha):
+            saida.write(json.dumps(dict(zip(campos, linha)), ensure_ascii=False) + "\n")
+    else:
+        writer = csv.writer(saida)
+        writer.writerow(campos)
+        escrever = writer.writerow
+    return escrever
+
+
+def _emitir(args, campos, linhas):
+    escrever = _escritor(args.formato, campos)
+    for linha in linhas:
+        escrever(linha)
+
+
+def _exigir(recurso, comando):
+    if not repo.suporta(recurso):
+        raise ValueError(f"'{comando}' só está disponível no banco SQLite ({repo.descricao()}).")
+
+
+def _erros_linha():
+    # Erros que marcam uma linha do arquivo como falha sem parar o lote
+    # (inclui "database is locked" enquanto outro app grava)
+    return (ValueError, TypeError, repositorio.ErroIntegridade) + repo.erros_banco
+
+
+# ---------------- Locais e produtos ----------------
+def _resolver_local(valor):
+    # Aceita id ou nome do local; None = todos / padrão
+    if valor is None:
+        return None
+    for local_id, nome, _tipo in repo.listar_locais():
+        if str(local_id) == str(valor) or nome.casefold() == str(valor).casefold():
+            return local_id
+    raise ValueError(f"Local não encontrado: {valor}")
+
+
+def _resolver_produto(valor):
+    # Código de barras tem prioridade; depois, id numérico
+    valor = str(valor).strip()
+    row = repo.buscar_produto_por_codigo(valor)
+    if row:
+        return row[0]
+    if valor.isdigit() and repo.obter_produto(int(valor)) is not None:
+        return int(valor)
+    raise ValueError(f"Produto não encontrado: {valor}")
+
+
+# ---------------- Comandos de consulta ----------------
+def cmd_produtos(args):
+    campos = ("id", "nome", "categoria", "quantidade", "preco_unitario", "fornecedor", "codigo_barras")
+    _emitir(args, campos, repo.listar_produtos(_resolver_local(args.local)))
+
+
+def cmd_consultar(args):
+    # Estoque de um produto: uma linha por local, com os lotes quando houver
+    campos = ("produto_id", "nome", "local", "quantidade", "lote", "validade", "quantidade_lote")
+    escrever = _escritor(args.formato, campos)
+    for valor in args.produtos:
+        pid = _resolver_produto(valor)
+        nome = repo.obter_produto(pid)["nome"]
+        for local_id, local, qtd in repo.estoque_por_local(pid):
+            lotes = repo.listar_lotes(pid, local_id) if repo.suporta("lotes") else []
+            if not lotes:
+                escrever((pid, nome, local, qtd, None, None, None))
+            for _lote_id, _local, codigo, validade, qtd_lote in lotes:
+                escrever((pid, nome, local, qtd, codigo, validade, qtd_lote))
+
+
+def cmd_movimentacoes(args):
+    campos = ("id", "data_hora", "tipo", "produto_id", "produto", "quantidade", "local", "usuario",
+              "observacao", "transferencia_id", "custo_unitario")
+    _emitir(args, campos, repo.iterar_movimentacoes(_resolver_local(args.local), args.desde, args.ate))
+
+
+def cmd_locais(args):
+    campos = ("id", "nome", "tipo", "quantidade", "valor", "produtos")
+    _emitir(args, campos, repo.totais_por_local())
+
+
+def cmd_lotes(args):
+    _exigir("lotes", "lotes")
+    campos = ("lote_id", "produto", "categoria", "local", "codigo", "validade", "quantidade", "dias_restantes")
+    _emitir(args, campos, repo.lotes_a_vencer(args.dias, _resolver_local(args.local), not args.sem_vencidos))
+
+
+def cmd_valoracao(args):
+    _exigir("custos", "valoracao")
+    campos = ("id", "nome", "categoria", "quantidade", "custo_medio", "valor_medio", "valor_fifo")
+    _emitir(args, campos, repo.valoracao_produtos(args.limite))
+
+
+def cmd_cmv(args):
+    _exigir("custos", "cmv")
+    campos = ("inicio", "fim", "cmv_medio", "cmv_fifo")
+    _emitir(args, campos, [(args.inicio, args.fim) + tuple(repo.cmv_periodo(args.inicio, args.fim))])
+
+
+# ---------------- Movimentações em lote ----------------
+def _ler_registros(caminho):
+    # CSV com cabeçalho ou JSON lines (um objeto por linha); "-" lê do stdin.
+    # Devolve (número da linha, dict).
+    arquivo = sys.stdin if caminho == "-" else open(caminho, encoding="utf-8-sig", newline="")
+    try:
+        primeira = arquivo.readline()
+        if primeira.lstrip().startswith("{"):
+            yield 1, json.loads(primeira)
+            for n, linha in enumerate(arquivo, 2):
+                if linha.strip():
+                    yield n, json.loads(linha)
+        else:
+            leitor = csv.DictReader(arquivo, fieldnames=next(csv.reader([primeira])))
+            for n, registro in enumerate(leitor, 2):
+                yield n, registro
+    finally:
+        if arquivo is not sys.stdin:
+            arquivo.close()
+
+
+def _vazio(valor):
+    return valor is None or str(valor).strip() == ""
+
+
+def _aplicar(registro, usuario, local_padrao):
+    # Uma linha do arquivo: produto (código de barras ou id), quantidade, tipo
+    # (entrada, saida, transferencia) e, opcionalmente, local, destino, lote,
+    # validade, custo e observacao. Devolve (produto_id, quantidade resultante).
+    pid = _resolver_produto(registro.get("produto") or registro.get("codigo_barras") or registro.get("produto_id"))
+    quantidade = int(registro.get("quantidade"))
+    tipo = str(registro.get("tipo", "")).strip().lower()
+    local_id = local_padrao if _vazio(registro.get("local")) else _resolver_local(registro["local"])
+    observacao = None if _vazio(registro.get("observacao")) else registro["observacao"]
+
+    if tipo == "transferencia":
+        if local_id is None or _vazio(registro.get("destino")):
+            raise ValueError("Transferência precisa de local e destino.")
+        destino_id = _resolver_local(registro["destino"])
+        repo.transferir_estoque(pid, quantidade, local_id, destino_id, usuario=usuario, observacao=observacao)
+        return pid, dict((l[0], l[2]) for l in repo.estoque_por_local(pid)).get(destino_id, 0)
+
+    custo = None if _vazio(registro.get("custo")) else float(registro["custo"])
+    nova = repo.inserir_movimentacao(
+        pid, quantidade, tipo, usuario=usuario, observacao=observacao, local_id=local_id,
+        lote=None if _vazio(registro.get("lote")) else registro["lote"],
+        validade=None if _vazio(registro.get("validade")) else registro["validade"],
+        custo_unitario=custo,
+    )
+    return pid, nova
+
+
+def cmd_movimentar(args):
+    # Cada linha é gravada na sua própria transação; linhas com erro são
+    # reportadas e não impedem as seguintes (a menos que --parar-no-erro)
+    if args.snapshot:
+        _exigir("snapshots", "movimentar --snapshot")
+    local_padrao = _resolver_local(args.local)
+    escrever = _escritor(args.formato, ("linha", "ok", "produto_id", "quantidade_local", "erro"))
+    falhas = 0
+    for n, registro in _ler_registros(args.arquivo):
+        try:
+            pid, nova = _aplicar(registro, args.usuario, local_padrao)
+            escrever((n, True, pid, nova, None))
+        except _erros_linha() as e:
+            falhas += 1
+            escrever((n, False, None, None, str(e)))
+            if args.parar_no_erro:
+                break
+    if args.snapshot:
+        import snapshots
+        snapshots.atualizar()
+    return 1 if falhas else 0
+
+
+# ---------------- Cadastro em lote e duplicados ----------------
+def cmd_cadastrar(args):
+    # Produtos de um arquivo CSV/JSONL (nome, categoria, quantidade, preco,
+    # fornecedor, codigo_barras, local, validade, lote, custo). Nomes parecidos
+    # com produtos existentes são apontados em "similares" e, com
+    # --pular-duplicados, não são cadastrados.
+    escrever = _escritor(args.formato, ("linha", "ok", "produto_id", "similares", "erro"))
+    falhas = 0
+    for n, registro in _ler_registros(args.arquivo):
+        try:
+            nome = str(registro.get("nome") or "").strip()
+            if not nome:
+                raise ValueError("Nome é obrigatório.")
+            similares = []
+            if repo.suporta("duplicados"):
+                similares = repo.produtos_similares(nome, limite=5, limiar=args.limiar)
+            ids_similares = " ".join(str(s[0]) for s in similares) or None
+            if similares and args.pular_duplicados:
+                escrever((n, False, None, ids_similares, "Possível duplicado."))
+                continue
+            pid = repo.inserir_produto(
+                nome, str(registro.get("categoria") or "Outros").strip(),
+                int(registro.get("quantidade") or 0), float(registro.get("preco") or 0),
+                None if _vazio(registro.get("fornecedor")) else registro["fornecedor"],
+                local_id=_resolver_local(registro.get("local") or args.local),
+                codigo_barras=None if _vazio(registro.get("codigo_barras")) else str(registro["codigo_barras"]).strip(),
+                lote=None if _vazio(registro.get("lote")) else registro["lote"],
+                validade=None if _vazio(registro.get("validade")) else registro["validade"],
+                custo_unitario=None if _vazio(registro.get("custo")) else float(registro["custo"]),
+            )
+            escrever((n, True, pid, ids_similares, None))
+        except _erros_linha() as e:
+            falhas += 1
+            escrever((n, False, None, None, str(e)))
+    return 1 if falhas else 0
+
+
+def cmd_duplicados(args):
+    # Uma linha por produto, com o número do grupo de prováveis duplicados
+    _exigir("duplicados", "duplicados")
+    escrever = _escritor(args.formato, ("grupo", "produto_id", "nome", "categoria", "quantidade"))
+    for n, membros in enumerate(repo.grupos_duplicados(args.limiar), 1):
+        for membro in membros:
+            escrever((n,) + tuple(membro))
+
+
+def cmd_mesclar(args):
+    _exigir("duplicados", "mesclar")
+    manter = _resolver_produto(args.manter)
+    escrever = _escritor(args.formato, ("mantido", "removido"))
+    for valor in args.remover:
+        remover = _resolver_produto(valor)
+        repo.mesclar_produtos(manter, remover, usuario=args.usuario)
+        escrever((manter, remover))
+
+
+# ---------------- Rotinas ----------------
+def cmd_backup(args):
+    _exigir("backup", "backup")
+    import backup
+    info = backup.fazer_backup()
+    _emitir(args, tuple(info), [tuple(info.values())])
+
+
+def cmd_snapshot(args):
+    # pyarrow só é carregado aqui
+    _exigir("snapshots", "snapshot")
+    import snapshots
+    resumo = snapshots.atualizar(completo=args.completo)
+    _emitir(args, tuple(resumo), [tuple(resumo.values())])
+
+
+def cmd_previsao(args):
+    # numpy só é carregado aqui
+    _exigir("previsao", "previsao")
+    import previsao
+    resumo = previsao.prever(horizonte=args.horizonte or previsao.HORIZONTE_DIAS)
+    _emitir(args, tuple(resumo), [tuple(resumo.values())])
+
+
+# ---------------- Linha de comando ----------------
+def _parser():
+    parser = argparse.ArgumentParser(prog="python -m estoque", description="Estoque pela linha de comando.")
+    padrao = os.environ.get("ESTOQUE_DB_URL") or os.environ.get("ESTOQUE_DB", banco.DB_PATH)
+    parser.add_argument("--banco", default=padrao,
+                        help="arquivo SQLite ou URL postgresql:// (padrão: $ESTOQUE_DB_URL, $ESTOQUE_DB ou estoque.db)")
+    parser.add_argument("--formato", choices=("csv", "jsonl"), default="csv")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("produtos", help="lista produtos (quantidade da rede ou de um local)")
+    p.add_argument("--local")
+    p.set_defaults(func=cmd_produtos)
+
+    p = sub.add_parser("consultar", help="estoque e lotes por local de um ou mais produtos")
+    p.add_argument("produtos", nargs="+", help="código de barras ou id")
+    p.set_defaults(func=cmd_consultar)
+
+    p = sub.add_parser("movimentar", help="aplica movimentações de um arquivo CSV/JSONL ('-' = stdin)")
+    p.add_argument("arquivo")
+    p.add_argument("--usuario", default="cli")
+    p.add_argument("--local", help="local usado nas linhas sem local")
+    p.add_argument("--parar-no-erro", action="store_true")
+    p.add_argument("--snapshot", action="store_true", help="atualiza os snapshots Parquet ao final")
+    p.set_defaults(func=cmd_movimentar)
+
+    p = sub.add_parser("cadastrar", help="cadastra produtos de um arquivo CSV/JSONL, apontando duplicados")
+    p.add_argument("arquivo")
+    p.add_argument("--local", help="local do estoque inicial nas linhas sem local")
+    p.add_argument("--limiar", type=float, default=duplicados.LIMIAR_SIMILARIDADE)
+    p.add_argument("--pular-duplicados", action="store_true")
+    p.set_defaults(func=cmd_cadastrar)
+
+    p = sub.add_parser("duplicados", help="grupos de produtos com nomes parecidos")
+    p.add_argument("--limiar", type=float, default=duplicados.LIMIAR_SIMILARIDADE)
+    p.set_defaults(func=cmd_duplicados)
+
+    p = sub.add_parser("mesclar", help="junta produtos duplicados em um (estoque, lotes, custos e histórico)")
+    p.add_argument("manter", help="código de barras ou id do produto mantido")
+    p.add_argument("remover", nargs="+")
+    p.add_argument("--usuario", default="cli")
+    p.set_defaults(func=cmd_mesclar)
+
+    p = sub.add_parser("movimentacoes", help="exporta o histórico de movimentações")
+    p.add_argument("--local")
+    p.add_argument("--desde", help="AAAA-MM-DD")
+    p.add_argument("--ate", help="AAAA-MM-DD")
+    p.set_defaults(func=cmd_movimentacoes)
+
+    p = sub.add_parser("locais", help="totais por local")
+    p.set_defaults(func=cmd_locais)
+
+    p = sub.add_parser("lotes", help="lotes a vencer")
+    p.add_argument("--dias", type=int, default=30)
+    p.add_argument("--local")
+    p.add_argument("--sem-vencidos", action="store_true")
+    p.set_defaults(func=cmd_lotes)
+
+    p = sub.add_parser("valoracao", help="valor do estoque por produto (custo médio e FIFO)")
+    p.add_argument("--limite", type=int)
+    p.set_defaults(func=cmd_valoracao)
+
+    p = sub.add_parser("cmv", help="custo das mercadorias vendidas no período")
+    p.add_argument("inicio", help="AAAA-MM-DD")
+    p.add_argument("fim", help="AAAA-MM-DD")
+    p.set_defaults(func=cmd_cmv)
+
+    p = sub.add_parser("backup", help="faz um backup agora")
+    p.set_defaults(func=cmd_backup)
+
+    p = sub.add_parser("snapshot", help="atualiza os snapshots Parquet usados nas análises")
+    p.add_argument("--completo", action="store_true", help="refaz todas as partições")
+    p.set_defaults(func=cmd_snapshot)
+
+    p = sub.add_parser("previsao", help="recalcula a previsão de demanda")
+    p.add_argument("--horizonte", type=int, help="dias (padrão: previsao.HORIZONTE_DIAS)")
+    p.set_defaults(func=cmd_previsao)
+    return parser
+
+
+def main(argv=None):
+    global repo
+    args = _parser().parse_args(argv)
+    repo = repositorio.abrir(args.banco)
+    try:
+        repo.inicializar()
+        return args.func(args) or 0
+    except ValueError as e:
+        print(f"Erro: {e}", file=sys.stderr)
+        return 2
+    except BrokenPipeError:
+        # Saída cortada por `head` etc.: o que restar no buffer vai para
+        # /dev/null, senão o interpretador falha de novo ao sair
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    finally:
+        repo.fechar()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
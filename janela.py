@@ -1,182 +1,131 @@
 # estoque_app.py
 import os
-import sqlite3
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
 import subprocess
 import shutil
-from datetime import datetime
-
-# ---------------- Configurações ----------------
-BASE_DIR = os.path.abspath(os.path.dirname(__file__))
-DB_PATH = os.path.join(BASE_DIR, "estoque.db")
-
-DEFAULT_ADMIN_USER = "admin"
-DEFAULT_ADMIN_PASS = "123"
+import threading
+
+from banco import BASE_DIR, DEFAULT_ADMIN_USER, DEFAULT_ADMIN_PASS, categoria_com_lote
+import backup
+import repositorio
+
+# SQLite ou PostgreSQL, conforme ESTOQUE_DB_URL
+repo = repositorio.obter()
+
+# Modo leitura: o lote em memória é gravado a cada N leituras ou após um
+# intervalo sem leituras, o que vier primeiro
+LEITURA_LOTE_MAX = 25
+LEITURA_LOTE_MS = 1500
+
+# ---------------- Lotes ----------------
+def pedir_lote(parent, nome):
+    # Pede validade (obrigatória) e código do lote; None se cancelar
+    validade = simpledialog.askstring("Lote", f"Validade do lote de '{nome}' (AAAA-MM-DD):", parent=parent)
+    if validade is None:
+        return None
+    lote = simpledialog.askstring("Lote", "Código do lote (opcional):", parent=parent)
+    return (lote or "").strip() or None, validade.strip()
+
+# ---------------- Duplicados ----------------
+def confirmar_duplicados(parent, nome, excluir_id=None):
+    # Avisa se já existem produtos com nome parecido; True para seguir
+    if not repo.suporta("duplicados"):
+        return True
+    similares = repo.produtos_similares(nome, excluir_id=excluir_id, limite=5)
+    if not similares:
+        return True
+    lista = "\n".join(f"• {n} ({cat}) — {s:.0%}" for _pid, n, cat, s in similares)
+    return messagebox.askyesno(
+        "Possível duplicado",
+        f"Já existem produtos parecidos com '{nome}':\n\n{lista}\n\nSalvar mesmo assim?",
+        parent=parent,
+    )
 
-# ---------------- Banco de Dados ----------------
-def get_conn():
-    return sqlite3.connect(DB_PATH)
+def abrir_duplicados(parent, usuario, ao_mesclar):
+    # Lista os grupos de prováveis duplicados; o produto selecionado absorve
+    # os demais do grupo (estoque, lotes, custos e histórico)
+    top = tk.Toplevel(parent)
+    top.title("Produtos Duplicados")
+    top.geometry("720x440")
+    top.transient(parent)
 
-def init_db():
-    conn = get_conn()
-    cur = conn.cursor()
+    ttk.Label(top, text="Selecione, em cada grupo, o produto que deve ser mantido:").pack(anchor="w", padx=10, pady=(10,0))
+    tree_dup = ttk.Treeview(top, columns=("id", "categoria", "quantidade"), selectmode="browse", height=14)
+    tree_dup.heading("#0", text="Nome")
+    tree_dup.heading("id", text="ID")
+    tree_dup.heading("categoria", text="Categoria")
+    tree_dup.heading("quantidade", text="Quantidade")
+    tree_dup.column("#0", width=320)
+    tree_dup.column("id", width=60, anchor="center")
+    tree_dup.column("categoria", width=160)
+    tree_dup.column("quantidade", width=90, anchor="e")
+    tree_dup.pack(expand=True, fill="both", padx=10, pady=8)
+    lbl_status = ttk.Label(top, text="Procurando duplicados...")
+    lbl_status.pack(anchor="w", padx=10)
+
+    grupos = {}
+
+    def carregar():
+        # A varredura roda em thread; o resultado é lido via after()
+        resultado = {}
+
+        def trabalho():
+            try:
+                resultado["grupos"] = repo.grupos_duplicados()
+            except Exception as e:
+                resultado["erro"] = e
 
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS usuarios (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        nome TEXT UNIQUE NOT NULL,
-        senha TEXT NOT NULL,
-        cargo TEXT CHECK(cargo IN ('administrador','funcionario')) NOT NULL
-    )
-    """)
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS produtos (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        nome TEXT NOT NULL,
-        categoria TEXT NOT NULL,
-        quantidade INTEGER CHECK(quantidade >= 0) NOT NULL DEFAULT 0,
-        preco_unitario REAL CHECK(preco_unitario >= 0) NOT NULL DEFAULT 0.0,
-        fornecedor TEXT
-    )
-    """)
-
-    # Tabela de histórico de movimentações (entradas/saídas)
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS movimentacoes (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        produto_id INTEGER NOT NULL,
-        quantidade INTEGER NOT NULL,
-        tipo TEXT CHECK(tipo IN ('entrada','saida')) NOT NULL,
-        usuario TEXT,
-        data_hora TEXT NOT NULL,
-        observacao TEXT,
-        FOREIGN KEY(produto_id) REFERENCES produtos(id)
-    )
-    """)
-
-    # Cria admin padrão caso não exista
-    cur.execute("SELECT id FROM usuarios WHERE nome = ?", (DEFAULT_ADMIN_USER,))
-    if not cur.fetchone():
-        cur.execute(
-            "INSERT INTO usuarios (nome, senha, cargo) VALUES (?, ?, ?)",
-            (DEFAULT_ADMIN_USER, DEFAULT_ADMIN_PASS, "administrador")
-        )
-
-    conn.commit()
-    conn.close()
-
-# ---------------- Operações de BD ----------------
-def verificar_login(nome, senha):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT cargo FROM usuarios WHERE nome=? AND senha=?", (nome, senha))
-    row = cur.fetchone()
-    conn.close()
-    return row[0] if row else None
-
-def listar_produtos():
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT id, nome, categoria, quantidade, preco_unitario, fornecedor FROM produtos ORDER BY nome")
-    rows = cur.fetchall()
-    conn.close()
-    return rows
-
-def inserir_produto(nome, categoria, quantidade, preco, fornecedor):
-    conn = get_conn()
-    cur = conn.cursor()
-    try:
-        cur.execute("""
-            INSERT INTO produtos (nome, categoria, quantidade, preco_unitario, fornecedor)
-            VALUES (?, ?, ?, ?, ?)
-        """, (nome, categoria, quantidade, preco, fornecedor))
-        conn.commit()
-    finally:
-        conn.close()
-
-def atualizar_produto(prod_id, nome, categoria, quantidade, preco, fornecedor):
-    conn = get_conn()
-    cur = conn.cursor()
-    try:
-        cur.execute("""
-            UPDATE produtos
-            SET nome=?, categoria=?, quantidade=?, preco_unitario=?, fornecedor=?
-            WHERE id=?
-        """, (nome, categoria, quantidade, preco, fornecedor, prod_id))
-        conn.commit()
-    finally:
-        conn.close()
-
-def remover_produto(prod_id):
-    conn = get_conn()
-    cur = conn.cursor()
-    try:
-        cur.execute("DELETE FROM produtos WHERE id=?", (prod_id,))
-        conn.commit()
-    finally:
-        conn.close()
-
-def listar_usuarios():
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT id, nome, cargo FROM usuarios ORDER BY nome")
-    rows = cur.fetchall()
-    conn.close()
-    return rows
-
-def inserir_usuario(nome, senha, cargo):
-    conn = get_conn()
-    cur = conn.cursor()
-    try:
-        cur.execute("INSERT INTO usuarios (nome, senha, cargo) VALUES (?, ?, ?)",
-                    (nome, senha, cargo))
-        conn.commit()
-        return True, None
-    except sqlite3.IntegrityError:
-        return False, "Usuário já existe."
-    except Exception as e:
-        return False, str(e)
-    finally:
-        conn.close()
+        def aguardar():
+            if thread.is_alive():
+                top.after(200, aguardar)
+                return
+            if "erro" in resultado:
+                lbl_status.config(text=f"Erro: {resultado['erro']}")
+                return
+            tree_dup.delete(*tree_dup.get_children())
+            grupos.clear()
+            for n, membros in enumerate(resultado["grupos"], 1):
+                gid = f"g{n}"
+                grupos[gid] = [m[0] for m in membros]
+                tree_dup.insert("", "end", iid=gid, text=f"Grupo {n} ({len(membros)} produtos)", open=True)
+                for pid, nome, cat, qtd in membros:
+                    tree_dup.insert(gid, "end", iid=str(pid), text=nome, values=(pid, cat, qtd))
+            lbl_status.config(text=f"{len(grupos)} grupos encontrados.")
+
+        thread = threading.Thread(target=trabalho, daemon=True)
+        thread.start()
+        lbl_status.config(text="Procurando duplicados...")
+        top.after(200, aguardar)
+
+    def mesclar():
+        sel = tree_dup.selection()
+        if not sel or tree_dup.parent(sel[0]) == "":
+            messagebox.showwarning("Aviso", "Selecione o produto a manter (dentro de um grupo).", parent=top)
+            return
+        manter = int(sel[0])
+        outros = [pid for pid in grupos[tree_dup.parent(sel[0])] if pid != manter]
+        if not messagebox.askyesno(
+            "Confirmar",
+            f"Mesclar {len(outros)} produto(s) em '{tree_dup.item(sel[0], 'text')}'?\n"
+            "Estoque, lotes e histórico passam para ele e os demais são apagados.",
+            parent=top,
+        ):
+            return
+        try:
+            for pid in outros:
+                repo.mesclar_produtos(manter, pid, usuario=usuario)
+            messagebox.showinfo("Sucesso", "Produtos mesclados.", parent=top)
+            ao_mesclar()
+            carregar()
+        except Exception as e:
+            messagebox.showerror("Erro", f"Não foi possível mesclar: {e}", parent=top)
 
-def remover_usuario(user_id):
-    conn = get_conn()
-    cur = conn.cursor()
-    try:
-        cur.execute("DELETE FROM usuarios WHERE id=?", (user_id,))
-        conn.commit()
-    finally:
-        conn.close()
-
-# Movimentações (histórico)
-def inserir_movimentacao(produto_id, quantidade, tipo, usuario=None, observacao=None):
-    conn = get_conn()
-    cur = conn.cursor()
-    try:
-        now = datetime.now().isoformat(sep=' ', timespec='seconds')
-        cur.execute("""
-            INSERT INTO movimentacoes (produto_id, quantidade, tipo, usuario, data_hora, observacao)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (produto_id, quantidade, tipo, usuario, now, observacao))
-        conn.commit()
-    finally:
-        conn.close()
-
-def listar_movimentacoes(limit=500):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT m.id, p.nome, m.quantidade, m.tipo, m.usuario, m.data_hora, m.observacao
-        FROM movimentacoes m
-        LEFT JOIN produtos p ON p.id = m.produto_id
-        ORDER BY m.data_hora DESC
-        LIMIT ?
-    """, (limit,))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    btns = ttk.Frame(top)
+    btns.pack(pady=8)
+    ttk.Button(btns, text="Mesclar no selecionado", command=mesclar).pack(side="left", padx=6)
+    ttk.Button(btns, text="Procurar de novo", command=carregar).pack(side="left", padx=6)
+    carregar()
 
 # ---------------- Integração com Dashboard ----------------
 def abrir_dashboard():
@@ -196,6 +145,75 @@ def abrir_dashboard():
     except Exception as e:
         messagebox.showerror("Dashboard", f"Erro ao abrir dashboard:\n{e}")
 
+# ---------------- Backup ----------------
+def fazer_backup_ui(app):
+    # Roda em thread para não travar a janela; o resultado é lido via after()
+    resultado = {}
+
+    def trabalho():
+        try:
+            resultado["info"] = backup.fazer_backup()
+        except Exception as e:
+            resultado["erro"] = e
+
+    def aguardar():
+        if thread.is_alive():
+            app.after(200, aguardar)
+            return
+        app.config(cursor="")
+        if "erro" in resultado:
+            messagebox.showerror("Backup", f"Erro ao fazer backup:\n{resultado['erro']}")
+            return
+        info = resultado["info"]
+        messagebox.showinfo("Backup", (
+            f"Backup concluído em {info['duracao_s']:.1f}s.\n\n"
+            f"Banco: {backup.formatar_tamanho(info['tamanho_banco'])}\n"
+            f"Arquivo: {backup.formatar_tamanho(info['tamanho_arquivo'])}\n"
+            f"{info['arquivo']}"
+        ))
+
+    thread = threading.Thread(target=trabalho, daemon=True)
+    thread.start()
+    app.config(cursor="watch")
+    app.after(200, aguardar)
+
+def abrir_restaurar_backup(parent, ao_restaurar):
+    top = tk.Toplevel(parent)
+    top.title("Restaurar Backup")
+    top.geometry("560x360")
+    top.transient(parent)
+    top.grab_set()
+
+    ttk.Label(top, text="Escolha o backup a restaurar (o estado atual é salvo antes):").pack(anchor="w", padx=10, pady=(10,0))
+    tree_bk = ttk.Treeview(top, columns=("data", "tamanho", "arquivo"), show="headings", selectmode="browse", height=10)
+    tree_bk.heading("data", text="Data")
+    tree_bk.heading("tamanho", text="Tamanho")
+    tree_bk.heading("arquivo", text="Arquivo")
+    tree_bk.column("data", width=150)
+    tree_bk.column("tamanho", width=90, anchor="e")
+    tree_bk.column("arquivo", width=280)
+    tree_bk.pack(expand=True, fill="both", padx=10, pady=8)
+
+    for caminho, tamanho, data in backup.listar_backups():
+        tree_bk.insert("", "end", iid=caminho, values=(f"{data:%d/%m/%Y %H:%M:%S}", backup.formatar_tamanho(tamanho), os.path.basename(caminho)))
+
+    def restaurar():
+        sel = tree_bk.selection()
+        if not sel:
+            messagebox.showwarning("Aviso", "Selecione um backup.", parent=top)
+            return
+        if not messagebox.askyesno("Confirmar", "Substituir todos os dados atuais por este backup?", parent=top):
+            return
+        try:
+            seguranca = backup.restaurar_backup(sel[0])
+            messagebox.showinfo("Sucesso", f"Backup restaurado.\nO estado anterior foi salvo em:\n{seguranca['arquivo']}", parent=top)
+            top.destroy()
+            ao_restaurar()
+        except Exception as e:
+            messagebox.showerror("Erro", f"Não foi possível restaurar: {e}", parent=top)
+
+    ttk.Button(top, text="Restaurar", command=restaurar).pack(pady=10)
+
 # ---------------- Interface Tkinter ----------------
 def abrir_login():
     def tentar_login():
@@ -204,7 +222,7 @@ def abrir_login():
         if not usuario or not senha:
             messagebox.showwarning("Aviso", "Preencha usuário e senha.")
 
-        cargo = verificar_login(usuario, senha)
+        cargo = repo.verificar_login(usuario, senha)
         if cargo:
             root.destroy()
             abrir_main(usuario, cargo)
@@ -231,7 +249,7 @@ def abrir_login():
 
 def abrir_main(usuario, cargo):
     app = tk.Tk()
-    app.title(f"Sistema de Estoque — {usuario} ({cargo})")
+    app.title(f"Sistema de Estoque — {usuario} ({cargo}) — {repo.descricao()}")
     app.geometry("980x640")
 
     # Menu simples (melhora UI)
@@ -239,6 +257,14 @@ def abrir_main(usuario, cargo):
     file_menu = tk.Menu(menubar, tearoff=0)
     file_menu.add_command(label="Abrir dashboard", command=abrir_dashboard)
     file_menu.add_separator()
+    # backup.py e o índice de duplicados existem só no SQLite
+    if repo.suporta("backup"):
+        file_menu.add_command(label="Fazer backup agora", command=lambda: fazer_backup_ui(app))
+    if cargo == "administrador" and repo.suporta("backup"):
+        file_menu.add_command(label="Restaurar backup...", command=lambda: abrir_restaurar_backup(app, recarregar_tudo))
+    if cargo == "administrador" and repo.suporta("duplicados"):
+        file_menu.add_command(label="Produtos duplicados...", command=lambda: abrir_duplicados(app, usuario, recarregar_tudo))
+    file_menu.add_separator()
     file_menu.add_command(label="Sair", command=app.quit)
     menubar.add_cascade(label="Arquivo", menu=file_menu)
 
@@ -270,19 +296,48 @@ def abrir_main(usuario, cargo):
     ttk.Button(top_prod, text="Ir", command=aplicar_pesquisa).pack(side="left")
     ttk.Button(top_prod, text="Atualizar", command=lambda: atualizar_treeview_produtos("")).pack(side="right")
 
-    cols = ("id", "nome", "categoria", "quantidade", "preco", "fornecedor")
+    # Local selecionado: "Todos os locais" mostra o total da rede
+    TODOS_LOCAIS = "Todos os locais"
+    locais_ids = {}
+    local_var = tk.StringVar(value=TODOS_LOCAIS)
+    cb_local = ttk.Combobox(top_prod, textvariable=local_var, state="readonly", width=24)
+    cb_local.pack(side="right", padx=6)
+    ttk.Label(top_prod, text="Local:").pack(side="right")
+
+    def carregar_locais():
+        locais_ids.clear()
+        for lid, lnome, _tipo in repo.listar_locais():
+            locais_ids[lnome] = lid
+        cb_local["values"] = [TODOS_LOCAIS] + list(locais_ids)
+        if local_var.get() not in locais_ids:
+            local_var.set(TODOS_LOCAIS)
+
+    def local_atual():
+        return locais_ids.get(local_var.get())
+
+    carregar_locais()
+
+    def trocar_local(event=None):
+        atualizar_treeview_produtos(search_var.get().strip().lower())
+        atualizar_treeview_movimentacoes()
+
+    cb_local.bind("<<ComboboxSelected>>", trocar_local)
+
+    cols = ("id", "nome", "categoria", "quantidade", "preco", "fornecedor", "codigo")
     tree = ttk.Treeview(tab_prod, columns=cols, show="headings", selectmode="browse", height=18)
     tree.heading("nome", text="Nome")
     tree.heading("categoria", text="Categoria")
     tree.heading("quantidade", text="Qtd")
     tree.heading("preco", text="Preço (R$)")
     tree.heading("fornecedor", text="Fornecedor")
+    tree.heading("codigo", text="Cód. barras")
     tree.column("id", width=0, stretch=False)
     tree.column("nome", width=300)
     tree.column("categoria", width=140)
     tree.column("quantidade", width=80, anchor="center")
     tree.column("preco", width=120, anchor="e")
-    tree.column("fornecedor", width=260)
+    tree.column("fornecedor", width=200)
+    tree.column("codigo", width=130)
     tree.pack(expand=True, fill="both", padx=8, pady=8)
 
     # Botões de produtos (organizados em frames)
@@ -297,23 +352,26 @@ def abrir_main(usuario, cargo):
     def abrir_form_produto(edit=False):
         sel = tree.selection()
         prod_id = None
-        dados = None
+        original = None
+        # Quantidade é por local: sem um local selecionado, a edição não
+        # mexe no estoque (o total da rede é a soma dos locais)
+        local_id = local_atual()
         if edit:
             if not sel:
                 messagebox.showwarning("Aviso", "Selecione um produto para editar.")
                 return
             prod_id = int(tree.set(sel[0], "id"))
-            dados = (
-                tree.set(sel[0], "nome"),
-                tree.set(sel[0], "categoria"),
-                tree.set(sel[0], "quantidade"),
-                tree.set(sel[0], "preco"),
-                tree.set(sel[0], "fornecedor")
-            )
+            # lê do banco (com a versão da linha), não da Treeview, que pode
+            # estar desatualizada
+            original = repo.obter_produto(prod_id, local_id)
+            if original is None:
+                messagebox.showwarning("Aviso", "O produto foi removido por outro usuário.")
+                atualizar_treeview_produtos()
+                return
 
         top = tk.Toplevel(app)
         top.title("Editar Produto" if edit else "Cadastrar Produto")
-        top.geometry("420x360")
+        top.geometry("420x470")
         top.transient(app)
         top.grab_set()
 
@@ -327,21 +385,69 @@ def abrir_main(usuario, cargo):
         e_preco = ttk.Entry(top); e_preco.pack(fill="x", padx=10)
         ttk.Label(top, text="Fornecedor (opcional):").pack(anchor="w", padx=10, pady=(8,0))
         e_for = ttk.Entry(top); e_for.pack(fill="x", padx=10)
+        ttk.Label(top, text="Código de barras (opcional):").pack(anchor="w", padx=10, pady=(8,0))
+        e_cod = ttk.Entry(top); e_cod.pack(fill="x", padx=10)
 
-        if edit and dados:
-            e_nome.insert(0, dados[0])
-            e_cat.insert(0, dados[1])
-            e_qtd.insert(0, dados[2])
-            e_preco.insert(0, dados[3])
-            e_for.insert(0, dados[4])
+        lbl_conflito = ttk.Label(top, text="", foreground="red", wraplength=400, justify="left")
+        lbl_conflito.pack(anchor="w", padx=10, pady=(8,0))
 
+        if edit:
+            e_nome.insert(0, original["nome"])
+            e_cat.insert(0, original["categoria"])
+            e_qtd.insert(0, original["quantidade"])
+            e_preco.insert(0, f"{float(original['preco']):.2f}")
+            e_for.insert(0, original["fornecedor"] or "")
+            e_cod.insert(0, original["codigo_barras"] or "")
+            if local_id is None:
+                e_qtd.config(state="disabled")
+
+        rotulos = {"nome": "Nome", "categoria": "Categoria", "preco": "Preço", "fornecedor": "Fornecedor",
+                   "codigo_barras": "Código de barras", "quantidade": "Quantidade"}
+
+        def salvar_edicao(nome, cat, qtd_i, preco_f, forn, cod):
+            novos = {"nome": nome, "categoria": cat, "preco": preco_f, "fornecedor": forn, "codigo_barras": cod or None}
+            alteracoes = {c: v for c, v in novos.items() if (v or None) != (original[c] or None)}
+            nova_qtd = qtd_i if qtd_i is not None and qtd_i != original["quantidade"] else None
+            meus = set(alteracoes) | ({"quantidade"} if nova_qtd is not None else set())
+            if not meus:
+                return True
+
+            ok, info = repo.atualizar_produto(prod_id, original["versao"], alteracoes, local_id=local_id,
+                                         quantidade=nova_qtd, quantidade_anterior=original["quantidade"])
+            if ok:
+                return True
+
+            atual = repo.obter_produto(prod_id, local_id)
+            if atual is None:
+                raise ValueError("O produto foi removido por outro usuário.")
+            outros = {c for c in rotulos if (atual[c] or None) != (original[c] or None)}
+            if not outros & meus:
+                # o outro usuário mexeu em campos diferentes: como só os
+                # campos alterados são gravados, basta repetir na nova versão
+                ok, info = repo.atualizar_produto(prod_id, atual["versao"], alteracoes, local_id=local_id,
+                                             quantidade=nova_qtd, quantidade_anterior=atual["quantidade"])
+                if ok:
+                    return True
+                atual = repo.obter_produto(prod_id, local_id) or atual
+                outros = {c for c in rotulos if (atual[c] or None) != (original[c] or None)}
+
+            linhas = [f"{info} Valores atuais:"]
+            for c in rotulos:
+                if c in outros:
+                    linhas.append(f"• {rotulos[c]}: {atual[c]}")
+            linhas.append("Salvar novamente grava os seus valores por cima.")
+            lbl_conflito.config(text="\n".join(linhas))
+            # o usuário já viu o conflito: a próxima tentativa parte da versão atual
+            original.update(atual)
+            return False
 
         def salvar():
             nome = e_nome.get().strip()
             cat = e_cat.get().strip()
-            qtd = e_qtd.get().strip()
+            qtd = e_qtd.get().strip() if str(e_qtd.cget("state")) != "disabled" else None
             preco = e_preco.get().strip().replace(",", ".")  
             forn = e_for.get().strip()
+            cod = e_cod.get().strip()
 
             if not nome:
                 messagebox.showerror("Erro", "Nome é obrigatório.")
@@ -349,7 +455,7 @@ def abrir_main(usuario, cargo):
             if not cat:
                 messagebox.showerror("Erro", "Categoria é obrigatória.")
                 
-            if not qtd:
+            if qtd == "":
                 messagebox.showerror("Erro", "Quantidade é obrigatória.")
            
             if not preco:
@@ -358,8 +464,8 @@ def abrir_main(usuario, cargo):
 
             # quantidade deve ser inteiro não-negativo
             try:
-                qtd_i = int(qtd)
-                if qtd_i < 0:
+                qtd_i = int(qtd) if qtd is not None else None
+                if qtd_i is not None and qtd_i < 0:
                     raise ValueError("Quantidade negativa")
             except Exception:
                 messagebox.showerror("Erro", "Quantidade deve ser inteiro >= 0.")
@@ -374,15 +480,28 @@ def abrir_main(usuario, cargo):
                 messagebox.showerror("Erro", "Preço deve ser número >= 0 (use vírgula ou ponto).")
 
 
+            if (not edit or nome != original["nome"]) and not confirmar_duplicados(top, nome, prod_id):
+                return
+
+            lote = validade = None
+            if not edit and qtd_i and repo.suporta("lotes") and categoria_com_lote(cat):
+                dados_lote = pedir_lote(top, nome)
+                if dados_lote is None:
+                    return
+                lote, validade = dados_lote
+
             try:
                 if edit:
-                    atualizar_produto(prod_id, nome, cat, qtd_i, preco_f, forn)
+                    if not salvar_edicao(nome, cat, qtd_i, preco_f, forn, cod):
+                        return
                     messagebox.showinfo("Sucesso", "Produto atualizado.")
                 else:
-                    inserir_produto(nome, cat, qtd_i, preco_f, forn)
+                    repo.inserir_produto(nome, cat, qtd_i, preco_f, forn, local_id=local_id, codigo_barras=cod,
+                                    lote=lote, validade=validade)
                     messagebox.showinfo("Sucesso", "Produto cadastrado.")
                 top.destroy()
                 atualizar_treeview_produtos()
+                atualizar_aba_locais()
             except Exception as e:
                 messagebox.showerror("Erro", f"Erro ao salvar produto: {e}")
 
@@ -397,7 +516,7 @@ def abrir_main(usuario, cargo):
         nome = tree.set(sel[0], "nome")
         if messagebox.askyesno("Confirmar", f"Deletar produto '{nome}'?"):
             try:
-                remover_produto(prod_id)
+                repo.remover_produto(prod_id)
                 messagebox.showinfo("Sucesso", "Produto removido.")
                 atualizar_treeview_produtos()
             except Exception as e:
@@ -408,66 +527,366 @@ def abrir_main(usuario, cargo):
         sel = tree.selection()
         if not sel:
             messagebox.showwarning("Aviso", "Selecione um produto para registrar movimentação.")
+            return
+        local_id = local_atual()
+        if local_id is None:
+            messagebox.showwarning("Aviso", "Selecione o local da movimentação.")
+            return
 
         prod_id = int(tree.set(sel[0], "id"))
         nome = tree.set(sel[0], "nome")
-        qtd_atual = int(tree.set(sel[0], "quantidade"))
-        prompt = f"Quantidade para {'entrada' if tipo=='entrada' else 'saída'} de '{nome}':"
+        prompt = f"Quantidade para {'entrada' if tipo=='entrada' else 'saída'} de '{nome}' em '{local_var.get()}':"
         # pede quantidade via dialog simples
         try:
             resp = simpledialog.askstring("Registrar " + ("Entrada" if tipo == "entrada" else "Saída"), prompt, parent=app)
             if resp is None:
                 return  # cancelou
             resp = resp.strip()
-            if not resp:
-                messagebox.showerror("Erro", "Quantidade inválida.")
-
-            if not resp.isdigit():
-                messagebox.showerror("Erro", "Digite um número inteiro válido.")
-
-            qtd = int(resp)
-            if qtd <= 0:
-                messagebox.showerror("Erro", "Quantidade deve ser maior que zero.")
-
-            if tipo == "saida" and qtd > qtd_atual:
-                messagebox.showerror("Erro", f"Não há estoque suficiente (atual: {qtd_atual}).")
-
+            if not resp.isdigit() or int(resp) <= 0:
+                messagebox.showerror("Erro", "Digite um número inteiro maior que zero.")
+                return
 
-            # atualiza quantidade no produto
-            nova_qtd = qtd_atual + qtd if tipo == "entrada" else qtd_atual - qtd
-            # atualiza DB
-            atualizar_produto(prod_id, tree.set(sel[0], "nome"), tree.set(sel[0], "categoria"), nova_qtd, float(tree.set(sel[0], "preco").replace(",", ".")), tree.set(sel[0], "fornecedor"))
-            # insere movimentacao
-            inserir_movimentacao(prod_id, qtd, tipo, usuario=usuario, observacao=None)
-            messagebox.showinfo("Sucesso", f"Movimentação registrada ({tipo}) — nova qtd: {nova_qtd}")
+            # entradas de categorias com lote pedem validade; saídas são
+            # alocadas por FEFO em inserir_movimentacao
+            lote = validade = None
+            if tipo == "entrada" and repo.suporta("lotes") and categoria_com_lote(tree.set(sel[0], "categoria")):
+                dados_lote = pedir_lote(app, nome)
+                if dados_lote is None:
+                    return
+                lote, validade = dados_lote
+
+            # custo de compra da entrada (vazio = custo médio atual)
+            custo = None
+            if tipo == "entrada" and repo.suporta("custos"):
+                resp_custo = simpledialog.askstring("Registrar Entrada", "Custo unitário de compra (opcional):", parent=app)
+                if resp_custo is None:
+                    return
+                resp_custo = resp_custo.strip().replace(",", ".")
+                if resp_custo:
+                    try:
+                        custo = float(resp_custo)
+                        if custo < 0:
+                            raise ValueError("Custo negativo")
+                    except ValueError:
+                        messagebox.showerror("Erro", "Custo deve ser número >= 0 (use vírgula ou ponto).")
+                        return
+
+            # estoque do local e histórico são gravados na mesma transação
+            nova_qtd = repo.inserir_movimentacao(prod_id, int(resp), tipo, usuario=usuario, observacao=None,
+                                            local_id=local_id, lote=lote, validade=validade, custo_unitario=custo)
+            messagebox.showinfo("Sucesso", f"Movimentação registrada ({tipo}) — nova qtd no local: {nova_qtd}")
             atualizar_treeview_produtos()
             atualizar_treeview_movimentacoes()
+            atualizar_aba_locais()
         except Exception as e:
             messagebox.showerror("Erro", f"Erro ao registrar movimentação: {e}")
 
+    def transferir_ui():
+        sel = tree.selection()
+        if not sel:
+            messagebox.showwarning("Aviso", "Selecione um produto para transferir.")
+            return
+        prod_id = int(tree.set(sel[0], "id"))
+        nome = tree.set(sel[0], "nome")
+
+        top = tk.Toplevel(app)
+        top.title("Transferir Estoque")
+        top.geometry("360x260")
+        top.transient(app)
+        top.grab_set()
+
+        ttk.Label(top, text=f"Produto: {nome}").pack(anchor="w", padx=10, pady=(10,0))
+        ttk.Label(top, text="Origem:").pack(anchor="w", padx=10, pady=(8,0))
+        origem_var = tk.StringVar(value=local_var.get() if local_atual() else "")
+        ttk.Combobox(top, textvariable=origem_var, values=list(locais_ids), state="readonly").pack(fill="x", padx=10)
+        ttk.Label(top, text="Destino:").pack(anchor="w", padx=10, pady=(8,0))
+        destino_var = tk.StringVar()
+        ttk.Combobox(top, textvariable=destino_var, values=list(locais_ids), state="readonly").pack(fill="x", padx=10)
+        ttk.Label(top, text="Quantidade:").pack(anchor="w", padx=10, pady=(8,0))
+        e_qtd = ttk.Entry(top); e_qtd.pack(fill="x", padx=10)
+
+        def confirmar():
+            origem = locais_ids.get(origem_var.get())
+            destino = locais_ids.get(destino_var.get())
+            qtd = e_qtd.get().strip()
+            if origem is None or destino is None:
+                messagebox.showerror("Erro", "Escolha origem e destino.", parent=top)
+                return
+            if not qtd.isdigit() or int(qtd) <= 0:
+                messagebox.showerror("Erro", "Digite um número inteiro maior que zero.", parent=top)
+                return
+            try:
+                repo.transferir_estoque(prod_id, int(qtd), origem, destino, usuario=usuario)
+                messagebox.showinfo("Sucesso", "Transferência registrada.", parent=top)
+                top.destroy()
+                atualizar_treeview_produtos()
+                atualizar_treeview_movimentacoes()
+                atualizar_aba_locais()
+            except Exception as e:
+                messagebox.showerror("Erro", f"Erro ao transferir: {e}", parent=top)
+
+        ttk.Button(top, text="Transferir", command=confirmar).pack(pady=12)
+
+    # Modo leitura (leitor de código de barras, só teclado)
+    def abrir_modo_leitura():
+        local_id = local_atual()
+        if local_id is None:
+            messagebox.showwarning("Aviso", "Selecione o local antes de abrir o modo leitura.")
+            return
+
+        top = tk.Toplevel(app)
+        top.title(f"Modo leitura — {local_var.get()}")
+        top.geometry("600x480")
+        top.transient(app)
+
+        tipo_var = tk.StringVar(value="entrada")
+        cache = {}          # codigo -> [produto_id, nome, quantidade gravada no local, categoria com lote]
+        pendentes = {}      # produto_id -> quantidade ainda não gravada
+        leituras = []       # (produto_id, qtd) desde a última gravação, para desfazer
+        recusados = []      # produto_id que a última gravação deixou pendentes (F5 remove)
+        agendado = [None]
+        lote_atual = [None, None]   # (código, validade) aplicados às entradas
+
+        lbl_tipo = ttk.Label(top, font=("TkDefaultFont", 14, "bold"))
+        lbl_tipo.pack(anchor="w", padx=10, pady=(10,0))
+        ttk.Label(top, text="F2 entrada · F3 saída · F4 desfaz última · F5 tira item · F6 lote/validade · Esc fecha · "
+                            "3*código lê 3 unidades",
+                  foreground="gray", wraplength=580).pack(anchor="w", padx=10)
+        lbl_lote = ttk.Label(top, text="")
+        lbl_lote.pack(anchor="w", padx=10)
+        e_cod = ttk.Entry(top, font=("TkDefaultFont", 14))
+        e_cod.pack(fill="x", padx=10, pady=8)
+        lbl_status = ttk.Label(top, text="Aguardando leitura...")
+        lbl_status.pack(anchor="w", padx=10)
+
+        tree_lido = ttk.Treeview(top, columns=("produto", "pendente", "estoque"), show="headings", height=14)
+        tree_lido.heading("produto", text="Produto")
+        tree_lido.heading("pendente", text="A gravar")
+        tree_lido.heading("estoque", text="Estoque no local")
+        tree_lido.column("produto", width=320)
+        tree_lido.column("pendente", width=100, anchor="center")
+        tree_lido.column("estoque", width=130, anchor="center")
+        tree_lido.pack(expand=True, fill="both", padx=10, pady=8)
+
+        def status(texto, erro=False):
+            lbl_status.config(text=texto, foreground="red" if erro else "")
+            if erro:
+                top.bell()
+
+        def mostrar_tipo():
+            lbl_tipo.config(text="ENTRADA" if tipo_var.get() == "entrada" else "SAÍDA",
+                            foreground="darkgreen" if tipo_var.get() == "entrada" else "darkred")
+
+        def mostrar_produto(pid, nome, estoque):
+            pend = pendentes.get(pid, 0)
+            valores = (nome, pend, estoque)
+            if tree_lido.exists(str(pid)):
+                tree_lido.item(str(pid), values=valores)
+                tree_lido.move(str(pid), "", 0)
+            else:
+                tree_lido.insert("", 0, iid=str(pid), values=valores)
+
+        def produtos_lidos():
+            # produto_id -> [produto_id, nome, estoque, com lote] (um código por produto)
+            return {prod[0]: prod for prod in cache.values()}
+
+        def gravar_itens(itens):
+            novas = repo.registrar_movimentacoes_lote(itens, tipo_var.get(), usuario=usuario,
+                                                      observacao="modo leitura", local_id=local_id,
+                                                      lote=lote_atual[0], validade=lote_atual[1])
+            for pid in itens:
+                del pendentes[pid]
+            leituras[:] = [l for l in leituras if l[0] in pendentes]
+            for pid, prod in produtos_lidos().items():
+                if pid in novas:
+                    prod[2] = novas[pid]
+                    mostrar_produto(*prod[:3])
+            # atualiza só as linhas afetadas na aba Produtos
+            if local_atual() == local_id:
+                for pid, nova in novas.items():
+                    if tree.exists(str(pid)):
+                        tree.set(str(pid), "quantidade", nova)
+            atualizar_aba_locais()
+            return novas
+
+        def gravar():
+            # Grava o lote em memória. Se alguma saída passou do estoque (outro
+            # caixa vendeu antes), grava os demais itens e deixa só esses
+            # pendentes, com o nome na mensagem: F5 os tira da lista.
+            if agendado[0]:
+                top.after_cancel(agendado[0])
+                agendado[0] = None
+            recusados.clear()
+            if not pendentes:
+                return True
+            try:
+                novas = gravar_itens(dict(pendentes))
+                status(f"Lote gravado: {len(novas)} produto(s).")
+                return True
+            except Exception as e:
+                erro = e
+
+            # recarrega o estoque dos itens pendentes: alguém pode ter mexido
+            for codigo, prod in cache.items():
+                if prod[0] in pendentes:
+                    row = repo.buscar_produto_por_codigo(codigo, local_id)
+                    if row:
+                        prod[2] = row[2]
+                        mostrar_produto(*prod[:3])
+            lidos = produtos_lidos()
+            if tipo_var.get() == "saida":
+                recusados.extend(pid for pid, pend in pendentes.items() if pend > lidos[pid][2])
+            if not recusados:
+                status(f"Lote não gravado: {erro} (F4 desfaz a última leitura, F5 tira o item selecionado)", erro=True)
+                return False
+            gravados = 0
+            validos = {pid: pend for pid, pend in pendentes.items() if pid not in recusados}
+            if validos:
+                try:
+                    gravados = len(gravar_itens(validos))
+                except Exception as e:
+                    status(f"Lote não gravado: {e}", erro=True)
+                    return False
+            nomes = ", ".join(f"'{lidos[pid][1]}' (estoque {lidos[pid][2]}, lido {pendentes[pid]})" for pid in recusados)
+            status(f"{gravados} produto(s) gravado(s). Sem estoque suficiente, pendente: {nomes}. "
+                   f"F5 tira da lista.", erro=True)
+            return False
+
+        def ler(event=None):
+            texto = e_cod.get().strip()
+            e_cod.delete(0, "end")
+            if not texto:
+                return
+            qtd = 1
+            if "*" in texto:
+                mult, texto = texto.split("*", 1)
+                if not mult.isdigit() or int(mult) <= 0:
+                    status("Quantidade inválida.", erro=True)
+                    return
+                qtd = int(mult)
+
+            prod = cache.get(texto)
+            if prod is None:
+                row = repo.buscar_produto_por_codigo(texto, local_id)
+                if row is None:
+                    status(f"Código não cadastrado: {texto}", erro=True)
+                    return
+                prod = cache[texto] = list(row[:3]) + [repo.suporta("lotes") and categoria_com_lote(row[3])]
+            pid, nome, estoque, com_lote = prod
+
+            if tipo_var.get() == "entrada" and com_lote and not lote_atual[1]:
+                status(f"'{nome}' exige lote: informe a validade (F6).", erro=True)
+                return
+
+            pend = pendentes.get(pid, 0) + qtd
+            if tipo_var.get() == "saida" and pend > estoque:
+                status(f"Não há estoque suficiente de '{nome}' (atual: {estoque}).", erro=True)
+                return
+            pendentes[pid] = pend
+            leituras.append((pid, qtd))
+            mostrar_produto(pid, nome, estoque)
+            status(f"{nome}: +{qtd}")
+
+            if len(leituras) >= LEITURA_LOTE_MAX:
+                gravar()
+            else:
+                if agendado[0]:
+                    top.after_cancel(agendado[0])
+                agendado[0] = top.after(LEITURA_LOTE_MS, gravar)
+
+        def desfazer(event=None):
+            if not leituras:
+                return
+            pid, qtd = leituras.pop()
+            pendentes[pid] -= qtd
+            if pendentes[pid] <= 0:
+                del pendentes[pid]
+            for prod in cache.values():
+                if prod[0] == pid:
+                    mostrar_produto(*prod[:3])
+            status("Última leitura desfeita.")
+
+        def tirar_item(event=None):
+            # Tira das leituras pendentes o item selecionado ou, sem seleção,
+            # os que a última gravação recusou
+            selecao = [int(iid) for iid in tree_lido.selection()]
+            alvo = [pid for pid in (selecao or list(recusados)) if pid in pendentes]
+            if not alvo:
+                status("Selecione um item com leituras pendentes.", erro=True)
+                return
+            lidos = produtos_lidos()
+            for pid in alvo:
+                del pendentes[pid]
+                mostrar_produto(*lidos[pid][:3])
+            leituras[:] = [l for l in leituras if l[0] in pendentes]
+            recusados.clear()
+            status(f"Tirado(s) da lista: {', '.join(lidos[pid][1] for pid in alvo)}.")
+            e_cod.focus_set()
+
+        def definir_lote(event=None):
+            # o lote em memória usa o lote/validade vigentes: grava antes de trocar
+            if not repo.suporta("lotes"):
+                status("Controle de lotes não disponível neste banco.", erro=True)
+                return
+            if not gravar():
+                return
+            dados_lote = pedir_lote(top, "próximas entradas")
+            if dados_lote is None:
+                return
+            lote_atual[0], lote_atual[1] = dados_lote
+            lbl_lote.config(text=f"Lote: {lote_atual[0] or '—'} · validade {lote_atual[1]}")
+            e_cod.focus_set()
+
+        def trocar_tipo(tipo):
+            if tipo_var.get() == tipo or not gravar():
+                return
+            tipo_var.set(tipo)
+            mostrar_tipo()
+
+        def fechar(event=None):
+            if not gravar() and not messagebox.askyesno(
+                    "Modo leitura", "Há leituras não gravadas. Descartar e fechar?", parent=top):
+                return
+            top.destroy()
+
+        e_cod.bind("<Return>", ler)
+        top.bind("<F2>", lambda e: trocar_tipo("entrada"))
+        top.bind("<F3>", lambda e: trocar_tipo("saida"))
+        top.bind("<F4>", desfazer)
+        top.bind("<F5>", tirar_item)
+        top.bind("<F6>", definir_lote)
+        top.bind("<Escape>", fechar)
+        top.protocol("WM_DELETE_WINDOW", fechar)
+        mostrar_tipo()
+        e_cod.focus_set()
+
     ttk.Button(left_btns, text="Novo Produto", command=lambda: abrir_form_produto(edit=False)).pack(side="left", padx=6)
     ttk.Button(left_btns, text="Editar Produto", command=lambda: abrir_form_produto(edit=True)).pack(side="left", padx=6)
     ttk.Button(left_btns, text="Deletar Produto", command=deletar_produto_ui).pack(side="left", padx=6)
 
     ttk.Button(right_btns, text="Registrar Entrada", command=lambda: registrar_movimentacao_ui("entrada")).pack(side="right", padx=6)
     ttk.Button(right_btns, text="Registrar Saída", command=lambda: registrar_movimentacao_ui("saida")).pack(side="right", padx=6)
+    ttk.Button(right_btns, text="Transferir", command=transferir_ui).pack(side="right", padx=6)
+    ttk.Button(right_btns, text="Modo Leitura (F8)", command=abrir_modo_leitura).pack(side="right", padx=6)
+    app.bind("<F8>", lambda e: abrir_modo_leitura())
     ttk.Button(right_btns, text="Abrir Dashboard", command=abrir_dashboard).pack(side="right", padx=6)
 
     def atualizar_treeview_produtos(filter_term=""):
         for r in tree.get_children():
             tree.delete(r)
         try:
-            produtos = listar_produtos()
+            produtos = repo.listar_produtos(local_atual())
             termo = filter_term.lower() if filter_term else None
             for p in produtos:
-                pid, nome, cat, qtd, preco, forn = p
+                pid, nome, cat, qtd, preco, forn, cod = p
                 preco_str = f"{float(preco):.2f}"
-                linha = (pid, nome, cat, qtd, preco_str, forn or "")
+                linha = (pid, nome, cat, qtd, preco_str, forn or "", cod or "")
+                # iid = id do produto, para o modo leitura atualizar só a linha
                 if termo:
-                    if termo in nome.lower() or termo in cat.lower() or termo in (forn or "").lower():
-                        tree.insert("", "end", values=linha)
+                    if termo in nome.lower() or termo in cat.lower() or termo in (forn or "").lower() or termo == (cod or ""):
+                        tree.insert("", "end", iid=str(pid), values=linha)
                 else:
-                    tree.insert("", "end", values=linha)
+                    tree.insert("", "end", iid=str(pid), values=linha)
         except Exception as e:
             messagebox.showerror("Erro", f"Erro ao carregar produtos: {e}")
 
@@ -483,11 +902,12 @@ def abrir_main(usuario, cargo):
     ttk.Label(top_mov, text="Últimas movimentações:").pack(side="left")
     ttk.Button(top_mov, text="Atualizar", command=lambda: atualizar_treeview_movimentacoes()).pack(side="right")
 
-    cols_mov = ("id", "produto", "quantidade", "tipo", "usuario", "data", "obs")
+    cols_mov = ("id", "produto", "quantidade", "tipo", "local", "usuario", "data", "obs")
     tree_mov = ttk.Treeview(tab_mov, columns=cols_mov, show="headings", height=18)
     tree_mov.heading("produto", text="Produto")
     tree_mov.heading("quantidade", text="Qtd")
     tree_mov.heading("tipo", text="Tipo")
+    tree_mov.heading("local", text="Local")
     tree_mov.heading("usuario", text="Usuário")
     tree_mov.heading("data", text="Data/Hora")
     tree_mov.heading("obs", text="Observação")
@@ -495,6 +915,7 @@ def abrir_main(usuario, cargo):
     tree_mov.column("produto", width=260)
     tree_mov.column("quantidade", width=70, anchor="center")
     tree_mov.column("tipo", width=80, anchor="center")
+    tree_mov.column("local", width=140)
     tree_mov.column("usuario", width=120, anchor="center")
     tree_mov.column("data", width=160)
     tree_mov.column("obs", width=200)
@@ -504,15 +925,64 @@ def abrir_main(usuario, cargo):
         for r in tree_mov.get_children():
             tree_mov.delete(r)
         try:
-            movs = listar_movimentacoes()
+            # segue o local escolhido na aba Produtos
+            movs = repo.listar_movimentacoes(local_id=local_atual())
             for m in movs:
-                mid, produto, quantidade, tipo, usuario_m, data_hora, obs = m
-                tree_mov.insert("", "end", values=(mid, produto or "—", quantidade, tipo, usuario_m or "—", data_hora, obs or ""))
+                mid, produto, quantidade, tipo, local_m, usuario_m, data_hora, obs = m
+                tree_mov.insert("", "end", values=(mid, produto or "—", quantidade, tipo, local_m or "—", usuario_m or "—", data_hora, obs or ""))
         except Exception as e:
             messagebox.showerror("Erro", f"Erro ao carregar movimentações: {e}")
 
     atualizar_treeview_movimentacoes()
 
+    # ----- Tab Locais -----
+    tab_loc = ttk.Frame(nb)
+    nb.add(tab_loc, text="Locais")
+
+    top_loc = ttk.Frame(tab_loc, padding=8)
+    top_loc.pack(fill="x")
+
+    lbl_rede = ttk.Label(top_loc, text="")
+    lbl_rede.pack(side="left")
+    ttk.Button(top_loc, text="Atualizar", command=lambda: atualizar_aba_locais()).pack(side="right")
+    if cargo == "administrador":
+        ttk.Button(top_loc, text="Novo Local", command=lambda: abrir_criar_local(app, lambda: (carregar_locais(), atualizar_aba_locais()))).pack(side="right", padx=6)
+
+    cols_loc = ("id", "nome", "tipo", "produtos", "quantidade", "valor")
+    tree_loc = ttk.Treeview(tab_loc, columns=cols_loc, show="headings", selectmode="browse", height=18)
+    tree_loc.heading("nome", text="Local")
+    tree_loc.heading("tipo", text="Tipo")
+    tree_loc.heading("produtos", text="Produtos em estoque")
+    tree_loc.heading("quantidade", text="Qtd total")
+    tree_loc.heading("valor", text="Valor (R$)")
+    tree_loc.column("id", width=0, stretch=False)
+    tree_loc.column("nome", width=260)
+    tree_loc.column("tipo", width=100, anchor="center")
+    tree_loc.column("produtos", width=140, anchor="center")
+    tree_loc.column("quantidade", width=120, anchor="center")
+    tree_loc.column("valor", width=160, anchor="e")
+    tree_loc.pack(expand=True, fill="both", padx=8, pady=8)
+
+    def atualizar_aba_locais():
+        # totais vêm de totais_local (uma linha por local), sem varrer o estoque
+        for r in tree_loc.get_children():
+            tree_loc.delete(r)
+        try:
+            for lid, lnome, tipo, qtd, valor, n_prod in repo.totais_por_local():
+                tree_loc.insert("", "end", values=(lid, lnome, tipo, n_prod, qtd, f"{float(valor):.2f}"))
+            qtd_rede, valor_rede = repo.total_rede()
+            lbl_rede.config(text=f"Total da rede: {qtd_rede} itens — R$ {float(valor_rede):.2f}")
+        except Exception as e:
+            messagebox.showerror("Erro", f"Erro ao carregar locais: {e}")
+
+    atualizar_aba_locais()
+
+    def recarregar_tudo():
+        carregar_locais()
+        atualizar_treeview_produtos()
+        atualizar_treeview_movimentacoes()
+        atualizar_aba_locais()
+
     # ----- Tab Usuários (só para admin) -----
     if cargo == "administrador":
         tab_user = ttk.Frame(nb)
@@ -536,7 +1006,7 @@ def abrir_main(usuario, cargo):
             for r in tree_users.get_children():
                 tree_users.delete(r)
             try:
-                users = listar_usuarios()
+                users = repo.listar_usuarios()
                 for u in users:
                     uid, nomeu, cargou = u
                     tree_users.insert("", "end", values=(uid, nomeu, cargou))
@@ -555,7 +1025,7 @@ def abrir_main(usuario, cargo):
                 return
             if messagebox.askyesno("Confirmar", f"Deletar usuário '{nomeu}'?"):
                 try:
-                    remover_usuario(uid)
+                    repo.remover_usuario(uid)
                     messagebox.showinfo("Sucesso", "Usuário removido.")
                     atualizar_usuarios()
                 except Exception as e:
@@ -565,6 +1035,37 @@ def abrir_main(usuario, cargo):
 
     app.mainloop()
 
+def abrir_criar_local(parent, atualiza_callback):
+    top = tk.Toplevel(parent)
+    top.title("Cadastrar Local")
+    top.geometry("360x180")
+    top.transient(parent)
+    top.grab_set()
+
+    ttk.Label(top, text="Nome:").pack(anchor="w", padx=10, pady=(10,0))
+    e_nome = ttk.Entry(top); e_nome.pack(fill="x", padx=10)
+    ttk.Label(top, text="Tipo:").pack(anchor="w", padx=10, pady=(8,0))
+    tipo_var = tk.StringVar(value="loja")
+    frm = ttk.Frame(top); frm.pack(anchor="w", padx=10)
+    ttk.Radiobutton(frm, text="Loja", variable=tipo_var, value="loja").pack(side="left", padx=6)
+    ttk.Radiobutton(frm, text="Depósito", variable=tipo_var, value="deposito").pack(side="left", padx=6)
+
+    def salvar_local():
+        nome = e_nome.get().strip()
+        if not nome:
+            messagebox.showerror("Erro", "Preencha o nome do local.", parent=top)
+            return
+
+        ok, err = repo.inserir_local(nome, tipo_var.get())
+        if ok:
+            messagebox.showinfo("Sucesso", "Local criado.")
+            top.destroy()
+            atualiza_callback()
+        else:
+            messagebox.showerror("Erro", f"Não foi possível criar local: {err}", parent=top)
+
+    ttk.Button(top, text="Salvar", command=salvar_local).pack(pady=12)
+
 def abrir_criar_usuario(parent, atualiza_callback):
     top = tk.Toplevel(parent)
     top.title("Cadastrar Usuário")
@@ -589,7 +1090,7 @@ def abrir_criar_usuario(parent, atualiza_callback):
         if not nome or not senha:
             messagebox.showerror("Erro", "Preencha nome e senha.")
 
-        ok, err = inserir_usuario(nome, senha, cargo)
+        ok, err = repo.inserir_usuario(nome, senha, cargo)
         if ok:
             messagebox.showinfo("Sucesso", "Usuário criado.")
             top.destroy()
@@ -601,5 +1102,5 @@ def abrir_criar_usuario(parent, atualiza_callback):
 
 # ---------------- Start ----------------
 if __name__ == "__main__":
-    init_db()
+    repo.inicializar()
     abrir_login()
@@ -0,0 +1,175 @@
+# previsao.py
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import banco
+import repositorio
+
+# ---------------- Configurações ----------------
+HISTORICO_DIAS = 182        # janela de saídas usada no ajuste
+HORIZONTE_DIAS = 14         # quantos dias à frente prever
+ALFA = 0.3                  # suavização exponencial do nível
+JANELA_MEDIA = 28           # média móvel (dias)
+DIAS_VALIDACAO = 14         # últimos dias usados para escolher o modelo
+SEMANAS_SAZONALIDADE = 8    # histórico a partir do qual a sazonalidade semanal vale inteira
+
+# Acima disso o ajuste é dividido em blocos de produtos e distribuído em processos
+LIMIAR_PARALELO = 20000
+TAMANHO_BLOCO = 10000
+
+
+# ---------------- Série diária ----------------
+def carregar_saidas(conn, inicio, dias):
+    # Matriz produtos x dias com as saídas (sem transferências) desde `inicio`.
+    # A agregação por dia é feita no SQLite, sobre o índice parcial de saídas.
+    ids = np.array([r[0] for r in conn.execute("SELECT id FROM produtos ORDER BY id")], dtype=np.int64)
+    Y = np.zeros((len(ids), dias), dtype=np.float64)
+    cur = conn.execute("""
+        SELECT produto_id,
+               CAST(julianday(substr(data_hora, 1, 10)) - julianday(?) AS INTEGER) AS dia,
+               SUM(quantidade)
+        FROM movimentacoes
+        WHERE tipo = 'saida' AND transferencia_id IS NULL AND data_hora >= ?
+        GROUP BY produto_id, dia
+    """, (inicio.isoformat(), inicio.isoformat()))
+    while True:
+        linhas = cur.fetchmany(50000)
+        if not linhas:
+            break
+        dados = np.array(linhas, dtype=np.float64)
+        prod = np.searchsorted(ids, dados[:, 0].astype(np.int64))
+        dia = dados[:, 1].astype(np.int64)
+        # descarta produtos removidos e dias fora da janela
+        ok = (prod < len(ids)) & (dia >= 0) & (dia < dias)
+        ok[ok] &= ids[prod[ok]] == dados[ok, 0].astype(np.int64)
+        Y[prod[ok], dia[ok]] = dados[ok, 2]
+    return ids, Y
+
+
+# ---------------- Modelos ----------------
+def ajustar_modelos(Y, dia_semana_inicial, horizonte=HORIZONTE_DIAS):
+    # Ajusta, para todas as linhas de Y de uma vez, suavização exponencial e
+    # média móvel, ambas sobre a série dessazonalizada (sazonalidade semanal
+    # multiplicativa). Escolhe por produto o modelo com menor erro absoluto
+    # médio nos últimos DIAS_VALIDACAO dias.
+    # Devolve (demanda prevista no horizonte, erro, usa_suavizacao).
+    n, T = Y.shape
+    dow = (dia_semana_inicial + np.arange(T)) % 7
+
+    media = Y.mean(axis=1)
+    por_dia = np.stack([Y[:, dow == d].mean(axis=1) if (dow == d).any() else media for d in range(7)], axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        S = np.where(media[:, None] > 0, por_dia / media[:, None], 1.0)
+    # pouco histórico: puxa os índices para 1
+    peso = min(1.0, T / (7 * SEMANAS_SAZONALIDADE))
+    S = 1.0 + peso * (S - 1.0)
+
+    # Série dessazonalizada; dias com índice 0 (ex.: loja fechada) não
+    # atualizam o nível
+    S_t = S[:, dow]
+    ativo = S_t > 0
+    D = np.divide(Y, S_t, out=np.zeros_like(Y), where=ativo)
+
+    V = min(DIAS_VALIDACAO, max(T - 1, 0))
+    corte = T - V
+
+    # Suavização exponencial: um passo por dia, vetorizado sobre os produtos
+    nivel = D[:, :JANELA_MEDIA].mean(axis=1) if T else np.zeros(n)
+    nivel_corte = nivel.copy()
+    for t in range(T):
+        if t == corte:
+            nivel_corte = nivel.copy()
+        nivel = np.where(ativo[:, t], ALFA * D[:, t] + (1 - ALFA) * nivel, nivel)
+    if corte >= T:
+        nivel_corte = nivel.copy()
+
+    # Média móvel dessazonalizada (no fim da série e no ponto de corte)
+    media_movel = D[:, max(0, T - JANELA_MEDIA):].mean(axis=1) if T else np.zeros(n)
+    media_corte = D[:, max(0, corte - JANELA_MEDIA):corte].mean(axis=1) if corte > 0 else np.zeros(n)
+
+    if V > 0:
+        real = Y[:, corte:]
+        S_val = S_t[:, corte:]
+        erro_se = np.abs(real - nivel_corte[:, None] * S_val).mean(axis=1)
+        erro_mm = np.abs(real - media_corte[:, None] * S_val).mean(axis=1)
+    else:
+        erro_se = erro_mm = np.zeros(n)
+
+    usa_suavizacao = erro_se <= erro_mm
+    base = np.where(usa_suavizacao, nivel, media_movel)
+    dow_futuro = (dia_semana_inicial + T + np.arange(horizonte)) % 7
+    previsto = (base[:, None] * S[:, dow_futuro]).sum(axis=1)
+    erro = np.where(usa_suavizacao, erro_se, erro_mm)
+    return previsto, erro, usa_suavizacao
+
+
+def _ajustar_bloco(args):
+    Y, dia_semana_inicial, horizonte = args
+    return ajustar_modelos(Y, dia_semana_inicial, horizonte)
+
+
+def prever(historico_dias=HISTORICO_DIAS, horizonte=HORIZONTE_DIAS, processos=None):
+    # Roda a previsão para o catálogo inteiro e grava em `previsoes`.
+    # Devolve um resumo com quantidade de produtos e tempos.
+    inicio_execucao = time.monotonic()
+    hoje = datetime.now().date()
+    inicio = hoje - timedelta(days=historico_dias)
+
+    conn = banco.get_conn()
+    try:
+        ids, Y = carregar_saidas(conn, inicio, historico_dias)
+    finally:
+        conn.close()
+    tempo_leitura = time.monotonic() - inicio_execucao
+
+    dia_semana = inicio.weekday()
+    if len(ids) > LIMIAR_PARALELO:
+        blocos = [(Y[i:i + TAMANHO_BLOCO], dia_semana, horizonte) for i in range(0, len(ids), TAMANHO_BLOCO)]
+        with ProcessPoolExecutor(max_workers=processos or os.cpu_count()) as pool:
+            partes = list(pool.map(_ajustar_bloco, blocos))
+        previsto = np.concatenate([p[0] for p in partes])
+        erro = np.concatenate([p[1] for p in partes])
+        usa_suavizacao = np.concatenate([p[2] for p in partes])
+    else:
+        previsto, erro, usa_suavizacao = ajustar_modelos(Y, dia_semana, horizonte)
+    tempo_ajuste = time.monotonic() - inicio_execucao - tempo_leitura
+
+    gerado_em = datetime.now().isoformat(sep=" ", timespec="seconds")
+    modelos = np.where(usa_suavizacao, "suavizacao", "media_movel")
+    conn = banco.get_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM previsoes")
+        cur.executemany("""
+            INSERT INTO previsoes (produto_id, gerado_em, horizonte_dias, demanda_horizonte, demanda_diaria, modelo, erro_medio)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, zip(ids.tolist(), [gerado_em] * len(ids), [horizonte] * len(ids),
+                 np.round(previsto, 3).tolist(), np.round(previsto / horizonte, 3).tolist(),
+                 modelos.tolist(), np.round(erro, 3).tolist()))
+        conn.commit()
+    finally:
+        conn.close()
+
+    return {
+        "produtos": int(len(ids)),
+        "gerado_em": gerado_em,
+        "leitura_s": round(tempo_leitura, 2),
+        "ajuste_s": round(tempo_ajuste, 2),
+        "total_s": round(time.monotonic() - inicio_execucao, 2),
+    }
+
+
+# ---------------- Linha de comando ----------------
+if __name__ == "__main__":
+    # python previsao.py [horizonte_dias]  -> para rodar de madrugada (cron)
+    horizonte = int(sys.argv[1]) if len(sys.argv) > 1 else HORIZONTE_DIAS
+    repositorio.usar_sqlite("previsao.py")
+    banco.init_db()
+    resumo = prever(horizonte=horizonte)
+    print(f"Previsão de {resumo['produtos']} produtos em {resumo['total_s']}s "
+          f"(leitura {resumo['leitura_s']}s, ajuste {resumo['ajuste_s']}s)")
@@ -0,0 +1,821 @@
+# repositorio.py
+# Camada de acesso a dados das duas interfaces (janela.py e dashboard.py):
+# usuários, produtos, locais e movimentações, com a mesma assinatura e o
+# mesmo formato de linhas das funções de banco.py.
+#
+#   ESTOQUE_DB_URL vazia ou caminho/sqlite:///caminho -> RepositorioSQLite (banco.py)
+#   ESTOQUE_DB_URL=postgresql://usuario@host/estoque  -> RepositorioPostgres
+#
+# Lotes/FEFO, custos, duplicados, previsão, snapshots, relatórios em segundo
+# plano e backup dependem dos triggers e tabelas auxiliares do SQLite e só
+# existem nele; as telas perguntam antes com repo.suporta(recurso).
+# As ferramentas que só existem no SQLite (tarefas.py, previsao.py,
+# snapshots.py, backup.py) chamam usar_sqlite() ao rodar pela linha de comando.
+# Para levar um estoque.db existente ao PostgreSQL: python migrar.py.
+import os
+import time
+import random
+import sqlite3
+from datetime import datetime
+
+import banco
+import duplicados
+
+RECURSOS_SQLITE = frozenset({"lotes", "custos", "duplicados", "previsao", "snapshots", "tarefas", "backup"})
+
+# PostgreSQL
+POOL_MIN = 1
+POOL_MAX = 10
+TENTATIVAS = 5               # deadlock entre lojas: a transação é refeita
+LINHAS_POR_BLOCO = 5000      # server-side cursor e COPY
+
+
+class ErroIntegridade(Exception):
+    # Violação de unicidade (código de barras, nome de usuário/local),
+    # qualquer que seja o banco
+    pass
+
+
+def usa_postgres(url):
+    return (url or "").startswith(("postgresql://", "postgres://"))
+
+
+def abrir(url=None):
+    url = url if url is not None else os.environ.get("ESTOQUE_DB_URL", "")
+    if usa_postgres(url):
+        return RepositorioPostgres(url)
+    if url.startswith("sqlite:///"):
+        url = url[len("sqlite:///"):]
+    return RepositorioSQLite(url or None)
+
+
+_repositorio = None
+
+def obter():
+    # Repositório do processo (o pool do PostgreSQL é aberto uma vez só)
+    global _repositorio
+    if _repositorio is None:
+        _repositorio = abrir()
+    return _repositorio
+
+
+def usar_sqlite(ferramenta):
+    # Para as ferramentas que só existem no SQLite (chamam banco.py direto):
+    # usa o arquivo de ESTOQUE_DB_URL, ou sai com erro se ela aponta para outro
+    # banco (em vez de ler e gravar um estoque.db esquecido)
+    url = os.environ.get("ESTOQUE_DB_URL", "")
+    if usa_postgres(url):
+        raise SystemExit(f"Erro: {ferramenta} só funciona com o banco SQLite, "
+                         f"mas ESTOQUE_DB_URL aponta para o PostgreSQL.")
+    abrir(url)
+
+
+class Repositorio:
+    recursos = frozenset()
+
+    def suporta(self, recurso):
+        return recurso in self.recursos
+
+
+# ---------------- SQLite ----------------
+class RepositorioSQLite(Repositorio):
+    # O SQLite de sempre: delega para banco.py
+    recursos = RECURSOS_SQLITE
+    erros_banco = (sqlite3.Error,)
+
+    def __init__(self, caminho=None):
+        if caminho:
+            banco.DB_PATH = caminho
+
+    def descricao(self):
+        return f"SQLite ({banco.DB_PATH})"
+
+    def fechar(self):
+        # sem conexões abertas entre operações
+        pass
+
+    def inicializar(self, criar_admin=True):
+        banco.init_db(criar_admin)
+
+    # Usuários
+    def verificar_login(self, nome, senha):
+        return banco.verificar_login(nome, senha)
+
+    def autenticar(self, nome, senha):
+        row = banco.obter_usuario(nome, senha)
+        return dict(zip(("id", "nome", "cargo"), row)) if row else None
+
+    def contar_usuarios(self):
+        return banco.contar_usuarios()
+
+    def listar_usuarios(self):
+        return banco.listar_usuarios()
+
+    def inserir_usuario(self, nome, senha, cargo):
+        return banco.inserir_usuario(nome, senha, cargo)
+
+    def remover_usuario(self, user_id):
+        banco.remover_usuario(user_id)
+
+    # Produtos
+    def contar_produtos(self):
+        return banco.contar_produtos()
+
+    def listar_produtos(self, local_id=None):
+        return banco.listar_produtos(local_id)
+
+    def inserir_produto(self, nome, categoria, quantidade, preco, fornecedor, local_id=None, codigo_barras=None,
+                        lote=None, validade=None, custo_unitario=None):
+        try:
+            return banco.inserir_produto(nome, categoria, quantidade, preco, fornecedor, local_id=local_id,
+                                         codigo_barras=codigo_barras, lote=lote, validade=validade,
+                                         custo_unitario=custo_unitario)
+        except sqlite3.IntegrityError as e:
+            raise ErroIntegridade(str(e)) from e
+
+    def obter_produto(self, prod_id, local_id=None):
+        return banco.obter_produto(prod_id, local_id)
+
+    def atualizar_produto(self, prod_id, versao, alteracoes, local_id=None, quantidade=None, quantidade_anterior=None):
+        try:
+            return banco.atualizar_produto(prod_id, versao, alteracoes, local_id=local_id, quantidade=quantidade,
+                                           quantidade_anterior=quantidade_anterior)
+        except sqlite3.IntegrityError as e:
+            raise ErroIntegridade(str(e)) from e
+
+    def buscar_produto_por_codigo(self, codigo_barras, local_id=None):
+        return banco.buscar_produto_por_codigo(codigo_barras, local_id)
+
+    def remover_produto(self, prod_id):
+        banco.remover_produto(prod_id)
+
+    def estoque_por_local(self, prod_id):
+        return banco.estoque_por_local(prod_id)
+
+    # Locais
+    def listar_locais(self):
+        return banco.listar_locais()
+
+    def inserir_local(self, nome, tipo="loja"):
+        return banco.inserir_local(nome, tipo)
+
+    def totais_por_local(self):
+        return banco.totais_por_local()
+
+    def total_rede(self):
+        return banco.total_rede()
+
+    def recalcular_totais(self):
+        banco.recalcular_totais()
+
+    # Movimentações
+    def inserir_movimentacao(self, produto_id, quantidade, tipo, usuario=None, observacao=None, local_id=None,
+                             lote=None, validade=None, custo_unitario=None):
+        return banco.inserir_movimentacao(produto_id, quantidade, tipo, usuario=usuario, observacao=observacao,
+                                          local_id=local_id, lote=lote, validade=validade,
+                                          custo_unitario=custo_unitario)
+
+    def registrar_movimentacoes_lote(self, itens, tipo, usuario=None, observacao=None, local_id=None,
+                                     lote=None, validade=None):
+        return banco.registrar_movimentacoes_lote(itens, tipo, usuario=usuario, observacao=observacao,
+                                                  local_id=local_id, lote=lote, validade=validade)
+
+    def transferir_estoque(self, produto_id, quantidade, origem_id, destino_id, usuario=None, observacao=None):
+        return banco.transferir_estoque(produto_id, quantidade, origem_id, destino_id, usuario=usuario,
+                                        observacao=observacao)
+
+    def listar_movimentacoes(self, limit=500, local_id=None):
+        return banco.listar_movimentacoes(limit, local_id)
+
+    def iterar_movimentacoes(self, local_id=None, inicio=None, fim=None):
+        return banco.iterar_movimentacoes(local_id, inicio, fim)
+
+    # Recursos só do SQLite
+    def lotes_a_vencer(self, dias=30, local_id=None, incluir_vencidos=True):
+        return banco.lotes_a_vencer(dias, local_id, incluir_vencidos)
+
+    def listar_lotes(self, prod_id, local_id=None):
+        return banco.listar_lotes(prod_id, local_id)
+
+    def valoracao_total(self):
+        return banco.valoracao_total()
+
+    def valoracao_produtos(self, limit=None):
+        return banco.valoracao_produtos(limit)
+
+    def cmv_periodo(self, inicio, fim):
+        return banco.cmv_periodo(inicio, fim)
+
+    def listar_previsoes(self):
+        return banco.listar_previsoes()
+
+    def produtos_similares(self, nome, excluir_id=None, limite=10, limiar=duplicados.LIMIAR_SIMILARIDADE):
+        return banco.produtos_similares(nome, limiar, excluir_id=excluir_id, limite=limite)
+
+    def grupos_duplicados(self, limiar=duplicados.LIMIAR_SIMILARIDADE):
+        return banco.grupos_duplicados(limiar)
+
+    def mesclar_produtos(self, manter_id, remover_id, usuario=None):
+        banco.mesclar_produtos(manter_id, remover_id, usuario=usuario)
+
+
+# ---------------- PostgreSQL ----------------
+# Mesmo modelo de dados do SQLite para usuários, locais, produtos e
+# movimentações. O que lá é feito por trigger (produtos.quantidade como soma
+# de estoque_local e os agregados de totais_local) aqui é feito pelo próprio
+# repositório, na mesma transação: assim a carga por COPY não passa linha a
+# linha por trigger e os totais são recalculados uma vez no fim.
+# movimentacoes.produto_id não tem FK: o histórico sobrevive ao produto,
+# como no SQLite.
+DDL_POSTGRES = [
+    """
+    CREATE TABLE IF NOT EXISTS usuarios (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        nome TEXT UNIQUE NOT NULL,
+        senha TEXT NOT NULL,
+        cargo TEXT CHECK(cargo IN ('administrador','funcionario')) NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS locais (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        nome TEXT UNIQUE NOT NULL,
+        tipo TEXT CHECK(tipo IN ('loja','deposito')) NOT NULL DEFAULT 'loja'
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS produtos (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        nome TEXT NOT NULL,
+        categoria TEXT NOT NULL,
+        quantidade BIGINT CHECK(quantidade >= 0) NOT NULL DEFAULT 0,
+        preco_unitario DOUBLE PRECISION CHECK(preco_unitario >= 0) NOT NULL DEFAULT 0.0,
+        fornecedor TEXT,
+        codigo_barras TEXT,
+        versao INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_produtos_codigo_barras
+    ON produtos (codigo_barras) WHERE codigo_barras IS NOT NULL
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_produtos_nome ON produtos (nome)",
+    """
+    CREATE TABLE IF NOT EXISTS estoque_local (
+        produto_id BIGINT NOT NULL REFERENCES produtos(id) ON DELETE CASCADE,
+        local_id BIGINT NOT NULL REFERENCES locais(id),
+        quantidade BIGINT CHECK(quantidade >= 0) NOT NULL DEFAULT 0,
+        PRIMARY KEY (produto_id, local_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_estoque_local_local ON estoque_local (local_id, produto_id)",
+    """
+    CREATE TABLE IF NOT EXISTS totais_local (
+        local_id BIGINT PRIMARY KEY REFERENCES locais(id),
+        quantidade BIGINT NOT NULL DEFAULT 0,
+        valor DOUBLE PRECISION NOT NULL DEFAULT 0.0,
+        produtos BIGINT NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS movimentacoes (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        produto_id BIGINT NOT NULL,
+        quantidade BIGINT NOT NULL,
+        tipo TEXT CHECK(tipo IN ('entrada','saida')) NOT NULL,
+        usuario TEXT,
+        data_hora TIMESTAMP(0) NOT NULL,
+        observacao TEXT,
+        local_id BIGINT REFERENCES locais(id),
+        transferencia_id BIGINT,
+        custo_unitario DOUBLE PRECISION,
+        cmv_medio DOUBLE PRECISION,
+        cmv_fifo DOUBLE PRECISION
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_movimentacoes_data ON movimentacoes (data_hora)",
+    "CREATE INDEX IF NOT EXISTS idx_movimentacoes_local ON movimentacoes (local_id, data_hora)",
+]
+
+# Ordem de carga (chaves estrangeiras) e colunas copiadas pelo migrar.py
+TABELAS_IMPORTACAO = [
+    ("usuarios", ("id", "nome", "senha", "cargo")),
+    ("locais", ("id", "nome", "tipo")),
+    ("produtos", ("id", "nome", "categoria", "quantidade", "preco_unitario", "fornecedor", "codigo_barras", "versao")),
+    ("estoque_local", ("produto_id", "local_id", "quantidade")),
+    ("movimentacoes", ("id", "produto_id", "quantidade", "tipo", "usuario", "data_hora", "observacao", "local_id",
+                       "transferencia_id", "custo_unitario", "cmv_medio", "cmv_fifo")),
+]
+
+SQL_RECALCULAR_TOTAIS = """
+    INSERT INTO totais_local (local_id, quantidade, valor, produtos)
+    SELECT l.id,
+           COALESCE(SUM(e.quantidade), 0),
+           COALESCE(SUM(e.quantidade * p.preco_unitario), 0),
+           COUNT(*) FILTER (WHERE e.quantidade > 0)
+    FROM locais l
+    LEFT JOIN estoque_local e ON e.local_id = l.id
+    LEFT JOIN produtos p ON p.id = e.produto_id
+    GROUP BY l.id
+    ON CONFLICT (local_id) DO UPDATE SET
+        quantidade = excluded.quantidade, valor = excluded.valor, produtos = excluded.produtos
+"""
+
+
+# data_hora como texto "AAAA-MM-DD HH:MM:SS", como vem do SQLite
+SQL_DATA_HORA = "to_char(m.data_hora, 'YYYY-MM-DD HH24:MI:SS')"
+
+
+class _Conflito(Exception):
+    # Controle otimista: a linha mudou desde a leitura (desfaz a transação)
+    pass
+
+
+def _agora():
+    return datetime.now().replace(microsecond=0)
+
+
+class RepositorioPostgres(Repositorio):
+    # Conexões de um pool (psycopg_pool); cada operação é uma transação,
+    # refeita se o PostgreSQL a escolher como vítima de deadlock
+    recursos = frozenset()
+
+    def __init__(self, url):
+        import psycopg
+        from psycopg import errors
+        from psycopg.conninfo import conninfo_to_dict
+        from psycopg_pool import ConnectionPool
+        self._erros = errors
+        self.erros_banco = (psycopg.Error,)
+        self._conninfo = conninfo_to_dict
+        self.url = url
+        self.pool = ConnectionPool(url, min_size=POOL_MIN, max_size=POOL_MAX, open=True)
+
+    def descricao(self):
+        info = self._conninfo(self.url)
+        return f"PostgreSQL ({info.get('host', 'localhost')}/{info.get('dbname', '')})"
+
+    def fechar(self):
+        self.pool.close()
+
+    def _transacao(self, funcao, *args):
+        # funcao(cur, *args) numa transação (commit no fim, rollback em erro)
+        for tentativa in range(TENTATIVAS):
+            try:
+                with self.pool.connection() as conn:
+                    with conn.cursor() as cur:
+                        return funcao(cur, *args)
+            except (self._erros.DeadlockDetected, self._erros.SerializationFailure):
+                if tentativa == TENTATIVAS - 1:
+                    raise
+                time.sleep(random.uniform(0.01, 0.05) * (tentativa + 1))
+            except self._erros.UniqueViolation as e:
+                raise ErroIntegridade(str(e)) from e
+
+    def _consultar(self, sql, params=(), um=False):
+        def consulta(cur):
+            cur.execute(sql, params)
+            return cur.fetchone() if um else cur.fetchall()
+        return self._transacao(consulta)
+
+    def inicializar(self, criar_admin=True):
+        def criar(cur):
+            # um inicializador por vez (dois apps abrindo juntos)
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext('estoque_inicializar'))")
+            for ddl in DDL_POSTGRES:
+                cur.execute(ddl)
+            cur.execute("""
+                INSERT INTO locais (nome, tipo) SELECT %s, 'deposito'
+                WHERE NOT EXISTS (SELECT 1 FROM locais)
+            """, (banco.LOCAL_PADRAO,))
+            cur.execute("INSERT INTO totais_local (local_id) SELECT id FROM locais ON CONFLICT DO NOTHING")
+            if criar_admin:
+                cur.execute("""
+                    INSERT INTO usuarios (nome, senha, cargo) VALUES (%s, %s, 'administrador')
+                    ON CONFLICT (nome) DO NOTHING
+                """, (banco.DEFAULT_ADMIN_USER, banco.DEFAULT_ADMIN_PASS))
+        self._transacao(criar)
+
+    # Usuários
+    def verificar_login(self, nome, senha):
+        row = self._consultar("SELECT cargo FROM usuarios WHERE nome = %s AND senha = %s", (nome, senha), um=True)
+        return row[0] if row else None
+
+    def autenticar(self, nome, senha):
+        row = self._consultar("SELECT id, nome, cargo FROM usuarios WHERE nome = %s AND senha = %s",
+                              (nome, senha), um=True)
+        return dict(zip(("id", "nome", "cargo"), row)) if row else None
+
+    def contar_usuarios(self):
+        return self._consultar("SELECT COUNT(*) FROM usuarios", um=True)[0]
+
+    def listar_usuarios(self):
+        return self._consultar("SELECT id, nome, cargo FROM usuarios ORDER BY nome")
+
+    def inserir_usuario(self, nome, senha, cargo):
+        try:
+            self._consultar("INSERT INTO usuarios (nome, senha, cargo) VALUES (%s, %s, %s) RETURNING id",
+                            (nome, senha, cargo), um=True)
+            return True, None
+        except ErroIntegridade:
+            return False, "Usuário já existe."
+        except Exception as e:
+            return False, str(e)
+
+    def remover_usuario(self, user_id):
+        self._transacao(lambda cur: cur.execute("DELETE FROM usuarios WHERE id = %s", (user_id,)))
+
+    # Estoque por local + agregados (o papel dos triggers do SQLite)
+    def _local_padrao(self, cur):
+        cur.execute("SELECT id FROM locais WHERE nome = %s", (banco.LOCAL_PADRAO,))
+        row = cur.fetchone()
+        if row:
+            return row[0]
+        cur.execute("SELECT MIN(id) FROM locais")
+        return cur.fetchone()[0]
+
+    def _nome_local(self, cur, local_id):
+        cur.execute("SELECT nome FROM locais WHERE id = %s", (local_id,))
+        row = cur.fetchone()
+        return row[0] if row else str(local_id)
+
+    def _agregar(self, cur, produto_id, local_id, antiga, nova, totais):
+        # estoque_local do (produto, local) foi de antiga para nova: soma em
+        # produtos.quantidade agora e acumula em `totais` o que vai para
+        # totais_local (gravado uma vez por local em _gravar_totais)
+        cur.execute("UPDATE produtos SET quantidade = quantidade + %s WHERE id = %s RETURNING preco_unitario",
+                    (nova - antiga, produto_id))
+        preco = cur.fetchone()[0]
+        t = totais.setdefault(local_id, [0, 0.0, 0])
+        t[0] += nova - antiga
+        t[1] += (nova - antiga) * preco
+        t[2] += (nova > 0) - (antiga > 0)
+
+    def _gravar_totais(self, cur, totais):
+        # Locais em ordem de id: transações concorrentes travam na mesma ordem
+        cur.executemany("""
+            UPDATE totais_local SET quantidade = quantidade + %s, valor = valor + %s, produtos = produtos + %s
+            WHERE local_id = %s
+        """, [(q, v, n, local_id) for local_id, (q, v, n) in sorted(totais.items())])
+
+    def _movimentar_estoque(self, cur, produto_id, local_id, delta, totais):
+        # Aplica delta ao estoque do (produto, local) e devolve a nova quantidade.
+        # Saída maior que o saldo viola o CHECK(quantidade >= 0) e vira ValueError.
+        cur.execute("SELECT 1 FROM produtos WHERE id = %s", (produto_id,))
+        if not cur.fetchone():
+            raise ValueError("Produto não encontrado.")
+        cur.execute("""
+            INSERT INTO estoque_local (produto_id, local_id, quantidade) VALUES (%s, %s, 0)
+            ON CONFLICT (produto_id, local_id) DO NOTHING
+        """, (produto_id, local_id))
+        try:
+            with cur.connection.transaction():
+                cur.execute("""
+                    UPDATE estoque_local SET quantidade = quantidade + %s
+                    WHERE produto_id = %s AND local_id = %s RETURNING quantidade
+                """, (delta, produto_id, local_id))
+                nova = cur.fetchone()[0]
+        except self._erros.CheckViolation:
+            cur.execute("SELECT quantidade FROM estoque_local WHERE produto_id = %s AND local_id = %s",
+                        (produto_id, local_id))
+            atual = cur.fetchone()[0]
+            raise ValueError(f"Não há estoque suficiente em '{self._nome_local(cur, local_id)}' (atual: {atual}).")
+        self._agregar(cur, produto_id, local_id, nova - delta, nova, totais)
+        return nova
+
+    # Produtos
+    def contar_produtos(self):
+        return self._consultar("SELECT COUNT(*) FROM produtos", um=True)[0]
+
+    def listar_produtos(self, local_id=None):
+        if local_id is None:
+            return self._consultar("""
+                SELECT id, nome, categoria, quantidade, preco_unitario, fornecedor, codigo_barras
+                FROM produtos ORDER BY nome
+            """)
+        return self._consultar("""
+            SELECT p.id, p.nome, p.categoria, COALESCE(e.quantidade, 0), p.preco_unitario, p.fornecedor, p.codigo_barras
+            FROM produtos p
+            LEFT JOIN estoque_local e ON e.produto_id = p.id AND e.local_id = %s
+            ORDER BY p.nome
+        """, (local_id,))
+
+    def inserir_produto(self, nome, categoria, quantidade, preco, fornecedor, local_id=None, codigo_barras=None,
+                        lote=None, validade=None, custo_unitario=None):
+        # Sem controle de lotes nem custos (recursos só do SQLite)
+        if validade:
+            raise ValueError("Controle de lotes não está disponível no PostgreSQL.")
+
+        def inserir(cur):
+            cur.execute("""
+                INSERT INTO produtos (nome, categoria, quantidade, preco_unitario, fornecedor, codigo_barras)
+                VALUES (%s, %s, 0, %s, %s, %s) RETURNING id
+            """, (nome, categoria, preco, fornecedor, codigo_barras or None))
+            prod_id = cur.fetchone()[0]
+            destino = local_id if local_id is not None else self._local_padrao(cur)
+            totais = {}
+            cur.execute("INSERT INTO estoque_local (produto_id, local_id, quantidade) VALUES (%s, %s, %s)",
+                        (prod_id, destino, quantidade))
+            self._agregar(cur, prod_id, destino, 0, quantidade, totais)
+            self._gravar_totais(cur, totais)
+            return prod_id
+        return self._transacao(inserir)
+
+    def obter_produto(self, prod_id, local_id=None):
+        row = self._consultar("""
+            SELECT p.nome, p.categoria, p.preco_unitario, p.fornecedor, p.codigo_barras, p.versao,
+                   CASE WHEN %s::bigint IS NULL THEN p.quantidade ELSE COALESCE(e.quantidade, 0) END
+            FROM produtos p
+            LEFT JOIN estoque_local e ON e.produto_id = p.id AND e.local_id = %s
+            WHERE p.id = %s
+        """, (local_id, local_id, prod_id), um=True)
+        if not row:
+            return None
+        return dict(zip(("nome", "categoria", "preco", "fornecedor", "codigo_barras", "versao", "quantidade"), row))
+
+    def atualizar_produto(self, prod_id, versao, alteracoes, local_id=None, quantidade=None, quantidade_anterior=None):
+        # Mesmo controle otimista de banco.atualizar_produto (WHERE versao = lida)
+        colunas = []
+        valores = []
+        for campo, valor in alteracoes.items():
+            if campo not in banco.CAMPOS_PRODUTO:
+                raise ValueError(f"Campo inválido: {campo}")
+            colunas.append(f"{banco.CAMPOS_PRODUTO[campo]} = %s")
+            valores.append(valor)
+
+        def atualizar(cur):
+            nova_versao = versao
+            totais = {}
+            if colunas:
+                cur.execute("SELECT preco_unitario FROM produtos WHERE id = %s AND versao = %s FOR UPDATE",
+                            (prod_id, versao))
+                row = cur.fetchone()
+                if row is None:
+                    raise _Conflito("O produto foi alterado ou removido por outro usuário.")
+                cur.execute(f"UPDATE produtos SET {', '.join(colunas)}, versao = versao + 1 WHERE id = %s",
+                            valores + [prod_id])
+                nova_versao += 1
+                if "preco" in alteracoes and alteracoes["preco"] != row[0]:
+                    for local_id_e, qtd in self._estoque_do_produto(cur, prod_id):
+                        t = totais.setdefault(local_id_e, [0, 0.0, 0])
+                        t[1] += (alteracoes["preco"] - row[0]) * qtd
+
+            if quantidade is not None:
+                destino = local_id if local_id is not None else self._local_padrao(cur)
+                cur.execute("""
+                    UPDATE estoque_local SET quantidade = %s
+                    WHERE produto_id = %s AND local_id = %s AND quantidade = %s
+                """, (quantidade, prod_id, destino, quantidade_anterior))
+                if cur.rowcount == 0:
+                    cur.execute("SELECT 1 FROM estoque_local WHERE produto_id = %s AND local_id = %s", (prod_id, destino))
+                    if cur.fetchone() or quantidade_anterior != 0:
+                        raise _Conflito("O estoque do produto mudou desde que o formulário foi aberto.")
+                    cur.execute("INSERT INTO estoque_local (produto_id, local_id, quantidade) VALUES (%s, %s, %s)",
+                                (prod_id, destino, quantidade))
+                self._agregar(cur, prod_id, destino, quantidade_anterior, quantidade, totais)
+            self._gravar_totais(cur, totais)
+            return nova_versao
+
+        try:
+            return True, self._transacao(atualizar)
+        except _Conflito as e:
+            return False, str(e)
+
+    def estoque_por_local(self, prod_id):
+        return self._consultar("""
+            SELECT l.id, l.nome, e.quantidade
+            FROM estoque_local e
+            JOIN locais l ON l.id = e.local_id
+            WHERE e.produto_id = %s
+            ORDER BY l.nome
+        """, (prod_id,))
+
+    def _estoque_do_produto(self, cur, prod_id):
+        cur.execute("SELECT local_id, quantidade FROM estoque_local WHERE produto_id = %s AND quantidade > 0",
+                    (prod_id,))
+        return cur.fetchall()
+
+    def buscar_produto_por_codigo(self, codigo_barras, local_id=None):
+        if local_id is None:
+            return self._consultar("SELECT id, nome, quantidade, categoria FROM produtos WHERE codigo_barras = %s",
+                                   (codigo_barras,), um=True)
+        return self._consultar("""
+            SELECT p.id, p.nome, COALESCE(e.quantidade, 0), p.categoria
+            FROM produtos p
+            LEFT JOIN estoque_local e ON e.produto_id = p.id AND e.local_id = %s
+            WHERE p.codigo_barras = %s
+        """, (local_id, codigo_barras), um=True)
+
+    def remover_produto(self, prod_id):
+        def remover(cur):
+            cur.execute("SELECT preco_unitario FROM produtos WHERE id = %s FOR UPDATE", (prod_id,))
+            row = cur.fetchone()
+            if row is None:
+                return
+            totais = {}
+            for local_id, qtd in self._estoque_do_produto(cur, prod_id):
+                totais[local_id] = [-qtd, -qtd * row[0], -1]
+            cur.execute("DELETE FROM produtos WHERE id = %s", (prod_id,))
+            self._gravar_totais(cur, totais)
+        self._transacao(remover)
+
+    # Locais
+    def listar_locais(self):
+        return self._consultar("SELECT id, nome, tipo FROM locais ORDER BY nome")
+
+    def inserir_local(self, nome, tipo="loja"):
+        if tipo not in banco.TIPOS_LOCAL:
+            return False, "Tipo de local inválido."
+
+        def inserir(cur):
+            cur.execute("INSERT INTO locais (nome, tipo) VALUES (%s, %s) RETURNING id", (nome, tipo))
+            cur.execute("INSERT INTO totais_local (local_id) VALUES (%s)", (cur.fetchone()[0],))
+        try:
+            self._transacao(inserir)
+            return True, None
+        except ErroIntegridade:
+            return False, "Local já existe."
+        except Exception as e:
+            return False, str(e)
+
+    def totais_por_local(self):
+        return self._consultar("""
+            SELECT l.id, l.nome, l.tipo, t.quantidade, t.valor, t.produtos
+            FROM totais_local t
+            JOIN locais l ON l.id = t.local_id
+            ORDER BY l.nome
+        """)
+
+    def total_rede(self):
+        return self._consultar("SELECT COALESCE(SUM(quantidade), 0)::bigint, COALESCE(SUM(valor), 0) FROM totais_local",
+                               um=True)
+
+    def recalcular_totais(self):
+        def recalcular(cur):
+            cur.execute("""
+                UPDATE produtos p SET quantidade = s.total
+                FROM (
+                    SELECT q.id, COALESCE(SUM(e.quantidade), 0) AS total
+                    FROM produtos q LEFT JOIN estoque_local e ON e.produto_id = q.id
+                    GROUP BY q.id
+                ) s
+                WHERE p.id = s.id AND p.quantidade <> s.total
+            """)
+            cur.execute(SQL_RECALCULAR_TOTAIS)
+        self._transacao(recalcular)
+
+    # Movimentações
+    def _registrar(self, cur, produto_id, quantidade, tipo, usuario, data_hora, observacao, local_id,
+                   transferencia_id=None):
+        cur.execute("""
+            INSERT INTO movimentacoes (produto_id, quantidade, tipo, usuario, data_hora, observacao, local_id,
+                                       transferencia_id)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING id
+        """, (produto_id, quantidade, tipo, usuario, data_hora, observacao, local_id, transferencia_id))
+        return cur.fetchone()[0]
+
+    def inserir_movimentacao(self, produto_id, quantidade, tipo, usuario=None, observacao=None, local_id=None,
+                             lote=None, validade=None, custo_unitario=None):
+        if tipo not in ("entrada", "saida"):
+            raise ValueError("Tipo de movimentação inválido.")
+        if quantidade <= 0:
+            raise ValueError("Quantidade deve ser maior que zero.")
+        if validade:
+            raise ValueError("Controle de lotes não está disponível no PostgreSQL.")
+
+        def movimentar(cur):
+            destino = local_id if local_id is not None else self._local_padrao(cur)
+            totais = {}
+            nova = self._movimentar_estoque(cur, produto_id, destino, quantidade if tipo == "entrada" else -quantidade,
+                                            totais)
+            self._registrar(cur, produto_id, quantidade, tipo, usuario, _agora(), observacao, destino)
+            self._gravar_totais(cur, totais)
+            return nova
+        return self._transacao(movimentar)
+
+    def registrar_movimentacoes_lote(self, itens, tipo, usuario=None, observacao=None, local_id=None,
+                                     lote=None, validade=None):
+        # Uma transação para o lote todo; produtos em ordem de id para que
+        # dois caixas com os mesmos itens travem as linhas na mesma ordem
+        if tipo not in ("entrada", "saida"):
+            raise ValueError("Tipo de movimentação inválido.")
+        if validade:
+            raise ValueError("Controle de lotes não está disponível no PostgreSQL.")
+
+        def movimentar(cur):
+            destino = local_id if local_id is not None else self._local_padrao(cur)
+            totais = {}
+            novas = {}
+            agora = _agora()
+            for produto_id in sorted(itens):
+                quantidade = itens[produto_id]
+                if quantidade <= 0:
+                    raise ValueError("Quantidade deve ser maior que zero.")
+                delta = quantidade if tipo == "entrada" else -quantidade
+                novas[produto_id] = self._movimentar_estoque(cur, produto_id, destino, delta, totais)
+            cur.executemany("""
+                INSERT INTO movimentacoes (produto_id, quantidade, tipo, usuario, data_hora, observacao, local_id)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """, [(pid, itens[pid], tipo, usuario, agora, observacao, destino) for pid in sorted(itens)])
+            self._gravar_totais(cur, totais)
+            return novas
+        return self._transacao(movimentar)
+
+    def transferir_estoque(self, produto_id, quantidade, origem_id, destino_id, usuario=None, observacao=None):
+        if origem_id == destino_id:
+            raise ValueError("Origem e destino devem ser diferentes.")
+        if quantidade <= 0:
+            raise ValueError("Quantidade deve ser maior que zero.")
+
+        def transferir(cur):
+            totais = {}
+            # locais na ordem de id (a saída continua valendo antes da entrada)
+            for local_id, delta in sorted(((origem_id, -quantidade), (destino_id, quantidade))):
+                self._movimentar_estoque(cur, produto_id, local_id, delta, totais)
+            agora = _agora()
+            transf_id = self._registrar(cur, produto_id, quantidade, "saida", usuario, agora, observacao, origem_id)
+            cur.execute("UPDATE movimentacoes SET transferencia_id = %s WHERE id = %s", (transf_id, transf_id))
+            self._registrar(cur, produto_id, quantidade, "entrada", usuario, agora, observacao, destino_id, transf_id)
+            self._gravar_totais(cur, totais)
+            return transf_id
+        return self._transacao(transferir)
+
+    def listar_movimentacoes(self, limit=500, local_id=None):
+        sql = f"""
+            SELECT m.id, p.nome, m.quantidade, m.tipo, l.nome, m.usuario, {SQL_DATA_HORA}, m.observacao
+            FROM movimentacoes m
+            LEFT JOIN produtos p ON p.id = m.produto_id
+            LEFT JOIN locais l ON l.id = m.local_id
+        """
+        params = []
+        if local_id is not None:
+            sql += " WHERE m.local_id = %s"
+            params.append(local_id)
+        sql += " ORDER BY m.data_hora DESC LIMIT %s"
+        params.append(limit)
+        return self._consultar(sql, params)
+
+    def iterar_movimentacoes(self, local_id=None, inicio=None, fim=None):
+        # Server-side cursor: o servidor entrega LINHAS_POR_BLOCO por vez, sem
+        # materializar o histórico inteiro no cliente
+        sql = f"""
+            SELECT m.id, {SQL_DATA_HORA}, m.tipo, m.produto_id, p.nome, m.quantidade, l.nome, m.usuario,
+                   m.observacao, m.transferencia_id, m.custo_unitario
+            FROM movimentacoes m
+            LEFT JOIN produtos p ON p.id = m.produto_id
+            LEFT JOIN locais l ON l.id = m.local_id
+            WHERE TRUE
+        """
+        params = []
+        if inicio:
+            sql += " AND m.data_hora >= %s::date"
+            params.append(inicio)
+        if fim:
+            sql += " AND m.data_hora < %s::date + 1"
+            params.append(fim)
+        if local_id is not None:
+            sql += " AND m.local_id = %s"
+            params.append(local_id)
+        with self.pool.connection() as conn:
+            with conn.cursor(name="iterar_movimentacoes") as cur:
+                cur.itersize = LINHAS_POR_BLOCO
+                cur.execute(sql + " ORDER BY m.data_hora, m.id", params)
+                yield from cur
+
+    # Carga em massa (migrar.py)
+    def vazio(self):
+        return self._consultar("SELECT NOT EXISTS (SELECT 1 FROM produtos) AND NOT EXISTS (SELECT 1 FROM movimentacoes)",
+                               um=True)[0]
+
+    def limpar(self):
+        self._transacao(lambda cur: cur.execute(
+            "TRUNCATE movimentacoes, estoque_local, totais_local, produtos, locais, usuarios RESTART IDENTITY"))
+
+    def importar(self, tabela, colunas, linhas):
+        # COPY FROM STDIN em uma transação por tabela; devolve quantas linhas.
+        # Fora de _transacao: `linhas` só pode ser lido uma vez, então uma
+        # falha não é refeita (a migração inteira é que deve ser repetida).
+        n = 0
+        try:
+            with self.pool.connection() as conn, conn.cursor() as cur:
+                with cur.copy(f"COPY {tabela} ({', '.join(colunas)}) FROM STDIN") as copia:
+                    for linha in linhas:
+                        copia.write_row(linha)
+                        n += 1
+        except self._erros.UniqueViolation as e:
+            raise ErroIntegridade(str(e)) from e
+        return n
+
+    def finalizar_importacao(self):
+        # Identidades continuam depois dos ids copiados; agregados refeitos
+        def finalizar(cur):
+            for tabela, _colunas in TABELAS_IMPORTACAO:
+                if tabela != "estoque_local":
+                    cur.execute(f"""
+                        SELECT setval(pg_get_serial_sequence('{tabela}', 'id'),
+                                      COALESCE((SELECT MAX(id) FROM {tabela}), 0) + 1, false)
+                    """)
+            cur.execute(SQL_RECALCULAR_TOTAIS)
+            for tabela, _colunas in TABELAS_IMPORTACAO:
+                cur.execute(f"ANALYZE {tabela}")
+        self._transacao(finalizar)
@@ -0,0 +1,289 @@
+# snapshots.py
+# Cópia colunar (Parquet) de produtos, locais e movimentações para análises
+# históricas, lida pelo dashboard sem passar pelo banco transacional.
+#
+#   snapshots/
+#     manifesto.json
+#     produtos.parquet, locais.parquet              (reescritos a cada execução)
+#     movimentacoes/mes=AAAA-MM/parte-<id>-<geração>.parquet  (só as linhas novas)
+#
+# O manifesto é quem diz quais partes valem: as novas são gravadas antes, o
+# manifesto é trocado de uma vez (os.replace) e só então as partes que ele
+# deixou de citar são apagadas, então o dashboard lendo ao mesmo tempo nunca
+# vê uma parte faltando nem a mesma linha duas vezes.
+# Movimentações só são inseridas (os UPDATEs acontecem na mesma transação do
+# INSERT), então a atualização incremental exporta apenas id > último id. A
+# exceção é a mesclagem de produtos duplicados, que força uma exportação completa.
+import os
+import sys
+import json
+import glob
+import time
+import secrets
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import banco
+import repositorio
+
+# ---------------- Configurações ----------------
+SNAPSHOT_DIR = os.path.join(banco.BASE_DIR, "snapshots")
+MANIFESTO = "manifesto.json"
+LINHAS_POR_BLOCO = 200000    # linhas lidas do SQLite por vez
+MAX_PARTES_POR_MES = 8       # acima disso as partes do mês são compactadas num arquivo
+COMPRESSAO = "zstd"
+
+SCHEMA_MOVIMENTACOES = pa.schema([
+    ("id", pa.int64()),
+    ("data_hora", pa.timestamp("s")),
+    ("produto_id", pa.int64()),
+    ("quantidade", pa.int64()),
+    ("tipo", pa.string()),
+    ("local_id", pa.int64()),
+    ("usuario", pa.string()),
+    ("observacao", pa.string()),
+    ("transferencia_id", pa.int64()),
+    ("custo_unitario", pa.float64()),
+    ("cmv_medio", pa.float64()),
+    ("cmv_fifo", pa.float64()),
+])
+
+SCHEMA_PRODUTOS = pa.schema([
+    ("id", pa.int64()),
+    ("nome", pa.string()),
+    ("categoria", pa.string()),
+    ("quantidade", pa.int64()),
+    ("preco_unitario", pa.float64()),
+    ("fornecedor", pa.string()),
+    ("codigo_barras", pa.string()),
+])
+
+SCHEMA_LOCAIS = pa.schema([
+    ("id", pa.int64()),
+    ("nome", pa.string()),
+    ("tipo", pa.string()),
+])
+
+
+# ---------------- Escrita ----------------
+def _gravar(tabela, caminho):
+    # Grava em arquivo temporário e troca: leitores nunca veem arquivo pela metade
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    tmp = caminho + ".tmp"
+    pq.write_table(tabela, tmp, compression=COMPRESSAO)
+    os.replace(tmp, caminho)
+
+
+def _tabela(linhas, schema):
+    colunas = list(zip(*linhas)) if linhas else [()] * len(schema)
+    return pa.Table.from_arrays(
+        [pa.array(c, type=campo.type) for c, campo in zip(colunas, schema)], schema=schema
+    )
+
+
+def _tabela_movimentacoes(linhas):
+    # data_hora vem como texto do SQLite; converte para timestamp
+    colunas = list(zip(*linhas))
+    texto = pc.utf8_slice_codeunits(pa.array(colunas[1], type=pa.string()), 0, 19)
+    arrays = [pa.array(c, type=campo.type) if i != 1 else
+              pc.strptime(texto, format="%Y-%m-%d %H:%M:%S", unit="s", error_is_null=True)
+              for i, (c, campo) in enumerate(zip(colunas, SCHEMA_MOVIMENTACOES))]
+    return pa.Table.from_arrays(arrays, schema=SCHEMA_MOVIMENTACOES)
+
+
+def _caminho_mes(destino_dir, mes):
+    return os.path.join(destino_dir, "movimentacoes", f"mes={mes}")
+
+
+def _nome_parte(primeiro_id, geracao):
+    # A geração (uma por execução) evita reescrever uma parte que o
+    # manifesto em uso ainda cita
+    return f"parte-{primeiro_id:012d}-{geracao}.parquet"
+
+
+def _compactar(destino_dir, mes, info, geracao):
+    # Junta as partes de um mês num arquivo só, ordenado por id; as partes
+    # antigas ficam até o novo manifesto ser gravado
+    pasta = _caminho_mes(destino_dir, mes)
+    partes = [os.path.join(pasta, a) for a in info["arquivos"]]
+    tabela = pa.concat_tables([pq.read_table(p, memory_map=True) for p in partes]).sort_by("id")
+    nome = _nome_parte(tabela["id"][0].as_py(), geracao)
+    _gravar(tabela, os.path.join(pasta, nome))
+    info["arquivos"] = [nome]
+
+
+def _remover_nao_citadas(destino_dir, manifesto):
+    # Partes que o manifesto gravado não cita mais (compactadas, ou de antes
+    # de uma exportação completa)
+    citadas = {os.path.normpath(os.path.join(_caminho_mes(destino_dir, mes), arquivo))
+               for mes, info in manifesto["movimentacoes"].items() for arquivo in info["arquivos"]}
+    for arquivo in glob.glob(os.path.join(destino_dir, "movimentacoes", "mes=*", "*.parquet")):
+        if os.path.normpath(arquivo) not in citadas:
+            os.remove(arquivo)
+
+
+def carregar_manifesto(destino_dir=SNAPSHOT_DIR):
+    try:
+        with open(os.path.join(destino_dir, MANIFESTO), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _mesclagens(conn):
+    return conn.execute("SELECT COUNT(*) FROM mesclagens").fetchone()[0]
+
+
+def _manifesto_valido(conn, manifesto):
+    # Depois de restaurar um backup o histórico pode ter voltado no tempo:
+    # a última movimentação exportada precisa continuar igual no banco.
+    # Mesclar produtos (banco.mesclar_produtos) reescreve movimentações antigas.
+    if manifesto is None or manifesto.get("mesclagens", 0) != _mesclagens(conn):
+        return False
+    if not manifesto["ultimo_id"]:
+        return True
+    row = conn.execute("SELECT data_hora FROM movimentacoes WHERE id = ?", (manifesto["ultimo_id"],)).fetchone()
+    return row is not None and row[0] == manifesto["ultimo_data_hora"]
+
+
+def atualizar(destino_dir=SNAPSHOT_DIR, completo=False):
+    # Exporta produtos e locais inteiros e as movimentações novas desde o
+    # último snapshot. Tudo é lido numa única transação de leitura (mesmo
+    # instante do banco). Devolve um resumo da execução.
+    inicio = time.monotonic()
+    geracao = secrets.token_hex(4)
+    conn = banco.get_conn()
+    try:
+        conn.execute("BEGIN")
+        manifesto = None if completo else carregar_manifesto(destino_dir)
+        if not _manifesto_valido(conn, manifesto):
+            # exportação completa; as partes antigas saem depois do novo manifesto
+            manifesto = {"ultimo_id": 0, "ultimo_data_hora": None, "movimentacoes": {}, "mesclagens": _mesclagens(conn)}
+
+        produtos = conn.execute("""
+            SELECT id, nome, categoria, quantidade, preco_unitario, fornecedor, codigo_barras
+            FROM produtos ORDER BY id
+        """).fetchall()
+        locais = conn.execute("SELECT id, nome, tipo FROM locais ORDER BY id").fetchall()
+
+        cur = conn.execute("""
+            SELECT substr(data_hora, 1, 7), id, data_hora, produto_id, quantidade, tipo, local_id, usuario,
+                   observacao, transferencia_id, custo_unitario, cmv_medio, cmv_fifo
+            FROM movimentacoes WHERE id > ? ORDER BY id
+        """, (manifesto["ultimo_id"],))
+        novas = 0
+        meses_alterados = set()
+        while True:
+            linhas = cur.fetchmany(LINHAS_POR_BLOCO)
+            if not linhas:
+                break
+            por_mes = {}
+            for linha in linhas:
+                por_mes.setdefault(linha[0], []).append(linha[1:])
+            for mes, grupo in por_mes.items():
+                nome = _nome_parte(grupo[0][0], geracao)
+                _gravar(_tabela_movimentacoes(grupo), os.path.join(_caminho_mes(destino_dir, mes), nome))
+                info = manifesto["movimentacoes"].setdefault(mes, {"arquivos": [], "linhas": 0})
+                info["arquivos"].append(nome)
+                info["linhas"] += len(grupo)
+                meses_alterados.add(mes)
+            novas += len(linhas)
+            manifesto["ultimo_id"] = linhas[-1][1]
+            manifesto["ultimo_data_hora"] = linhas[-1][2]
+    finally:
+        conn.rollback()
+        conn.close()
+
+    _gravar(_tabela(produtos, SCHEMA_PRODUTOS), os.path.join(destino_dir, "produtos.parquet"))
+    _gravar(_tabela(locais, SCHEMA_LOCAIS), os.path.join(destino_dir, "locais.parquet"))
+    for mes in meses_alterados:
+        info = manifesto["movimentacoes"][mes]
+        if len(info["arquivos"]) > MAX_PARTES_POR_MES:
+            _compactar(destino_dir, mes, info, geracao)
+
+    manifesto["gerado_em"] = datetime.now().isoformat(sep=" ", timespec="seconds")
+    manifesto["produtos"] = len(produtos)
+    tmp = os.path.join(destino_dir, MANIFESTO + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, os.path.join(destino_dir, MANIFESTO))
+    _remover_nao_citadas(destino_dir, manifesto)
+
+    return {
+        "gerado_em": manifesto["gerado_em"],
+        "produtos": len(produtos),
+        "movimentacoes_novas": novas,
+        "movimentacoes_total": sum(i["linhas"] for i in manifesto["movimentacoes"].values()),
+        "meses_alterados": len(meses_alterados),
+        "duracao_s": round(time.monotonic() - inicio, 2),
+    }
+
+
+# ---------------- Leitura ----------------
+def ler_produtos(colunas=None, destino_dir=SNAPSHOT_DIR):
+    # Tabela Arrow (memory-mapped, só as colunas pedidas) ou None sem snapshot
+    caminho = os.path.join(destino_dir, "produtos.parquet")
+    if not os.path.exists(caminho):
+        return None
+    return pq.read_table(caminho, columns=colunas, memory_map=True)
+
+
+def ler_locais(destino_dir=SNAPSHOT_DIR):
+    caminho = os.path.join(destino_dir, "locais.parquet")
+    if not os.path.exists(caminho):
+        return None
+    return pq.read_table(caminho, memory_map=True)
+
+
+def ler_movimentacoes(colunas=None, inicio=None, fim=None, destino_dir=SNAPSHOT_DIR):
+    # Movimentações do snapshot entre as datas (AAAA-MM-DD, inclusivas).
+    # Só abre os meses do período e só lê as colunas pedidas.
+    # Devolve uma tabela Arrow, ou None se ainda não houver snapshot.
+    leitura = None
+    if colunas is not None:
+        leitura = list(colunas) + (["data_hora"] if (inicio or fim) and "data_hora" not in colunas else [])
+
+    for tentativa in range(3):
+        manifesto = carregar_manifesto(destino_dir)
+        if manifesto is None:
+            return None
+        try:
+            tabelas = []
+            for mes in sorted(manifesto["movimentacoes"]):
+                if (inicio and mes < inicio[:7]) or (fim and mes > fim[:7]):
+                    continue
+                for arquivo in manifesto["movimentacoes"][mes]["arquivos"]:
+                    tabelas.append(pq.read_table(os.path.join(_caminho_mes(destino_dir, mes), arquivo),
+                                                 columns=leitura, memory_map=True))
+            break
+        except FileNotFoundError:
+            # uma atualização trocou o manifesto entre a leitura dele e a das partes
+            if tentativa == 2:
+                raise
+    if not tabelas:
+        schema = SCHEMA_MOVIMENTACOES if leitura is None else pa.schema([SCHEMA_MOVIMENTACOES.field(c) for c in leitura])
+        return schema.empty_table().select(list(colunas) if colunas is not None else schema.names)
+    tabela = pa.concat_tables(tabelas)
+
+    if inicio:
+        tabela = tabela.filter(pc.greater_equal(tabela["data_hora"], pa.scalar(datetime.fromisoformat(inicio), pa.timestamp("s"))))
+    if fim:
+        limite = datetime.fromisoformat(fim).replace(hour=23, minute=59, second=59)
+        tabela = tabela.filter(pc.less_equal(tabela["data_hora"], pa.scalar(limite, pa.timestamp("s"))))
+    if colunas is not None:
+        tabela = tabela.select(list(colunas))
+    return tabela
+
+
+# ---------------- Linha de comando ----------------
+if __name__ == "__main__":
+    # python snapshots.py            -> atualização incremental (agendar no cron)
+    # python snapshots.py --completo -> refaz todas as partições
+    repositorio.usar_sqlite("snapshots.py")
+    banco.init_db()
+    resumo = atualizar(completo="--completo" in sys.argv)
+    print(f"Snapshot de {resumo['produtos']} produtos e {resumo['movimentacoes_total']} movimentações "
+          f"({resumo['movimentacoes_novas']} novas, {resumo['meses_alterados']} meses) em {resumo['duracao_s']}s")
@@ -0,0 +1,533 @@
+# tarefas.py
+# Relatórios pesados gerados fora da sessão do usuário. O dashboard só
+# enfileira (tabela `tarefas`) e lê o arquivo pronto (tabela `artefatos`); um
+# worker (python tarefas.py) executa a fila e os agendamentos.
+#
+# Cada artefato guarda a versão dos dados que leu: a soma dos contadores de
+# versao_dados (mantidos por trigger, ver banco._migracao_tarefas) das tabelas
+# do relatório. Enquanto a soma não muda, o arquivo pronto continua valendo e
+# é baixado na hora, sem recalcular.
+#
+#   python tarefas.py                              -> worker contínuo
+#   python tarefas.py --uma-vez                    -> esvazia a fila e sai (cron)
+#   python tarefas.py --solicitar estoque_xlsx
+#   python tarefas.py --agendar resumo_categorias 60
+#   python tarefas.py --listar
+import os
+import csv
+import json
+import time
+import socket
+import sqlite3
+import secrets
+import argparse
+from datetime import datetime, timedelta
+
+import banco
+import repositorio
+
+# ---------------- Configurações ----------------
+ARTEFATOS_DIR = os.path.join(banco.BASE_DIR, "relatorios")
+INTERVALO_FILA_S = 2          # espera do worker com a fila vazia
+INTERVALO_PROGRESSO_S = 1.0   # no máximo uma gravação de progresso por segundo
+LIMITE_SEM_SINAL_S = 300      # tarefa "executando" sem sinal há mais que isso volta para a fila
+MANTER_TAREFAS_DIAS = 30      # histórico de tarefas concluídas/falhas
+LINHAS_POR_BLOCO = 5000
+TENTATIVAS_AVISO = 5          # gravação do estado final da tarefa com o banco ocupado
+
+
+def _agora():
+    return datetime.now().isoformat(sep=" ", timespec="seconds")
+
+
+# ---------------- Relatórios ----------------
+def _contar(conn, sql, params=()):
+    return conn.execute(f"SELECT COUNT(*) FROM ({sql})", params).fetchone()[0]
+
+
+def _linhas(conn, sql, params, progresso):
+    # Cabeçalho e linhas da consulta em blocos, avisando o progresso
+    total = _contar(conn, sql, params) or 1
+    cur = conn.execute(sql, params)
+    yield [d[0] for d in cur.description]
+    feitas = 0
+    while True:
+        bloco = cur.fetchmany(LINHAS_POR_BLOCO)
+        if not bloco:
+            break
+        yield from bloco
+        feitas += len(bloco)
+        progresso(feitas / total, f"{feitas} de {total} linhas")
+
+
+def _gravar_csv(linhas, caminho):
+    with open(caminho, "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows(linhas)
+
+
+def _gravar_xlsx(linhas, caminho, planilha, progresso):
+    # write_only: as linhas vão direto para o arquivo, sem montar a planilha na memória.
+    # O save compacta tudo de uma vez e pode demorar: sinal de vida antes e depois.
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(planilha)
+    for linha in linhas:
+        ws.append(list(linha))
+    progresso(0.99, "gravando a planilha", forcar=True)
+    wb.save(caminho)
+    progresso(0.99, "planilha gravada", forcar=True)
+
+
+SQL_ESTOQUE = "SELECT * FROM produtos ORDER BY id"
+
+SQL_RESUMO_CATEGORIAS = """
+    SELECT categoria, COUNT(*) AS produtos, SUM(quantidade) AS quantidade,
+           ROUND(SUM(quantidade * preco_unitario), 2) AS valor
+    FROM produtos GROUP BY categoria ORDER BY categoria
+"""
+
+
+def _estoque_csv(conn, caminho, parametros, progresso):
+    _gravar_csv(_linhas(conn, SQL_ESTOQUE, (), progresso), caminho)
+
+
+def _estoque_xlsx(conn, caminho, parametros, progresso):
+    _gravar_xlsx(_linhas(conn, SQL_ESTOQUE, (), progresso), caminho, "estoque", progresso)
+
+
+def _resumo_categorias(conn, caminho, parametros, progresso):
+    _gravar_csv(_linhas(conn, SQL_RESUMO_CATEGORIAS, (), progresso), caminho)
+
+
+def _movimentacoes(conn, caminho, parametros, progresso):
+    # parametros: inicio/fim (AAAA-MM-DD, inclusivas) e local_id, todos opcionais
+    sql = """
+        SELECT m.id, m.data_hora, m.tipo, m.produto_id, p.nome AS produto, m.quantidade, l.nome AS local,
+               m.usuario, m.observacao, m.transferencia_id, m.custo_unitario
+        FROM movimentacoes m
+        LEFT JOIN produtos p ON p.id = m.produto_id
+        LEFT JOIN locais l ON l.id = m.local_id
+        WHERE 1 = 1
+    """
+    params = []
+    if parametros.get("inicio"):
+        sql += " AND m.data_hora >= ?"
+        params.append(parametros["inicio"])
+    if parametros.get("fim"):
+        sql += " AND m.data_hora < date(?, '+1 day')"
+        params.append(parametros["fim"])
+    if parametros.get("local_id") is not None:
+        sql += " AND m.local_id = ?"
+        params.append(parametros["local_id"])
+    _gravar_csv(_linhas(conn, sql + " ORDER BY m.data_hora, m.id", params, progresso), caminho)
+
+
+MIME_CSV = "text/csv"
+MIME_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# nome -> definição; "tabelas" são as que o relatório lê (a versão dos dados
+# é a soma dos contadores delas)
+RELATORIOS = {
+    "estoque_csv": {
+        "titulo": "Estoque completo (CSV)",
+        "tabelas": ("produtos",),
+        "extensao": "csv", "mime": MIME_CSV,
+        "gerar": _estoque_csv,
+    },
+    "estoque_xlsx": {
+        "titulo": "Estoque completo (Excel)",
+        "tabelas": ("produtos",),
+        "extensao": "xlsx", "mime": MIME_XLSX,
+        "gerar": _estoque_xlsx,
+    },
+    "resumo_categorias": {
+        "titulo": "Resumo por categoria",
+        "tabelas": ("produtos",),
+        "extensao": "csv", "mime": MIME_CSV,
+        "gerar": _resumo_categorias,
+    },
+    "movimentacoes": {
+        "titulo": "Histórico de movimentações (CSV)",
+        "tabelas": ("movimentacoes", "produtos", "locais"),
+        "extensao": "csv", "mime": MIME_CSV,
+        "gerar": _movimentacoes,
+    },
+}
+
+
+# ---------------- Fila ----------------
+def _chave(parametros):
+    # Parâmetros em JSON canônico: a mesma combinação sempre dá o mesmo texto
+    return json.dumps(parametros or {}, sort_keys=True, ensure_ascii=False)
+
+
+def _definicao(relatorio):
+    if relatorio not in RELATORIOS:
+        raise ValueError(f"Relatório desconhecido: {relatorio}")
+    return RELATORIOS[relatorio]
+
+
+def _versao(conn, tabelas):
+    return conn.execute(
+        f"SELECT COALESCE(SUM(versao), 0) FROM versao_dados WHERE tabela IN ({','.join('?' * len(tabelas))})",
+        tabelas,
+    ).fetchone()[0]
+
+
+def versao_dados(relatorio):
+    conn = banco.get_conn()
+    try:
+        return _versao(conn, _definicao(relatorio)["tabelas"])
+    finally:
+        conn.close()
+
+
+COLUNAS_TAREFA = ("id", "relatorio", "parametros", "estado", "progresso", "mensagem", "solicitado_por",
+                  "criada_em", "iniciada_em", "concluida_em", "atualizada_em", "worker")
+COLUNAS_ARTEFATO = ("relatorio", "parametros", "versao_dados", "arquivo", "tamanho", "tarefa_id", "gerado_em")
+
+
+def _tarefa(row):
+    return dict(zip(COLUNAS_TAREFA, row)) if row else None
+
+
+def situacao(relatorio, parametros=None):
+    # O que o dashboard precisa mostrar de um relatório:
+    # {"artefato": último arquivo (dict) ou None, "atualizado": se ainda vale
+    #  para os dados atuais, "tarefa": tarefa mais recente (dict) ou None}
+    definicao = _definicao(relatorio)
+    chave = _chave(parametros)
+    conn = banco.get_conn()
+    try:
+        conn.execute("BEGIN")
+        versao = _versao(conn, definicao["tabelas"])
+        row = conn.execute(f"SELECT {', '.join(COLUNAS_ARTEFATO)} FROM artefatos WHERE relatorio = ? AND parametros = ?",
+                           (relatorio, chave)).fetchone()
+        artefato = dict(zip(COLUNAS_ARTEFATO, row)) if row else None
+        tarefa = _tarefa(conn.execute(f"""
+            SELECT {', '.join(COLUNAS_TAREFA)} FROM tarefas
+            WHERE relatorio = ? AND parametros = ? ORDER BY id DESC LIMIT 1
+        """, (relatorio, chave)).fetchone())
+    finally:
+        conn.rollback()
+        conn.close()
+    if artefato is not None and not os.path.exists(caminho_artefato(artefato)):
+        artefato = None
+    return {
+        "artefato": artefato,
+        "atualizado": artefato is not None and artefato["versao_dados"] == versao,
+        "tarefa": tarefa,
+    }
+
+
+def caminho_artefato(artefato, destino_dir=None):
+    return os.path.join(destino_dir or ARTEFATOS_DIR, artefato["arquivo"])
+
+
+def _solicitar(cur, relatorio, chave, usuario, forcar):
+    # Dentro de BEGIN IMMEDIATE: devolve a tarefa já ativa para os mesmos
+    # parâmetros, None se o artefato ainda vale, ou enfileira uma nova
+    cur.execute("""
+        SELECT id FROM tarefas
+        WHERE relatorio = ? AND parametros = ? AND estado IN ('pendente','executando')
+        ORDER BY id LIMIT 1
+    """, (relatorio, chave))
+    row = cur.fetchone()
+    if row:
+        return row[0]
+    if not forcar:
+        cur.execute("SELECT versao_dados FROM artefatos WHERE relatorio = ? AND parametros = ?", (relatorio, chave))
+        row = cur.fetchone()
+        if row and row[0] == _versao(cur, RELATORIOS[relatorio]["tabelas"]):
+            return None
+    cur.execute("INSERT INTO tarefas (relatorio, parametros, solicitado_por, criada_em) VALUES (?, ?, ?, ?)",
+                (relatorio, chave, usuario, _agora()))
+    return cur.lastrowid
+
+
+def solicitar(relatorio, parametros=None, usuario=None, forcar=False):
+    # Pede a geração do relatório. Vários pedidos iguais viram uma tarefa só.
+    # Devolve o id da tarefa, ou None se o arquivo pronto já corresponde aos
+    # dados atuais (a não ser com forcar=True).
+    _definicao(relatorio)
+    conn = banco.get_conn()
+    conn.isolation_level = None
+    cur = conn.cursor()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            tarefa_id = _solicitar(cur, relatorio, _chave(parametros), usuario, forcar)
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+        return tarefa_id
+    finally:
+        conn.close()
+
+
+def listar_tarefas(limit=50):
+    conn = banco.get_conn()
+    try:
+        return [_tarefa(r) for r in conn.execute(
+            f"SELECT {', '.join(COLUNAS_TAREFA)} FROM tarefas ORDER BY id DESC LIMIT ?", (limit,))]
+    finally:
+        conn.close()
+
+
+def agendar(relatorio, intervalo_min, parametros=None):
+    # O worker solicita o relatório a cada intervalo_min minutos (e nada é
+    # refeito se os dados não mudaram)
+    _definicao(relatorio)
+    conn = banco.get_conn()
+    try:
+        conn.execute("""
+            INSERT INTO agendamentos (relatorio, parametros, intervalo_min, proxima_em) VALUES (?, ?, ?, ?)
+            ON CONFLICT(relatorio, parametros) DO UPDATE SET intervalo_min = excluded.intervalo_min
+        """, (relatorio, _chave(parametros), intervalo_min, _agora()))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def desagendar(relatorio, parametros=None):
+    conn = banco.get_conn()
+    try:
+        conn.execute("DELETE FROM agendamentos WHERE relatorio = ? AND parametros = ?", (relatorio, _chave(parametros)))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+# ---------------- Worker ----------------
+class _TarefaPerdida(Exception):
+    # A tarefa voltou para a fila (ficou sem sinal) e não é mais deste worker
+    pass
+
+
+def _transacao(conn, funcao, *args):
+    # Executa funcao(cur, ...) em BEGIN IMMEDIATE (conn em autocommit)
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        resultado = funcao(cur, *args)
+        cur.execute("COMMIT")
+    except BaseException:
+        cur.execute("ROLLBACK")
+        raise
+    return resultado
+
+
+def _manutencao(cur):
+    # Devolve à fila tarefas de workers que pararam de dar sinal, dispara os
+    # agendamentos vencidos e apaga histórico antigo
+    agora = datetime.now()
+    limite = (agora - timedelta(seconds=LIMITE_SEM_SINAL_S)).isoformat(sep=" ", timespec="seconds")
+    cur.execute("""
+        UPDATE tarefas SET estado = 'pendente', progresso = 0, mensagem = 'reiniciada (worker sem sinal)'
+        WHERE estado = 'executando' AND COALESCE(atualizada_em, iniciada_em) < ?
+    """, (limite,))
+
+    cur.execute("SELECT relatorio, parametros, intervalo_min FROM agendamentos WHERE proxima_em <= ?",
+                (agora.isoformat(sep=" ", timespec="seconds"),))
+    for relatorio, chave, intervalo in cur.fetchall():
+        if relatorio in RELATORIOS:
+            _solicitar(cur, relatorio, chave, "agendamento", False)
+        proxima = (agora + timedelta(minutes=intervalo)).isoformat(sep=" ", timespec="seconds")
+        cur.execute("UPDATE agendamentos SET proxima_em = ? WHERE relatorio = ? AND parametros = ?",
+                    (proxima, relatorio, chave))
+
+    antigas = (agora - timedelta(days=MANTER_TAREFAS_DIAS)).isoformat(sep=" ", timespec="seconds")
+    cur.execute("""
+        DELETE FROM tarefas
+        WHERE estado IN ('concluida','falhou') AND concluida_em < ?
+          AND id NOT IN (SELECT tarefa_id FROM artefatos WHERE tarefa_id IS NOT NULL)
+    """, (antigas,))
+
+
+def _pegar(cur, worker):
+    # A tarefa pendente mais antiga passa a ser deste worker
+    cur.execute("SELECT id, relatorio, parametros FROM tarefas WHERE estado = 'pendente' ORDER BY id LIMIT 1")
+    row = cur.fetchone()
+    if row is None:
+        return None
+    agora = _agora()
+    cur.execute("""
+        UPDATE tarefas SET estado = 'executando', progresso = 0, mensagem = NULL,
+            iniciada_em = ?, atualizada_em = ?, worker = ?
+        WHERE id = ?
+    """, (agora, agora, worker, row[0]))
+    return row
+
+
+def _concluir(cur, tarefa_id, worker, relatorio, chave, versao, arquivo, tamanho):
+    # Registra o novo artefato; devolve o arquivo anterior (para apagar)
+    cur.execute("SELECT 1 FROM tarefas WHERE id = ? AND estado = 'executando' AND worker = ?", (tarefa_id, worker))
+    if cur.fetchone() is None:
+        raise _TarefaPerdida()
+    cur.execute("SELECT arquivo FROM artefatos WHERE relatorio = ? AND parametros = ?", (relatorio, chave))
+    anterior = cur.fetchone()
+    agora = _agora()
+    cur.execute("""
+        INSERT INTO artefatos (relatorio, parametros, versao_dados, arquivo, tamanho, tarefa_id, gerado_em)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(relatorio, parametros) DO UPDATE SET
+            versao_dados = excluded.versao_dados, arquivo = excluded.arquivo, tamanho = excluded.tamanho,
+            tarefa_id = excluded.tarefa_id, gerado_em = excluded.gerado_em
+    """, (relatorio, chave, versao, arquivo, tamanho, tarefa_id, agora))
+    cur.execute("""
+        UPDATE tarefas SET estado = 'concluida', progresso = 1, mensagem = NULL, concluida_em = ?, atualizada_em = ?
+        WHERE id = ?
+    """, (agora, agora, tarefa_id))
+    return anterior[0] if anterior and anterior[0] != arquivo else None
+
+
+def _avisar(conn, sql, params):
+    # Estado final da tarefa; com o banco ocupado tenta de novo e, se não der,
+    # desiste sem derrubar o worker (a tarefa volta para a fila por falta de sinal)
+    for tentativa in range(TENTATIVAS_AVISO):
+        try:
+            conn.execute(sql, params)
+            return
+        except sqlite3.OperationalError as e:
+            if tentativa == TENTATIVAS_AVISO - 1:
+                print(f"[{_agora()}] não foi possível atualizar a tarefa {params[-1]}: {e}", flush=True)
+                return
+            time.sleep(0.5 * (tentativa + 1))
+
+
+def executar(tarefa_id, relatorio, chave, destino_dir=None, worker=None):
+    # Gera o arquivo numa única transação de leitura: a versão registrada é a
+    # do mesmo instante dos dados lidos. O sinal de vida também confere que a
+    # tarefa continua deste worker: se voltou para a fila, a geração para.
+    destino_dir = destino_dir or ARTEFATOS_DIR
+    definicao = _definicao(relatorio)
+    os.makedirs(destino_dir, exist_ok=True)
+    # nome com sufixo aleatório: ids de tarefa se repetem depois de restaurar um backup
+    arquivo = f"{relatorio}-{tarefa_id}-{secrets.token_hex(4)}.{definicao['extensao']}"
+    caminho = os.path.join(destino_dir, arquivo)
+    tmp = caminho + ".tmp"
+
+    avisos = banco.get_conn()
+    avisos.isolation_level = None
+    ultimo = [0.0]
+
+    def progresso(fracao, mensagem=None, forcar=False):
+        # Também serve de sinal de vida; banco ocupado aqui não derruba o relatório
+        agora = time.monotonic()
+        if not forcar and agora - ultimo[0] < INTERVALO_PROGRESSO_S:
+            return
+        ultimo[0] = agora
+        try:
+            cur = avisos.execute("""
+                UPDATE tarefas SET progresso = ?, mensagem = ?, atualizada_em = ?
+                WHERE id = ? AND estado = 'executando' AND worker IS ?
+            """, (min(max(fracao, 0.0), 0.99), mensagem, _agora(), tarefa_id, worker))
+        except sqlite3.OperationalError:
+            return
+        if cur.rowcount == 0:
+            raise _TarefaPerdida()
+
+    conn = banco.get_conn()
+    try:
+        try:
+            conn.execute("BEGIN")
+            versao = _versao(conn, definicao["tabelas"])
+            definicao["gerar"](conn, tmp, json.loads(chave), progresso)
+        finally:
+            conn.rollback()
+            conn.close()
+        os.replace(tmp, caminho)
+        try:
+            anterior = _transacao(avisos, _concluir, tarefa_id, worker, relatorio, chave, versao, arquivo,
+                                  os.path.getsize(caminho))
+        except BaseException:
+            os.remove(caminho)
+            raise
+        if anterior:
+            try:
+                os.remove(os.path.join(destino_dir, anterior))
+            except FileNotFoundError:
+                pass
+        return True
+    except _TarefaPerdida:
+        print(f"[{_agora()}] tarefa {tarefa_id} voltou para a fila; abandonada por este worker", flush=True)
+        return False
+    except KeyboardInterrupt:
+        _avisar(avisos, "UPDATE tarefas SET estado = 'pendente', progresso = 0, mensagem = 'interrompida' WHERE id = ?",
+                (tarefa_id,))
+        raise
+    except Exception as e:
+        _avisar(avisos, """
+            UPDATE tarefas SET estado = 'falhou', mensagem = ?, concluida_em = ?, atualizada_em = ? WHERE id = ?
+        """, (f"{type(e).__name__}: {e}", _agora(), _agora(), tarefa_id))
+        return False
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        avisos.close()
+
+
+def trabalhar(uma_vez=False, destino_dir=None):
+    # Laço do worker: manutenção, depois a fila até esvaziar. Vários workers
+    # podem rodar juntos (cada tarefa é pega em BEGIN IMMEDIATE).
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    conn = banco.get_conn()
+    conn.isolation_level = None
+    executadas = falhas = 0
+    try:
+        while True:
+            try:
+                _transacao(conn, _manutencao)
+                while True:
+                    tarefa = _transacao(conn, _pegar, worker)
+                    if tarefa is None:
+                        break
+                    print(f"[{_agora()}] tarefa {tarefa[0]}: {tarefa[1]} {tarefa[2]}", flush=True)
+                    if executar(*tarefa, destino_dir=destino_dir, worker=worker):
+                        executadas += 1
+                    else:
+                        falhas += 1
+            except sqlite3.OperationalError as e:
+                # banco ocupado por mais que o timeout: tenta de novo na próxima volta
+                print(f"[{_agora()}] {e}", flush=True)
+            if uma_vez:
+                return {"executadas": executadas, "falhas": falhas}
+            time.sleep(INTERVALO_FILA_S)
+    finally:
+        conn.close()
+
+
+# ---------------- Linha de comando ----------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fila de relatórios em segundo plano.")
+    parser.add_argument("--uma-vez", action="store_true", help="processa a fila e sai")
+    parser.add_argument("--solicitar", metavar="RELATORIO", choices=sorted(RELATORIOS))
+    parser.add_argument("--parametros", default="{}", help="JSON, ex.: '{\"inicio\": \"2024-01-01\"}'")
+    parser.add_argument("--forcar", action="store_true", help="gera mesmo se os dados não mudaram")
+    parser.add_argument("--agendar", nargs=2, metavar=("RELATORIO", "MINUTOS"))
+    parser.add_argument("--desagendar", metavar="RELATORIO")
+    parser.add_argument("--listar", action="store_true", help="últimas tarefas")
+    args = parser.parse_args()
+
+    repositorio.usar_sqlite("tarefas.py")
+    banco.init_db()
+    parametros = json.loads(args.parametros)
+    if args.solicitar:
+        tarefa_id = solicitar(args.solicitar, parametros, usuario="linha de comando", forcar=args.forcar)
+        print(f"Tarefa {tarefa_id} na fila." if tarefa_id else "Relatório já está atualizado.")
+    elif args.agendar:
+        agendar(args.agendar[0], int(args.agendar[1]), parametros)
+        print(f"{args.agendar[0]} agendado a cada {args.agendar[1]} min.")
+    elif args.desagendar:
+        desagendar(args.desagendar, parametros)
+    elif args.listar:
+        for t in listar_tarefas():
+            print(f"{t['id']:>6} {t['relatorio']:<20} {t['estado']:<11} {t['progresso'] * 100:5.1f}% "
+                  f"{t['criada_em']} {t['mensagem'] or ''}")
+    else:
+        try:
+            resumo = trabalhar(uma_vez=args.uma_vez)
+            print(f"{resumo['executadas']} tarefas executadas, {resumo['falhas']} com falha.")
+        except KeyboardInterrupt:
+            pass
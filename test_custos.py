@@ -0,0 +1,66 @@
+# test_custos.py
+# Valoração pelo custo médio ponderado e por camadas FIFO, e CMV por período
+from datetime import date, timedelta
+
+import pytest
+
+import banco
+
+
+@pytest.fixture
+def banco_vazio(tmp_path, monkeypatch):
+    monkeypatch.setattr(banco, "DB_PATH", str(tmp_path / "estoque.db"))
+    banco.init_db(criar_admin=False)
+
+
+def test_custo_medio_e_fifo(banco_vazio):
+    pid = banco.inserir_produto("Parafuso", "Ferramentas", 0, 10.0, None)
+    banco.inserir_movimentacao(pid, 10, "entrada", custo_unitario=4.0)
+    banco.inserir_movimentacao(pid, 10, "entrada", custo_unitario=6.0)
+    # médio (10*4 + 10*6) / 20 = 5,00
+    assert banco.valoracao_total() == pytest.approx((100.0, 100.0, 0.0, 0.0))
+
+    # 15 saem: médio 15*5 = 75; FIFO 10*4 + 5*6 = 70
+    banco.inserir_movimentacao(pid, 15, "saida")
+    assert banco.valoracao_total() == pytest.approx((25.0, 30.0, 75.0, 70.0))
+
+    # entram 5 a 9,00: médio (5*5 + 5*9) / 10 = 7,00; FIFO 5*6 + 5*9 = 75
+    banco.inserir_movimentacao(pid, 5, "entrada", custo_unitario=9.0)
+    assert banco.valoracao_total() == pytest.approx((70.0, 75.0, 75.0, 70.0))
+
+    # 8 saem: médio 8*7 = 56; FIFO 5*6 + 3*9 = 57
+    banco.inserir_movimentacao(pid, 8, "saida")
+    assert banco.valoracao_total() == pytest.approx((14.0, 18.0, 131.0, 127.0))
+    assert banco.valoracao_produtos() == [
+        (pid, "Parafuso", "Ferramentas", 2, pytest.approx(7.0), pytest.approx(14.0), pytest.approx(18.0))]
+
+
+def test_entrada_sem_custo_e_ajuste_manual(banco_vazio):
+    # estoque inicial vale o preço; entrada sem custo entra pelo médio:
+    # camadas 4 a 5,00, 4 a 7,00 e 2 a 6,00 (médio 6,00)
+    pid = banco.inserir_produto("Parafuso", "Ferramentas", 4, 5.0, None)
+    banco.inserir_movimentacao(pid, 4, "entrada", custo_unitario=7.0)
+    banco.inserir_movimentacao(pid, 2, "entrada")
+    assert banco.valoracao_total() == pytest.approx((60.0, 60.0, 0.0, 0.0))
+
+    # ajuste para menos sai do FIFO mais antigo e não entra no CMV:
+    # médio 5*6 = 30; FIFO 60 - (4*5 + 1*7) = 33
+    versao = banco.obter_produto(pid)["versao"]
+    assert banco.atualizar_produto(pid, versao, {}, quantidade=5, quantidade_anterior=10)[0]
+    assert banco.valoracao_total() == pytest.approx((30.0, 33.0, 0.0, 0.0))
+
+
+def test_cmv_periodo(banco_vazio):
+    banco.inserir_local("Loja Centro")
+    origem = next(l[0] for l in banco.listar_locais() if l[1] == banco.LOCAL_PADRAO)
+    destino = next(l[0] for l in banco.listar_locais() if l[1] == "Loja Centro")
+    pid = banco.inserir_produto("Parafuso", "Ferramentas", 10, 3.0, None, custo_unitario=2.0)
+    banco.inserir_movimentacao(pid, 4, "saida")
+    # transferência não é venda: fica fora do CMV
+    banco.transferir_estoque(pid, 3, origem, destino)
+
+    hoje = date.today()
+    ontem = (hoje - timedelta(days=1)).isoformat()
+    assert banco.cmv_periodo(hoje.isoformat(), hoje.isoformat()) == pytest.approx((8.0, 8.0))
+    assert banco.cmv_periodo(ontem, ontem) == (0, 0)
+    assert banco.valoracao_total() == pytest.approx((12.0, 12.0, 8.0, 8.0))
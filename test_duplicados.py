@@ -0,0 +1,22 @@
+# test_duplicados.py
+# Busca de similares com trigramas que ainda não estão no índice
+import pytest
+
+import banco
+
+
+@pytest.fixture
+def banco_vazio(tmp_path, monkeypatch):
+    monkeypatch.setattr(banco, "DB_PATH", str(tmp_path / "estoque.db"))
+    banco.init_db(criar_admin=False)
+
+
+def test_similares_com_indice_vazio(banco_vazio):
+    assert banco.produtos_similares("Arroz 5kg") == []
+
+
+def test_similares_com_trigramas_desconhecidos(banco_vazio):
+    banco.inserir_produto("Arroz 5kg", "Alimentos", 0, 10.0, None)
+    assert banco.produtos_similares("Xilofone Azul Grande") == []
+    assert banco.produtos_similares("Zzqx") == []
+    assert [s[1] for s in banco.produtos_similares("Arroz 5 Kg")] == ["Arroz 5kg"]
@@ -0,0 +1,56 @@
+# test_edicao.py
+# Edição de produto com controle otimista (versão da linha)
+import pytest
+
+import banco
+
+
+@pytest.fixture
+def banco_vazio(tmp_path, monkeypatch):
+    monkeypatch.setattr(banco, "DB_PATH", str(tmp_path / "estoque.db"))
+    banco.init_db(criar_admin=False)
+
+
+def test_versao_antiga_e_recusada(banco_vazio):
+    pid = banco.inserir_produto("Parafuso", "Ferramentas", 1, 2.0, None)
+    # dois usuários abrem o formulário com a mesma versão
+    lida = banco.obter_produto(pid)["versao"]
+    assert banco.atualizar_produto(pid, lida, {"preco": 3.0}) == (True, lida + 1)
+    assert banco.atualizar_produto(pid, lida, {"nome": "Parafuso M6"}) == (
+        False, "O produto foi alterado ou removido por outro usuário.")
+
+    produto = banco.obter_produto(pid)
+    assert (produto["nome"], produto["preco"], produto["versao"]) == ("Parafuso", 3.0, lida + 1)
+    # com a versão atual a edição passa
+    assert banco.atualizar_produto(pid, lida + 1, {"nome": "Parafuso M6"}) == (True, lida + 2)
+
+
+def test_produto_removido(banco_vazio):
+    pid = banco.inserir_produto("Parafuso", "Ferramentas", 1, 2.0, None)
+    lida = banco.obter_produto(pid)["versao"]
+    banco.remover_produto(pid)
+    ok, _mensagem = banco.atualizar_produto(pid, lida, {"preco": 3.0})
+    assert not ok
+
+
+def test_quantidade_alterada_por_outro(banco_vazio):
+    pid = banco.inserir_produto("Parafuso", "Ferramentas", 10, 2.0, None)
+    lida = banco.obter_produto(pid)
+    # uma venda acontece com o formulário aberto
+    banco.inserir_movimentacao(pid, 3, "saida")
+    ok, mensagem = banco.atualizar_produto(pid, lida["versao"], {}, quantidade=12,
+                                           quantidade_anterior=lida["quantidade"])
+    assert (ok, mensagem) == (False, "O estoque do produto mudou desde que o formulário foi aberto.")
+    assert banco.obter_produto(pid)["quantidade"] == 7
+
+    # a venda não mexe na versão: só campos editados mudam a linha
+    assert banco.obter_produto(pid)["versao"] == lida["versao"]
+    assert banco.atualizar_produto(pid, lida["versao"], {}, quantidade=12, quantidade_anterior=7) == (
+        True, lida["versao"])
+    assert banco.obter_produto(pid)["quantidade"] == 12
+
+
+def test_campo_invalido(banco_vazio):
+    pid = banco.inserir_produto("Parafuso", "Ferramentas", 1, 2.0, None)
+    with pytest.raises(ValueError):
+        banco.atualizar_produto(pid, banco.obter_produto(pid)["versao"], {"quantidade": 5})
@@ -0,0 +1,45 @@
+# test_leituras.py
+# Gravação em lote do modo leitura: uma transação para todos os itens
+import pytest
+
+import banco
+
+
+@pytest.fixture
+def banco_vazio(tmp_path, monkeypatch):
+    monkeypatch.setattr(banco, "DB_PATH", str(tmp_path / "estoque.db"))
+    banco.init_db(criar_admin=False)
+
+
+def test_lote_grava_todos_os_itens(banco_vazio):
+    a = banco.inserir_produto("Parafuso", "Ferramentas", 5, 1.0, None)
+    b = banco.inserir_produto("Porca", "Ferramentas", 1, 1.0, None)
+    novas = banco.registrar_movimentacoes_lote({a: 2, b: 1}, "saida", usuario="caixa", observacao="modo leitura")
+
+    assert novas == {a: 3, b: 0}
+    movs = sorted((m[3], m[5], m[2], m[7]) for m in banco.iterar_movimentacoes())
+    assert movs == [(a, 2, "saida", "caixa"), (b, 1, "saida", "caixa")]
+    assert banco.total_rede()[0] == 3
+
+
+def test_lote_e_tudo_ou_nada(banco_vazio):
+    a = banco.inserir_produto("Parafuso", "Ferramentas", 5, 1.0, None)
+    b = banco.inserir_produto("Porca", "Ferramentas", 1, 1.0, None)
+    with pytest.raises(ValueError):
+        banco.registrar_movimentacoes_lote({a: 2, b: 3}, "saida")
+    with pytest.raises(ValueError):
+        banco.registrar_movimentacoes_lote({a: 2, b: 0}, "entrada")
+
+    assert banco.obter_produto(a)["quantidade"] == 5
+    assert banco.obter_produto(b)["quantidade"] == 1
+    assert list(banco.iterar_movimentacoes()) == []
+    assert banco.valoracao_total()[2:] == (0.0, 0.0)
+
+
+def test_lote_de_entradas_com_validade(banco_vazio):
+    a = banco.inserir_produto("Arroz 5kg", "Alimentos", 0, 20.0, None)
+    b = banco.inserir_produto("Feijão 1kg", "Alimentos", 0, 8.0, None)
+    banco.registrar_movimentacoes_lote({a: 4, b: 6}, "entrada", lote="L1", validade="2030-01-31")
+
+    assert [(l[2], l[3], l[4]) for l in banco.listar_lotes(a)] == [("L1", "2030-01-31", 4)]
+    assert [(l[2], l[3], l[4]) for l in banco.listar_lotes(b)] == [("L1", "2030-01-31", 6)]
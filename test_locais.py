@@ -0,0 +1,73 @@
+# test_locais.py
+# Estoque por local: agregados mantidos por trigger e transferências
+import pytest
+
+import banco
+
+
+@pytest.fixture
+def banco_vazio(tmp_path, monkeypatch):
+    monkeypatch.setattr(banco, "DB_PATH", str(tmp_path / "estoque.db"))
+    banco.init_db(criar_admin=False)
+
+
+def _local(nome):
+    if nome != banco.LOCAL_PADRAO:
+        banco.inserir_local(nome)
+    return next(l[0] for l in banco.listar_locais() if l[1] == nome)
+
+
+def _totais():
+    return {t[0]: (t[3], pytest.approx(t[4]), t[5]) for t in banco.totais_por_local()}
+
+
+def test_totais_acompanham_movimentacoes(banco_vazio):
+    deposito, loja = _local(banco.LOCAL_PADRAO), _local("Loja Centro")
+    a = banco.inserir_produto("Parafuso", "Ferramentas", 10, 2.0, None)
+    b = banco.inserir_produto("Porca", "Ferramentas", 5, 3.0, None, local_id=loja)
+    banco.inserir_movimentacao(a, 4, "entrada", local_id=loja)
+    banco.inserir_movimentacao(b, 3, "saida", local_id=loja)
+
+    # depósito: 10 x 2,00; loja: 4 x 2,00 + 2 x 3,00
+    assert _totais() == {deposito: (10, 20.0, 1), loja: (6, 14.0, 2)}
+    assert banco.obter_produto(a)["quantidade"] == 14
+    assert banco.obter_produto(b)["quantidade"] == 2
+    assert banco.total_rede() == (16, pytest.approx(34.0))
+
+    # preço novo revaloriza todos os locais do produto
+    ok, _versao = banco.atualizar_produto(a, banco.obter_produto(a)["versao"], {"preco": 2.5})
+    assert ok
+    assert _totais() == {deposito: (10, 25.0, 1), loja: (6, 16.0, 2)}
+
+    banco.remover_produto(b)
+    assert _totais() == {deposito: (10, 25.0, 1), loja: (4, 10.0, 1)}
+
+    # os triggers chegam ao mesmo resultado que o recálculo completo
+    antes = _totais()
+    banco.recalcular_totais()
+    assert _totais() == antes
+
+
+def test_transferencia(banco_vazio):
+    deposito, loja = _local(banco.LOCAL_PADRAO), _local("Loja Centro")
+    pid = banco.inserir_produto("Parafuso", "Ferramentas", 10, 2.0, None)
+    transf_id = banco.transferir_estoque(pid, 4, deposito, loja, usuario="teste")
+
+    assert {l[0]: l[2] for l in banco.estoque_por_local(pid)} == {deposito: 6, loja: 4}
+    assert banco.obter_produto(pid)["quantidade"] == 10
+    assert _totais() == {deposito: (6, 12.0, 1), loja: (4, 8.0, 1)}
+    movs = [(m[2], m[6], m[9]) for m in banco.iterar_movimentacoes()]
+    assert movs == [("saida", banco.LOCAL_PADRAO, transf_id), ("entrada", "Loja Centro", transf_id)]
+
+
+def test_transferencia_recusada_nao_mexe_no_estoque(banco_vazio):
+    deposito, loja = _local(banco.LOCAL_PADRAO), _local("Loja Centro")
+    pid = banco.inserir_produto("Parafuso", "Ferramentas", 3, 2.0, None)
+    with pytest.raises(ValueError):
+        banco.transferir_estoque(pid, 5, deposito, loja)
+    with pytest.raises(ValueError):
+        banco.transferir_estoque(pid, 1, deposito, deposito)
+
+    assert {l[0]: l[2] for l in banco.estoque_por_local(pid)} == {deposito: 3}
+    assert _totais() == {deposito: (3, 6.0, 1), loja: (0, 0.0, 0)}
+    assert list(banco.iterar_movimentacoes()) == []
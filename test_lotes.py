@@ -0,0 +1,85 @@
+# test_lotes.py
+# Lotes e validade: alocação FEFO nas saídas e consulta de lotes a vencer
+from datetime import date, timedelta
+
+import pytest
+
+import banco
+
+
+@pytest.fixture
+def banco_vazio(tmp_path, monkeypatch):
+    monkeypatch.setattr(banco, "DB_PATH", str(tmp_path / "estoque.db"))
+    banco.init_db(criar_admin=False)
+
+
+def _em(dias):
+    return (date.today() + timedelta(days=dias)).isoformat()
+
+
+def _lotes_da_movimentacao(mov_id):
+    conn = banco.get_conn()
+    rows = conn.execute("""
+        SELECT l.codigo, ml.quantidade FROM movimentacao_lotes ml JOIN lotes l ON l.id = ml.lote_id
+        WHERE ml.movimentacao_id = ? ORDER BY l.validade, l.id
+    """, (mov_id,)).fetchall()
+    conn.close()
+    return rows
+
+
+def test_saida_consome_o_que_vence_primeiro(banco_vazio):
+    pid = banco.inserir_produto("Leite 1L", "Alimentos", 5, 4.0, None, lote="B", validade="2030-03-10")
+    banco.inserir_movimentacao(pid, 3, "entrada", lote="A", validade="2030-02-28")
+    banco.inserir_movimentacao(pid, 4, "entrada", lote="C", validade="2030-03-10")
+    banco.inserir_movimentacao(pid, 9, "saida")
+
+    # A vence antes; B e C vencem juntos e sai primeiro o mais antigo (B)
+    saida_id = max(m[0] for m in banco.iterar_movimentacoes())
+    assert _lotes_da_movimentacao(saida_id) == [("A", 3), ("B", 5), ("C", 1)]
+    assert [(l[2], l[4]) for l in banco.listar_lotes(pid)] == [("C", 3)]
+    assert banco.obter_produto(pid)["quantidade"] == 3
+
+
+def test_estoque_sem_lote_fica_sem_alocacao(banco_vazio):
+    pid = banco.inserir_produto("Leite 1L", "Alimentos", 2, 4.0, None)
+    banco.inserir_movimentacao(pid, 3, "entrada", lote="A", validade="2030-02-28")
+    banco.inserir_movimentacao(pid, 4, "saida")
+
+    saida_id = max(m[0] for m in banco.iterar_movimentacoes())
+    assert _lotes_da_movimentacao(saida_id) == [("A", 3)]
+    assert banco.listar_lotes(pid) == []
+    assert banco.obter_produto(pid)["quantidade"] == 1
+
+
+def test_transferencia_leva_os_lotes(banco_vazio):
+    banco.inserir_local("Loja Centro")
+    origem = next(l[0] for l in banco.listar_locais() if l[1] == banco.LOCAL_PADRAO)
+    destino = next(l[0] for l in banco.listar_locais() if l[1] == "Loja Centro")
+    pid = banco.inserir_produto("Leite 1L", "Alimentos", 4, 4.0, None, lote="A", validade="2030-02-28")
+    banco.inserir_movimentacao(pid, 4, "entrada", lote="B", validade="2030-03-10")
+    banco.transferir_estoque(pid, 6, origem, destino)
+
+    assert [(l[2], l[4]) for l in banco.listar_lotes(pid, origem)] == [("B", 2)]
+    assert [(l[2], l[3], l[4]) for l in banco.listar_lotes(pid, destino)] == [
+        ("A", "2030-02-28", 4), ("B", "2030-03-10", 2)]
+
+
+def test_lotes_a_vencer(banco_vazio):
+    pid = banco.inserir_produto("Iogurte", "Alimentos", 1, 3.0, None, lote="vencido", validade=_em(-2))
+    for codigo, dias in (("hoje", 0), ("semana", 5), ("longe", 40), ("zerado", 1)):
+        banco.inserir_movimentacao(pid, 1, "entrada", lote=codigo, validade=_em(dias))
+    # o lote "vencido" sai por FEFO e fica sem saldo; o mesmo para "zerado"
+    banco.inserir_movimentacao(pid, 1, "saida")
+    conn = banco.get_conn()
+    conn.execute("UPDATE lotes SET quantidade = 0 WHERE codigo = 'zerado'")
+    conn.commit()
+    conn.close()
+    banco.inserir_movimentacao(pid, 1, "entrada", lote="vencido", validade=_em(-2))
+
+    def codigos(*args, **kwargs):
+        return [(l[4], l[7]) for l in banco.lotes_a_vencer(*args, **kwargs)]
+
+    assert codigos(30) == [("vencido", -2), ("hoje", 0), ("semana", 5)]
+    assert codigos(30, incluir_vencidos=False) == [("hoje", 0), ("semana", 5)]
+    assert codigos(0, incluir_vencidos=False) == [("hoje", 0)]
+    assert codigos(40) == [("vencido", -2), ("hoje", 0), ("semana", 5), ("longe", 40)]
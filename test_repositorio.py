@@ -0,0 +1,90 @@
+# test_repositorio.py
+# O mesmo comportamento nos dois repositórios. O PostgreSQL só roda com
+# ESTOQUE_TESTE_PG_URL apontando para um banco descartável (é apagado).
+import os
+import re
+
+import pytest
+
+import banco
+import repositorio
+
+PG_URL = os.environ.get("ESTOQUE_TESTE_PG_URL")
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def repo(request, tmp_path, monkeypatch):
+    if request.param == "sqlite":
+        monkeypatch.setattr(banco, "DB_PATH", banco.DB_PATH)
+        r = repositorio.abrir(str(tmp_path / "estoque.db"))
+    else:
+        if not PG_URL:
+            pytest.skip("defina ESTOQUE_TESTE_PG_URL para testar o PostgreSQL")
+        r = repositorio.abrir(PG_URL)
+        r.inicializar(criar_admin=False)
+        r.limpar()
+    r.inicializar(criar_admin=False)
+    yield r
+    r.fechar()
+
+
+def _local(repo, nome):
+    repo.inserir_local(nome)
+    return next(l[0] for l in repo.listar_locais() if l[1] == nome)
+
+
+def test_transferencia_e_totais(repo):
+    deposito = repo.listar_locais()[0][0]
+    loja = _local(repo, "Loja Centro")
+    pid = repo.inserir_produto("Parafuso", "Ferramentas", 10, 2.0, None)
+    repo.transferir_estoque(pid, 4, deposito, loja, usuario="teste")
+
+    assert {l[0]: l[2] for l in repo.estoque_por_local(pid)} == {deposito: 6, loja: 4}
+    assert repo.obter_produto(pid)["quantidade"] == 10
+    totais = {t[0]: (t[3], t[4], t[5]) for t in repo.totais_por_local()}
+    assert totais[deposito] == (6, pytest.approx(12.0), 1)
+    assert totais[loja] == (4, pytest.approx(8.0), 1)
+    qtd, valor = repo.total_rede()
+    assert (qtd, valor) == (10, pytest.approx(20.0))
+
+
+def test_saida_maior_que_o_saldo(repo):
+    pid = repo.inserir_produto("Parafuso", "Ferramentas", 3, 2.0, None)
+    with pytest.raises(ValueError):
+        repo.inserir_movimentacao(pid, 5, "saida")
+    assert repo.obter_produto(pid)["quantidade"] == 3
+    assert repo.total_rede()[0] == 3
+
+
+def test_lote_de_leituras_e_tudo_ou_nada(repo):
+    a = repo.inserir_produto("Parafuso", "Ferramentas", 5, 1.0, None)
+    b = repo.inserir_produto("Porca", "Ferramentas", 1, 1.0, None)
+    with pytest.raises(ValueError):
+        repo.registrar_movimentacoes_lote({a: 2, b: 3}, "saida")
+    assert repo.obter_produto(a)["quantidade"] == 5
+    repo.registrar_movimentacoes_lote({a: 2, b: 1}, "saida")
+    assert (repo.obter_produto(a)["quantidade"], repo.obter_produto(b)["quantidade"]) == (3, 0)
+
+
+def test_edicao_com_versao_antiga(repo):
+    pid = repo.inserir_produto("Parafuso", "Ferramentas", 1, 2.0, None)
+    versao = repo.obter_produto(pid)["versao"]
+    assert repo.atualizar_produto(pid, versao, {"preco": 3.0}) == (True, versao + 1)
+    ok, mensagem = repo.atualizar_produto(pid, versao, {"preco": 4.0})
+    assert not ok and mensagem
+    assert repo.obter_produto(pid)["preco"] == 3.0
+
+
+def test_codigo_de_barras_repetido(repo):
+    repo.inserir_produto("Parafuso", "Ferramentas", 0, 1.0, None, codigo_barras="789")
+    with pytest.raises(repositorio.ErroIntegridade):
+        repo.inserir_produto("Porca", "Ferramentas", 0, 1.0, None, codigo_barras="789")
+
+
+def test_datas_das_movimentacoes_em_texto(repo):
+    pid = repo.inserir_produto("Parafuso", "Ferramentas", 0, 1.0, None)
+    repo.inserir_movimentacao(pid, 2, "entrada", usuario="teste")
+    formato = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$")
+    historico = list(repo.iterar_movimentacoes())
+    assert len(historico) == 1 and formato.match(historico[0][1])
+    assert formato.match(repo.listar_movimentacoes()[0][6])